@@ -0,0 +1,245 @@
+"""
+apiKeyPool.py
+@biref Provides a process-wide pool of Gemini API keys with shared clients and rate-aware key selection.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+
+from google import genai
+
+import config
+import logger
+
+
+class ApiKeyState:
+    """
+    Usage and health of one API key.
+
+    Attributes:
+        key (str): The API key.
+        client (genai.Client): Long-lived client of the key.
+        requests (collections.deque[float]): Times of the requests within the last minute.
+        tokens (collections.deque[tuple[float, int]]): Times and token counts of the requests within the last minute.
+        reservations (collections.deque[tuple[float, int]]): Times and estimated token counts of the requests which
+            were acquired but not recorded yet.
+        failures (int): Consecutive rate limit errors.
+        cooldownUntil (float): Time until which the key is not used.
+    """
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.client = genai.Client(api_key=key)
+        self.requests: collections.deque[float] = collections.deque()
+        self.tokens: collections.deque[tuple[float, int]] = collections.deque()
+        self.reservations: collections.deque[tuple[float, int]] = collections.deque()
+        self.failures = 0
+        self.cooldownUntil = 0.0
+
+    def expire(self, now: float) -> None:
+        while self.requests and self.requests[0] <= now - 60:
+            self.requests.popleft()
+        while self.tokens and self.tokens[0][0] <= now - 60:
+            self.tokens.popleft()
+        # requests which were never recorded, e.g. abandoned streams, stop counting after a minute too
+        while self.reservations and self.reservations[0][0] <= now - 60:
+            self.reservations.popleft()
+
+    def load(self, now: float) -> float:
+        self.expire(now)
+        return max((len(self.requests) + len(self.reservations)) / config.API_KEY_RPM_LIMIT,
+                   (sum(i[1] for i in self.tokens) + sum(i[1] for i in self.reservations)) / config.API_KEY_TPM_LIMIT)
+
+    def availableAt(self, now: float) -> float:
+        # the time at which the key is out of its cooldown and below its limits again
+        at = max(now, self.cooldownUntil)
+        if self.load(now) >= 1:
+            # requests and tokens are recorded together, the oldest request is the first to expire
+            oldest = [i for i in (self.requests[0] if self.requests else None,
+                                  self.reservations[0][0] if self.reservations else None) if i is not None]
+            at = max(at, min(oldest) + 60)
+        return at
+
+
+class ApiKeyPool:
+    """
+    A pool of API keys with one long-lived client per key.
+
+    Usage of every key is tracked per minute against config.API_KEY_RPM_LIMIT and config.API_KEY_TPM_LIMIT.
+    acquire picks the least loaded key which is not cooling down after a rate limit error, and waits
+    if every key is exhausted. It reserves the request and its estimated tokens on the key until record
+    or release settles them, so concurrent sessions see each other's requests in flight and spread over the keys.
+
+    Args:
+        keys (list[str]): The API keys.
+
+    Methods:
+        acquire(tokens): Get the key to send the next request with and reserve the request on it.
+        acquireAsync(tokens): Get the key to send the next request with, without blocking the event loop.
+        client(key): Get the client of a key.
+        record(key, tokens): Record a request sent with a key, settling its reservation.
+        release(key): Drop the reservation of a request which was not sent or failed.
+        penalize(key): Put a key into cooldown after a rate limit error.
+        stats(): Get the usage of the keys.
+    """
+
+    def __init__(self, keys: list[str]) -> None:
+        self.keys = {i: ApiKeyState(i) for i in keys}
+        self.lock = threading.Lock()
+
+    def select(self, tokens: int) -> tuple[str, float]:
+        # the best key and how long to wait for it, reserved on the key if no waiting is needed
+        with self.lock:
+            now = time.time()
+            best = min(self.keys.values(), key=lambda i: (i.availableAt(now), i.load(now)))
+            wait = best.availableAt(now) - now
+            if wait <= 0:
+                best.reservations.append((now, tokens))
+            return best.key, wait
+
+    def acquire(self, tokens: int = 0) -> str:
+        """
+        Get the key to send the next request with, waiting until one is available.
+        The request is reserved on the key until it is settled with record or release.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the request. Defaults to 0.
+
+        Returns:
+            str: The least loaded available key.
+        """
+        while True:
+            key, wait = self.select(tokens)
+            if wait <= 0:
+                return key
+            logger.Logger.log(f'{__name__}: All API keys are exhausted, waiting {wait:.1f}s')
+            time.sleep(min(wait, config.API_KEY_COOLDOWN))
+
+    async def acquireAsync(self, tokens: int = 0) -> str:
+        """
+        Get the key to send the next request with, waiting on the event loop until one is available.
+        The request is reserved on the key until it is settled with record or release.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the request. Defaults to 0.
+
+        Returns:
+            str: The least loaded available key.
+        """
+        while True:
+            key, wait = self.select(tokens)
+            if wait <= 0:
+                return key
+            logger.Logger.log(f'{__name__}: All API keys are exhausted, waiting {wait:.1f}s')
+            await asyncio.sleep(min(wait, config.API_KEY_COOLDOWN))
+
+    def client(self, key: str) -> genai.Client:
+        """
+        Get the client of a key.
+
+        Args:
+            key (str): The API key.
+
+        Returns:
+            genai.Client: The client.
+        """
+        return self.keys[key].client
+
+    def record(self, key: str, tokens: int = 0) -> None:
+        """
+        Record a request sent with a key, replacing its reservation with the actual usage.
+
+        Args:
+            key (str): The API key.
+            tokens (int, optional): Tokens used by the request. Defaults to 0.
+        """
+        with self.lock:
+            state = self.keys[key]
+            now = time.time()
+            # reservations of a key only differ in their estimates, settling the oldest one is good enough
+            if state.reservations:
+                state.reservations.popleft()
+            state.requests.append(now)
+            state.tokens.append((now, tokens))
+            state.failures = 0
+
+    def release(self, key: str) -> None:
+        """
+        Drop the reservation of a request which was not sent or failed without usage.
+
+        Args:
+            key (str): The API key.
+        """
+        with self.lock:
+            state = self.keys[key]
+            if state.reservations:
+                state.reservations.popleft()
+
+    def penalize(self, key: str) -> None:
+        """
+        Put a key into cooldown after a rate limit error. The cooldown doubles with every consecutive error.
+
+        Args:
+            key (str): The API key.
+        """
+        with self.lock:
+            state = self.keys[key]
+            state.cooldownUntil = time.time() + config.API_KEY_COOLDOWN * 2 ** min(state.failures, 5)
+            state.failures += 1
+
+    def stats(self) -> list[dict[str, int | float]]:
+        """
+        Get the usage of the keys.
+
+        Returns:
+            list[dict[str, int | float]]: Requests and tokens within the last minute, requests in flight, consecutive
+            failures and remaining cooldown of every key, in pool order.
+        """
+        with self.lock:
+            now = time.time()
+            result = []
+            for i in self.keys.values():
+                i.expire(now)
+                result.append({
+                    'requests': len(i.requests),
+                    'tokens': sum(j[1] for j in i.tokens),
+                    'inflight': len(i.reservations),
+                    'failures': i.failures,
+                    'cooldown': max(0, i.cooldownUntil - now),
+                })
+            return result
+
+
+pools: dict[tuple[str, ...], ApiKeyPool] = {}
+poolsLock = threading.Lock()
+
+
+def getPool(keys: list[str]) -> ApiKeyPool:
+    """
+    Get the process-wide pool of a set of API keys, creating it on first use.
+
+    Args:
+        keys (list[str]): The API keys.
+
+    Returns:
+        ApiKeyPool: The pool shared by every model using these keys.
+    """
+    with poolsLock:
+        if tuple(keys) not in pools:
+            pools[tuple(keys)] = ApiKeyPool(keys)
+        return pools[tuple(keys)]
+
+
+def getClient(key: str) -> genai.Client:
+    """
+    Get the shared client of a single API key.
+
+    Args:
+        key (str): The API key.
+
+    Returns:
+        genai.Client: The client.
+    """
+    return getPool([key]).client(key)
@@ -0,0 +1,13 @@
+-- secondary indexes for the hot access paths
+
+-- fetchChatHistory / fetchLatestChatHistory
+create index if not exists idx_chatHistory_charName_timestamp on chatHistory (charName, timestamp);
+
+-- getSticker / getStickerList
+create index if not exists idx_stickers_setId_name on stickers (setId, name);
+
+-- getReferenceAudioByName / getAvailableTTSReferenceAudio
+create index if not exists idx_GPTSoVitsReferenceAudios_serviceId_name on GPTSoVitsReferenceAudios (serviceId, name);
+
+-- getCharacterId / getCharacterTHA4Service
+create index if not exists idx_personalCharacter_charName on personalCharacter (charName);
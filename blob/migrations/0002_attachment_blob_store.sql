@@ -0,0 +1,5 @@
+-- attachment contents are moved into the content-addressed blob store,
+-- `blobMsg` is kept for rows which have not been migrated yet
+
+alter table attachments add column blobHash string default NULL;
+alter table attachments add column size integer default NULL;
@@ -0,0 +1,24 @@
+-- full-text search over chat history and character memories
+-- trigram tokenizer matches substrings, which also works for text without spaces between words (e.g. Chinese)
+
+create virtual table chatHistoryFts using fts5(text, content='chatHistory', content_rowid='id', tokenize='trigram');
+
+create trigger chatHistoryFts_ai after insert on chatHistory begin
+    insert into chatHistoryFts (rowid, text) values (new.id, new.text);
+end;
+
+create trigger chatHistoryFts_ad after delete on chatHistory begin
+    insert into chatHistoryFts (chatHistoryFts, rowid, text) values ('delete', old.id, old.text);
+end;
+
+create trigger chatHistoryFts_au after update of text on chatHistory begin
+    insert into chatHistoryFts (chatHistoryFts, rowid, text) values ('delete', old.id, old.text);
+    insert into chatHistoryFts (rowid, text) values (new.id, new.text);
+end;
+
+insert into chatHistoryFts (chatHistoryFts) values ('rebuild');
+
+-- one row per stored memory, appended by Memory.storeMemory
+create virtual table pastMemoriesFts using fts5(charId unindexed, timestamp unindexed, text, tokenize='trigram');
+
+insert into pastMemoriesFts (charId, timestamp, text) select id, 0, pastMemories from personalCharacter;
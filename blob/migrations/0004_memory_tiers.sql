@@ -0,0 +1,12 @@
+-- stored memories are consolidated in tiers: 0 raw entries, 1 daily rollups, 2 long-term rollups
+-- fts5 tables can not be altered, so the table is recreated with the new column
+
+create virtual table pastMemoriesFtsTiered using fts5(charId unindexed, timestamp unindexed, tier unindexed, text, tokenize='trigram');
+
+-- memories written before this migration (the backfilled pastMemories) become long-term memories
+insert into pastMemoriesFtsTiered (rowid, charId, timestamp, tier, text)
+    select rowid, charId, timestamp, case when timestamp = 0 then 2 else 0 end, text from pastMemoriesFts;
+
+drop table pastMemoriesFts;
+
+alter table pastMemoriesFtsTiered rename to pastMemoriesFts;
@@ -0,0 +1,3 @@
+-- keywords and emojis of every sticker, a json list used by stickerMapper to map emojis to stickers
+
+alter table stickers add column keywords string not null default '[]';
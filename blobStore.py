@@ -0,0 +1,151 @@
+"""
+blobStore.py
+@biref Provides a content-addressed file store for binary attachments.
+"""
+
+import hashlib
+import os
+import typing
+import uuid
+
+
+class BlobStore:
+    """
+    A content-addressed file store which keeps blobs on disk keyed by their SHA-256 digest.
+
+    Blobs are stored under `<root>/<first two hex digits>/<digest>`. Writing the same content
+    twice only stores it once.
+
+    Args:
+        root (str): Directory to store the blobs in.
+
+    Methods:
+        put(data): Store a blob and return its digest.
+        open(digest): Open a stored blob for streaming reads.
+        read(digest): Read a stored blob into memory.
+        path(digest): Get the file path of a stored blob.
+        size(digest): Get the size of a stored blob.
+        exists(digest): Check whether a blob is stored.
+        delete(digest): Remove a stored blob.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        """
+        Compute the digest used as the key of a blob.
+
+        Args:
+            data (bytes): Content of the blob.
+
+        Returns:
+            str: Hex encoded SHA-256 digest.
+        """
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, digest: str) -> str:
+        """
+        Get the file path of a blob.
+
+        Args:
+            digest (str): Digest of the blob.
+
+        Raises:
+            ValueError: If the digest is malformed.
+
+        Returns:
+            str: Path of the blob file.
+        """
+        if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+            raise ValueError(f'{__name__}: Invalid blob digest {digest}')
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        """
+        Check whether a blob is stored.
+
+        Args:
+            digest (str): Digest of the blob.
+
+        Returns:
+            bool: True if the blob exists, False otherwise.
+        """
+        return os.path.isfile(self.path(digest))
+
+    def put(self, data: bytes) -> str:
+        """
+        Store a blob. The blob is written to a temporary file first and then moved into place,
+        so readers never observe a partially written blob.
+
+        Args:
+            data (bytes): Content of the blob.
+
+        Returns:
+            str: Digest of the stored blob.
+        """
+        digest = self.digest(data)
+        dest = self.path(digest)
+        if os.path.isfile(dest):
+            return digest
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        temp = f'{dest}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp, 'wb') as file:
+                file.write(data)
+            os.replace(temp, dest)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        return digest
+
+    def open(self, digest: str) -> typing.BinaryIO:
+        """
+        Open a blob for streaming reads. The caller is responsible for closing the file.
+
+        Args:
+            digest (str): Digest of the blob.
+
+        Returns:
+            typing.BinaryIO: File object of the blob.
+        """
+        return open(self.path(digest), 'rb')
+
+    def read(self, digest: str) -> bytes:
+        """
+        Read a blob into memory.
+
+        Args:
+            digest (str): Digest of the blob.
+
+        Returns:
+            bytes: Content of the blob.
+        """
+        with self.open(digest) as file:
+            return file.read()
+
+    def size(self, digest: str) -> int:
+        """
+        Get the size of a blob.
+
+        Args:
+            digest (str): Digest of the blob.
+
+        Returns:
+            int: Size of the blob in bytes.
+        """
+        return os.path.getsize(self.path(digest))
+
+    def delete(self, digest: str) -> None:
+        """
+        Remove a blob from the store. Missing blobs are ignored.
+
+        Args:
+            digest (str): Digest of the blob.
+        """
+        p = self.path(digest)
+        if os.path.isfile(p):
+            os.remove(p)
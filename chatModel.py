@@ -1,3 +1,4 @@
+import asyncio
 import mimetypes
 import os
 import time
@@ -12,7 +13,14 @@ from google.genai import types  # New import for type definitions
 import google.genai.errors
 import httpx
 
+import apiKeyPool
+import config
 import logger  # Assuming this is a custom logger
+import remoteFileCache
+import tokenCounter
+
+# errors of a request which are retried: rate limits and other client errors, overloaded servers, connection failures
+RETRIED_ERRORS = (google.genai.errors.ClientError, google.genai.errors.ServerError, httpx.ConnectError)
 
 def Message(role: str, content: str, content_type: str) -> dict[str, str]:
     return {
@@ -41,25 +49,25 @@ class ChatGoogleGenerativeAI():
         system_prompt (str): The system prompt to use for the chat.
         tools (list[typing.Any]): Tools to use for the chat.
         chat_session (genai.ChatSession | None): The active chat session.
+        context_token_budget (int | None): Prompt tokens above which the oldest turns are evicted, None to keep the whole history.
+        prompt_token_count (int): Prompt tokens of the last response.
     """
 
-    def __init__(self, model: str, with_thinking: bool = False, thinking_budget: int = 8192, temperature: float = 0.9, safety_settings: Any = None, system_prompt: str | None = None, tools: list[typing.Any] = [], api_key: str = None, api_key_pool: list[str] = []) -> None:
+    def __init__(self, model: str, with_thinking: bool = False, thinking_budget: int = 8192, temperature: float = 0.9, safety_settings: Any = None, system_prompt: str | None = None, tools: list[typing.Any] = [], api_key: str = None, api_key_pool: list[str] = [], context_token_budget: int | None = config.CHAT_CONTEXT_TOKEN_BUDGET) -> None:
+        # clients are shared by all models, see apiKeyPool
         if api_key:
-            self.client = genai.Client(api_key=api_key)
+            self.client = apiKeyPool.getClient(api_key)
             self.api_key_mode = "single"
-        elif api_key_pool:
-            self.api_key_mode = "pool"
-            self.api_key_pool = api_key_pool
-            self.api_key_current = 0
-            self.client = genai.Client(api_key=self.api_key_pool[self.api_key_current])
-        elif os.environ.get('GOOGLE_API_KEY_POOL'):
+        elif api_key_pool or os.environ.get('GOOGLE_API_KEY_POOL'):
             self.api_key_mode = "pool"
-            self.api_key_pool = os.environ['GOOGLE_API_KEY_POOL'].split(';')
-            self.api_key_current = 0
-            self.client = genai.Client(api_key=self.api_key_pool[self.api_key_current])
+            self.api_key_pool = apiKeyPool.getPool(
+                api_key_pool or os.environ['GOOGLE_API_KEY_POOL'].split(';'))
+            self.api_key_current = None
+            self.client = None
+            self.acquire_initial_key()
         elif os.environ.get('GOOGLE_API_KEY'):
             # use default API key
-            self.client = genai.Client(api_key=os.environ['GOOGLE_API_KEY'])
+            self.client = apiKeyPool.getClient(os.environ['GOOGLE_API_KEY'])
             self.api_key_mode = "single"
 
         self.model_name = model
@@ -72,7 +80,15 @@ class ChatGoogleGenerativeAI():
         self.token_count = 0
         self.thinking_budget = thinking_budget
         self.saved_chat_history = []
+        self.context_token_budget = context_token_budget
+        self.prompt_token_count = 0
+        self.initiate_chat_config = None
         
+    def acquire_initial_key(self) -> None:
+        # the reservation is settled by the first request, see apiKeyPool
+        self.api_key_current = self.api_key_pool.acquire()
+        self.client = self.api_key_pool.client(self.api_key_current)
+
     def getApiKey(self):
         return self.client._api_client.api_key
         
@@ -80,32 +96,30 @@ class ChatGoogleGenerativeAI():
         # convert the pool mode to single mode
         if self.api_key_mode == "pool":
             self.api_key_mode = "single"
-            if apiKey is not None:
-                self.client = genai.Client(api_key=apiKey)
+            if apiKey is not None and apiKey != self.api_key_current:
+                self.client = self.api_key_pool.client(apiKey) if apiKey in self.api_key_pool.keys else apiKeyPool.getClient(apiKey)
+                self.rebuild_session()
         
     def getClient(self) -> genai.Client:
         return self.client
         
-    def switch_api_key(self) -> None:
-        if self.api_key_mode == "single":
-            # raise ValueError(f'{__name__}: API key mode is set to single. Cannot switch API key.')
-            # ignore the behaviour
-            logger.Logger.log(f'{__name__}: API key mode is set to single. Cannot switch API key.')
-            return
-        
-        self.api_key_current = (self.api_key_current + 1) % len(self.api_key_pool)
-        self.client = genai.Client(api_key=self.api_key_pool[self.api_key_current])
-        logger.Logger.log(f'{__name__}: Switched to API key {self.api_key_pool[self.api_key_current]}')
-        # re-initiate the chat session
-        self.chat_session = self.client.chats.create(
-            model=self.model_name,
-            config=self.initiate_chat_config,
-            history=self.chat_session.get_history() if self.chat_session is not None else None
-        )
+    def rebuild_session(self) -> None:
+        # move the chat session to the current client, this is local and sends no request
+        if self.chat_session is not None:
+            self.chat_session = self.create_session(self.chat_session.get_history())
 
-    def initiate(self, begin_msg: list[dict[str, str]], streamed: bool = False) -> str | types.GenerateContentResponse | typing.Iterator[types.GenerateContentResponse]:
-        if self.chat_session is None:
-            chat_config = types.GenerateContentConfig(
+    def prepare_files(self, msg: typing.Any) -> typing.Any:
+        # uploaded files belong to the key which uploaded them, point the history and the message at the current key
+        if self.chat_session is not None:
+            history = self.chat_session.get_history()
+            localized = remoteFileCache.cache.localize(self.client, self.getApiKey(), history)
+            if localized is not history:
+                self.chat_session = self.create_session(localized)
+        return remoteFileCache.cache.localize(self.client, self.getApiKey(), msg)
+
+    def get_chat_config(self) -> types.GenerateContentConfig:
+        if self.initiate_chat_config is None:
+            self.initiate_chat_config = types.GenerateContentConfig(
                 temperature=self.temperature,
                 safety_settings=self.safety_settings,
                 tools=self.tools,
@@ -114,21 +128,89 @@ class ChatGoogleGenerativeAI():
                     include_thoughts=self.with_thinking,
                     thinking_budget=self.thinking_budget) if self.with_thinking else None
             )
-            self.initiate_chat_config = chat_config
+        return self.initiate_chat_config
 
-            self.chat_session = self.client.chats.create(
-                model=self.model_name,
-                config=chat_config
-            )
+    def create_session(self, history: list[types.Content] | None = None) -> typing.Any:
+        return self.client.chats.create(
+            model=self.model_name,
+            config=self.get_chat_config(),
+            history=history
+        )
+
+    @staticmethod
+    def backoff_delay(attempt: int) -> float:
+        # exponential backoff with full jitter
+        return random.uniform(0, min(config.CHAT_RETRY_MAX_DELAY, config.CHAT_RETRY_BASE_DELAY * 2 ** attempt))
+
+    def switch_api_key(self) -> None:
+        if self.api_key_mode == "single":
+            # raise ValueError(f'{__name__}: API key mode is set to single. Cannot switch API key.')
+            # ignore the behaviour
+            logger.Logger.log(f'{__name__}: API key mode is set to single. Cannot switch API key.')
+            return
+        
+        # the last prompt is the best estimate of the next one, the history only grows
+        key = self.api_key_pool.acquire(self.prompt_token_count)
+        if key == self.api_key_current:
+            return
+        self.api_key_current = key
+        self.client = self.api_key_pool.client(key)
+        logger.Logger.log(f'{__name__}: Switched to API key {key[:8]}...')
+        self.rebuild_session()
+
+    def record_usage(self, resp: types.GenerateContentResponse | None = None) -> None:
+        if self.api_key_mode == "pool":
+            tokens = (resp.usage_metadata.total_token_count or 0) if resp is not None else 0
+            self.api_key_pool.record(self.api_key_current, tokens)
 
+    def record_stream_usage(self, usage: types.GenerateContentResponseUsageMetadata | None) -> None:
+        # chunks report the usage so far, the last one holds the usage of the whole response
+        if usage is not None:
+            self.token_count += usage.total_token_count or 0
+            self.prompt_token_count = usage.prompt_token_count or 0
+        if self.api_key_mode == "pool":
+            self.api_key_pool.record(self.api_key_current, (usage.total_token_count or 0) if usage is not None else 0)
+
+    def handle_request_error(self, e: Exception) -> None:
+        # the failed request no longer holds its key, rate limited keys cool down
+        logger.Logger.log(f'{__name__}: {e}')
+        if self.api_key_mode == "pool":
+            self.api_key_pool.release(self.api_key_current)
+            if getattr(e, 'code', None) == 429:
+                self.api_key_pool.penalize(self.api_key_current)
+
+    def open_stream(self, msg: typing.Any) -> typing.Iterator[types.GenerateContentResponse]:
+        # errors of the request surface with the first chunk, it is fetched before anything is yielded so the caller can retry
+        chunks = iter(self.chat_session.send_message_stream(msg))
+        first = next(chunks, None)
+        return self.track_stream(first, chunks)
+
+    def track_stream(self, first: types.GenerateContentResponse | None, chunks: typing.Iterator[types.GenerateContentResponse]) -> typing.Iterator[types.GenerateContentResponse]:
+        usage = None
+        chunk = first
+        try:
+            while chunk is not None:
+                usage = chunk.usage_metadata or usage
+                yield chunk
+                chunk = next(chunks, None)
+        finally:
+            # also settles the key reservation of a stream which failed or was abandoned
+            self.record_stream_usage(usage)
+
+    def initiate(self, begin_msg: list[dict[str, str]], streamed: bool = False) -> str | types.GenerateContentResponse | typing.Iterator[types.GenerateContentResponse]:
+        if self.chat_session is None:
+            self.chat_session = self.create_session()
+        begin_msg = self.prepare_files(begin_msg)
 
         if not streamed:
             resp = self.chat_session.send_message(begin_msg)
+            self.record_usage(resp)
             self.token_count = resp.usage_metadata.total_token_count
+            self.prompt_token_count = resp.usage_metadata.prompt_token_count or 0
             return resp.text
         else:
             # Use send_message_stream for streaming
-            return self.chat_session.send_message_stream(begin_msg)
+            return self.open_stream(begin_msg)
 
     def chat(self, user_msg: list[dict[str, str]], streamed: bool = False, retryAttempts: int = 10) -> str | typing.Iterator[types.GenerateContentResponse]:
         if self.chat_session is None:
@@ -138,26 +220,232 @@ class ChatGoogleGenerativeAI():
         current_attempt = 0
         while current_attempt <= retryAttempts:
             try:
+                self.compact_history()
                 if self.api_key_mode == "pool":
                     self.switch_api_key()
+                msg = self.prepare_files(user_msg)
                     
                 # chat with user message
                 if not streamed:
-                    resp = self.chat_session.send_message(user_msg)
+                    resp = self.chat_session.send_message(msg)
+                    self.record_usage(resp)
                     self.token_count += resp.usage_metadata.total_token_count
+                    self.prompt_token_count = resp.usage_metadata.prompt_token_count or 0
                     if resp.usage_metadata.total_token_count > 250000:
                         logger.Logger.log(f'{__name__}: Token count exceeded. Trying lower the frequency of messages by sleeping.')
                         time.sleep(random.randint(5,30))
                     return resp.text
                 else:
-                    return self.chat_session.send_message_stream(user_msg)
-            except (google.genai.errors.ClientError, httpx.ConnectError) as e:
-                logger.Logger.log(f'{__name__}: {e}')
+                    return self.open_stream(msg)
+            except RETRIED_ERRORS as e:
+                self.handle_request_error(e)
                 current_attempt += 1
                 if current_attempt > retryAttempts:
                     logger.Logger.log(f'{__name__}: Maximum number of attempts reached. Giving up.')
-                time.sleep(random.randint(5,30))
+                else:
+                    time.sleep(self.backoff_delay(current_attempt))
 
 
     def count_tokens(self) -> int:
-        return self.token_count
\ No newline at end of file
+        return self.token_count
+
+    @staticmethod
+    def estimate_content_tokens(content: types.Content) -> int:
+        tokens = 0
+        for part in content.parts or []:
+            if part.text:
+                tokens += tokenCounter.counter.count(part.text)
+            elif part.inline_data or part.file_data:
+                tokens += config.CHAT_CONTEXT_ATTACHMENT_TOKENS
+        return tokens
+
+    @staticmethod
+    def strip_attachments(content: types.Content) -> tuple[types.Content, bool]:
+        parts = []
+        changed = False
+        for part in content.parts or []:
+            if part.thought:
+                changed = True
+                continue
+            data = part.inline_data or part.file_data
+            if data is not None:
+                parts.append(types.Part(text=f'[{data.mime_type or "file"} attachment omitted]'))
+                changed = True
+            else:
+                parts.append(part)
+        return (types.Content(role=content.role, parts=parts), True) if changed else (content, False)
+
+    def compact_history(self) -> None:
+        """
+        Keeps the chat history within the context token budget.
+
+        Attachments and thoughts of all but the latest config.CHAT_CONTEXT_ATTACHMENT_TURNS turns are replaced
+        with text placeholders. When the last prompt exceeded `context_token_budget`, the oldest turns are
+        evicted until the estimated prompt size drops to config.CHAT_CONTEXT_TARGET_RATIO of the budget,
+        so the history is not rebuilt again on the next turns.
+        The chat session is only recreated locally, no request is sent.
+        """
+        if self.chat_session is None or self.context_token_budget is None:
+            return
+
+        # a turn starts with a user message, function responses belong to the turn which called them
+        turns: list[list[types.Content]] = []
+        for content in self.chat_session.get_history():
+            is_function_response = any(i.function_response for i in content.parts or [])
+            if not turns or (content.role == 'user' and not is_function_response):
+                turns.append([])
+            turns[-1].append(content)
+
+        changed = False
+        for turn in turns[:-config.CHAT_CONTEXT_ATTACHMENT_TURNS or None]:
+            for idx, content in enumerate(turn):
+                turn[idx], stripped = self.strip_attachments(content)
+                changed = changed or stripped
+
+        if self.prompt_token_count > self.context_token_budget:
+            excess = self.prompt_token_count - int(self.context_token_budget * config.CHAT_CONTEXT_TARGET_RATIO)
+            while excess > 0 and len(turns) > 1:
+                excess -= sum(self.estimate_content_tokens(i) for i in turns.pop(0))
+                changed = True
+            logger.Logger.log(f'{__name__}: Prompt of {self.prompt_token_count} tokens exceeded the context budget, {len(turns)} turns kept.')
+            self.prompt_token_count = 0
+
+        if changed:
+            self.chat_session = self.create_session(
+                [content for turn in turns for content in turn])
+
+
+class AsyncChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
+    """
+    The asyncio counterpart of ChatGoogleGenerativeAI, built on the aio client of google-genai.
+
+    It shares the configuration, key pool and context window handling of ChatGoogleGenerativeAI, but
+    `initiate`, `chat` and `stream` are coroutines, so one event loop can drive many sessions.
+    Every call accepts a `deadline` in time.monotonic() seconds which bounds the requests, retries and
+    backoff delays together, and raises TimeoutError once it passes. Cancelling the awaiting task
+    cancels the request in flight.
+
+    The constructor never blocks: with a key pool, the key is acquired on the event loop by `create`
+    or by the first request.
+    """
+
+    @classmethod
+    async def create(cls, *args: typing.Any, **kwargs: typing.Any) -> 'AsyncChatGoogleGenerativeAI':
+        """
+        Create a model and acquire the key of its first request without blocking the event loop.
+
+        Args:
+            *args, **kwargs: The arguments of ChatGoogleGenerativeAI.
+
+        Returns:
+            AsyncChatGoogleGenerativeAI: The model.
+        """
+        model = cls(*args, **kwargs)
+        if model.api_key_mode == "pool":
+            await model.switch_api_key_async()
+        return model
+
+    def acquire_initial_key(self) -> None:
+        # acquired on the event loop instead, see create
+        pass
+
+    def create_session(self, history: list[types.Content] | None = None) -> typing.Any:
+        return self.client.aio.chats.create(
+            model=self.model_name,
+            config=self.get_chat_config(),
+            history=history
+        )
+
+    @staticmethod
+    def remaining(deadline: float | None) -> float | None:
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f'{__name__}: Deadline exceeded')
+        return remaining
+
+    async def switch_api_key_async(self) -> None:
+        key = await self.api_key_pool.acquireAsync(self.prompt_token_count)
+        if key == self.api_key_current:
+            return
+        self.api_key_current = key
+        self.client = self.api_key_pool.client(key)
+        logger.Logger.log(f'{__name__}: Switched to API key {key[:8]}...')
+        self.rebuild_session()
+
+    async def prepare_request(self) -> None:
+        # the first request uses the key acquired by create, later ones pick the least loaded key
+        if self.chat_session is not None:
+            self.compact_history()
+        if self.api_key_mode == "pool" and (self.chat_session is not None or self.client is None):
+            await self.switch_api_key_async()
+        if self.chat_session is None:
+            self.chat_session = self.create_session()
+
+    async def retry_delay(self, e: Exception, attempt: int, retryAttempts: int, deadline: float | None) -> None:
+        # handles a failed request and waits before the next attempt, raises if there is none
+        self.handle_request_error(e)
+        if attempt > retryAttempts:
+            logger.Logger.log(f'{__name__}: Maximum number of attempts reached. Giving up.')
+            raise e
+        delay = self.backoff_delay(attempt)
+        remaining = self.remaining(deadline)
+        if remaining is not None and delay >= remaining:
+            raise TimeoutError(f'{__name__}: Deadline exceeded') from e
+        await asyncio.sleep(delay)
+
+    async def initiate(self, begin_msg: list[dict[str, str]], deadline: float | None = None) -> str:
+        await self.prepare_request()
+        async with asyncio.timeout(self.remaining(deadline)):
+            begin_msg = await asyncio.to_thread(self.prepare_files, begin_msg)
+            resp = await self.chat_session.send_message(begin_msg)
+        self.record_usage(resp)
+        self.token_count = resp.usage_metadata.total_token_count
+        self.prompt_token_count = resp.usage_metadata.prompt_token_count or 0
+        return resp.text
+
+    async def chat(self, user_msg: list[dict[str, str]], deadline: float | None = None, retryAttempts: int = 10) -> str:
+        if self.chat_session is None:
+            return await self.initiate(user_msg, deadline)
+
+        current_attempt = 0
+        while True:
+            try:
+                await self.prepare_request()
+                async with asyncio.timeout(self.remaining(deadline)):
+                    msg = await asyncio.to_thread(self.prepare_files, user_msg)
+                    resp = await self.chat_session.send_message(msg)
+                self.record_usage(resp)
+                self.token_count += resp.usage_metadata.total_token_count
+                self.prompt_token_count = resp.usage_metadata.prompt_token_count or 0
+                return resp.text
+            except RETRIED_ERRORS as e:
+                current_attempt += 1
+                await self.retry_delay(e, current_attempt, retryAttempts, deadline)
+
+    async def stream(self, user_msg: list[dict[str, str]], deadline: float | None = None, retryAttempts: int = 10) -> typing.AsyncIterator[types.GenerateContentResponse]:
+        current_attempt = 0
+        while True:
+            try:
+                await self.prepare_request()
+                async with asyncio.timeout(self.remaining(deadline)):
+                    msg = await asyncio.to_thread(self.prepare_files, user_msg)
+                    iterator = aiter(await self.chat_session.send_message_stream(msg))
+                    # errors of the request surface with the first chunk, nothing is yielded before it so it can be retried
+                    chunk = await anext(iterator, None)
+                break
+            except RETRIED_ERRORS as e:
+                current_attempt += 1
+                await self.retry_delay(e, current_attempt, retryAttempts, deadline)
+
+        usage = None
+        try:
+            while chunk is not None:
+                usage = chunk.usage_metadata or usage
+                yield chunk
+                async with asyncio.timeout(self.remaining(deadline)):
+                    chunk = await anext(iterator, None)
+        finally:
+            # also settles the key reservation of a stream which failed or was abandoned
+            self.record_stream_usage(usage)
@@ -27,10 +27,177 @@ AUTHENTICATE_METHOD = 'oauth' if USE_MODEL.startswith('tunedModels') else 'apike
 # how many times chatbotManager will retry when receive an invalid response
 MAX_CHAT_RETRY_COUNT = 5
 
-MEMORY_SUMMARIZING_LIMIT = 16386
+# stream replies to the client segment by segment instead of waiting for the complete reply
+CHAT_STREAMING = True
+
+# emojis in replies are mapped to stickers locally, see stickerMapper.py
+# if enabled, replies with emojis no sticker matches are mapped by the model instead
+STICKER_MAPPING_LLM_FALLBACK = False
+
+# per key limits of the GOOGLE_API_KEY_POOL, requests are sent with the least loaded key below its limits
+API_KEY_RPM_LIMIT = 10
+API_KEY_TPM_LIMIT = 250000
+# seconds a key is not used after a rate limit error, doubled for every consecutive error
+API_KEY_COOLDOWN = 30
+
+# failed chat requests are retried after a random delay of up to base * 2^attempt seconds, capped at the max
+CHAT_RETRY_BASE_DELAY = 1.0
+CHAT_RETRY_MAX_DELAY = 30.0
+
+# prompt tokens of a chat session above which the oldest turns are evicted from its history, None to keep everything
+CHAT_CONTEXT_TOKEN_BUDGET = 131072
+# the history is trimmed down to this fraction of the budget, so it is not trimmed again on every turn
+CHAT_CONTEXT_TARGET_RATIO = 0.75
+# attachments of older turns are replaced with text placeholders
+CHAT_CONTEXT_ATTACHMENT_TURNS = 4
+# estimated tokens of an attachment when evicting turns
+CHAT_CONTEXT_ATTACHMENT_TOKENS = 258
+
+# audio attachments up to this size are sent inline, larger ones are uploaded to the Files API
+AUDIO_INLINE_MAX_BYTES = 4 * 1024 * 1024
+# uploaded files are uploaded again this many seconds before they expire
+REMOTE_FILE_EXPIRY_MARGIN = 600
+# how many attachments and uploaded files the remote file cache keeps track of
+REMOTE_FILE_CACHE_SIZE = 1024
+
+# token limits of the memory tiers, the oldest memories of an overflowing tier are consolidated
+# into the next one in the background: raw memories into daily rollups, daily rollups into long-term rollups
+MEMORY_RAW_TIER_LIMIT = 4096
+MEMORY_DAILY_TIER_LIMIT = 8192
+MEMORY_LONG_TERM_TIER_LIMIT = 16386
+# maximum tokens of memories consolidated per tier each time a memory is stored
+MEMORY_CONSOLIDATION_MAX_TOKENS = 32768
+# size of the chunks summarized in parallel during consolidation
+MEMORY_CONSOLIDATION_CHUNK_TOKENS = 8192
+MEMORY_CONSOLIDATION_WORKERS = 4
+
+# memories are split into chunks of at most this many characters for retrieval
+MEMORY_CHUNK_SIZE = 512
+# how many memory chunks related to the latest turn are retrieved
+MEMORY_RETRIEVAL_TOP_K = 8
+# token budget of the latest raw memories put into the system prompt
+MEMORY_RECENT_TOKEN_LIMIT = 1024
+# token budget of the long-term and daily rollups put into the system prompt before the latest memories
+MEMORY_SUMMARY_TOKEN_LIMIT = 2048
+
+# extract the reference memory of the text on a worker thread as soon as a turn arrives, while its attachments are loaded
+MEMORY_EXTRACTION_PIPELINED = True
+# seconds a turn waits for the memory extraction before falling back to the retrieved memories, later results are dropped
+MEMORY_EXTRACTION_DEADLINE = 8.0
+# how many extraction results are kept per chat session
+MEMORY_EXTRACTION_CACHE_SIZE = 256
+
+# how tokens are counted: 'local' uses the sentencepiece tokenizer of google-genai and falls back to
+# estimation when it is unavailable, 'estimate' only estimates, 'remote' asks the Gemini API for exact counts
+TOKEN_COUNTER_MODE = 'local'
+# model whose tokenizer is used and which is asked in 'remote' mode, a cheap flash model so counting
+# does not spend the quota of USE_MODEL
+TOKEN_COUNTER_MODEL = 'models/gemini-2.5-flash'
+# how many token counts are kept in memory
+TOKEN_COUNTER_CACHE_SIZE = 4096
+# calibration of the token estimator: CJK and other wide characters cost about one token each,
+# other text about four characters per token
+TOKEN_ESTIMATE_TOKENS_PER_WIDE_CHAR = 1.0
+TOKEN_ESTIMATE_CHARS_PER_TOKEN = 4.0
 
 BLOB_URL = 'blob'
 
+# directory of the content-addressed store for attachment contents
+ATTACHMENT_STORE_PATH = os.path.join(BLOB_URL, 'attachments')
+
+# compiled user scripts kept across sessions, see userScript.UserScriptRegistry
+USER_SCRIPT_CACHE_SIZE = 64
+
+# tool invocations of a response run concurrently on a shared pool of this many threads
+TOOL_EXECUTOR_WORKERS = 8
+# seconds after which a running invocation is answered with a failure
+TOOL_INVOCATION_TIMEOUT = 60
+# per tool overrides of TOOL_INVOCATION_TIMEOUT, WebsiteReader's is derived from WEB_FETCH_DEADLINE below
+TOOL_INVOCATION_TIMEOUTS = {}
+# maximum number of concurrent invocations of a tool across all sessions, tools not listed are only bounded by the pool
+TOOL_CONCURRENCY_LIMITS = {
+    'WebsiteReader': 4,
+    'SearchEngine': 2,
+}
+
+# tool outputs above this many tokens are cut down to their passages most relevant to the invocation
+TOOL_OUTPUT_TOKEN_BUDGET = 4096
+# maximum length of a ranked passage in characters
+TOOL_OUTPUT_PASSAGE_SIZE = 800
+# how many truncated outputs are kept for the ToolOutputReader tool
+TOOL_OUTPUT_STORE_SIZE = 64
+
+# SearchEngine tool: seconds results are cached and how many pages are kept
+SEARCH_CACHE_TTL = 60 * 60
+SEARCH_CACHE_SIZE = 256
+# fetch the second page in the background when the first one is requested
+SEARCH_PREFETCH_NEXT_PAGE = True
+
+# WebsiteReader: (connect, read) timeouts in seconds, retries and the maximum page size read
+WEB_FETCH_TIMEOUT = (10, 30)
+WEB_FETCH_RETRIES = 3
+# seconds all attempts to fetch a page take at most, the timeouts above are cut down to the time left
+WEB_FETCH_DEADLINE = 40
+# the fetch ends by its deadline, the rest is left for parsing the page
+TOOL_INVOCATION_TIMEOUTS['WebsiteReader'] = WEB_FETCH_DEADLINE + 10
+WEB_FETCH_MAX_BYTES = 4 * 1024 * 1024
+# keep-alive connections kept per host
+WEB_FETCH_POOL_SIZE = 16
+# sqlite database caching fetched pages, None to always fetch
+WEB_CACHE_PATH = os.path.join(BLOB_URL, 'web_cache.db')
+# seconds a page is used without revalidation when the server does not send a max-age
+WEB_CACHE_FRESHNESS = 10 * 60
+# pages not fetched for this many seconds are dropped from the cache
+WEB_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+# total size of the cached pages in bytes, the least recently fetched ones are dropped beyond it
+WEB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# a content container with less text than this is skipped in favour of the extractor
+WEB_READER_MIN_CONTENT_CHARS = 200
+# maximum number of links returned per page
+WEB_READER_MAX_LINKS = 100
+
+# cache responses of stateless model helpers (sticker and emotion mapping, character generation)
+# by model, temperature and prompt, see responseCache.py
+RESPONSE_CACHE_ENABLED = True
+# number of responses kept in memory
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+# sqlite database of the persistent tier, None keeps responses in memory only
+RESPONSE_CACHE_PATH = os.path.join(BLOB_URL, 'response_cache.db')
+# seconds a persisted response stays valid
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60
+
+# how many read-only sqlite connections DatabaseObject keeps for select queries
+DATABASE_READER_POOL_SIZE = 4
+
+# pragmas applied to every sqlite connection opened by DatabaseObject
+DATABASE_SYNCHRONOUS = 'NORMAL'
+DATABASE_MMAP_SIZE = 256 * 1024 * 1024
+# negative value means KiB instead of pages, see sqlite docs for `cache_size`
+DATABASE_CACHE_SIZE = -32768
+DATABASE_BUSY_TIMEOUT = 5000
+
+# buffer chat history writes and insert them in batches instead of once per saveChatHistory call
+CHAT_HISTORY_WRITE_BEHIND = False
+# number of buffered messages which triggers a batch insert
+CHAT_HISTORY_FLUSH_ROWS = 64
+# maximum time in seconds a message stays in the buffer
+CHAT_HISTORY_FLUSH_INTERVAL = 2.0
+
+# maximum page size of the cursor based chat history api
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+# markers wrapped around the matched text in chat history search results
+SEARCH_HIGHLIGHT = ('<mark>', '</mark>')
+# queries shorter than three characters can not use the trigram index, they only scan this many latest messages
+SEARCH_SHORT_QUERY_SCAN_ROWS = 5000
+
+# in-memory cache for avatars and stickers served by the web frontend
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# images larger than this are served from the database without being cached
+IMAGE_CACHE_MAX_ENTRY_BYTES = 2 * 1024 * 1024
+# avatars and stickers may change under the same url, clients revalidate them with their ETag
+IMAGE_CACHE_CONTROL = 'private, no-cache'
+
 TOOLS_PROMPT = \
     '''
 Tool Interaction Format:
@@ -68,6 +235,8 @@ Tool Usage Constraints:
     *   Re-trying a failed attempt.
     *   Following closely related internal links from a page just read.
 
+Invocations in one response run concurrently. If an invocation needs the result of another one first, add an `"id"` to the other one and list it in the `"after"` field of the dependent one, e.g. `"id": "search"` and `"after": ["search"]`.
+
 Occasions and Uses:
 You can use them at any time and even consecutively if you feel like it. They are not just for finishing this turn of chat. Use them to imitate the most of your personality.
 Finally when you are done with your investigation, or when you think it is not nessary to use any tools, you can simply not to use any tool invocation and continue with your conversation.
@@ -364,7 +533,8 @@ Rules:
 2. Output the result directly.
 3. If there are no related memories, output "No related memories found".
 
-Here are the given memories:
+Every input ends with the older memories retrieved for it, after the line "Retrieved memories:".
+Here are the latest memories:
 ```
 {{memories}}
 ```
@@ -376,6 +546,28 @@ Param used in this prompt:
 - memories
 '''
 
+MEMORY_SUMMARIZING_PROMPT = '''\
+Below are memories of {{charName}}, oldest first.
+Summarize them into one shorter text written from {{charName}}'s first-person perspective.
+
+Rules:
+1. Keep names, dates, promises, preferences and events which may matter in later conversations.
+2. Merge repeated or related memories, drop small talk.
+3. Keep the chronological order.
+4. Output the summary directly.
+
+Memories:
+```
+{{memories}}
+```
+'''
+'''
+Prompt to summarize memories during memory consolidation
+Param used in this prompt:
+- charName
+- memories
+'''
+
 CREATE_CHARACTER_PROMPT = '''\
 **Your Role:** You are an expert character analyst and profile creator. Your mission is to conduct comprehensive research using the provided tools and then synthesize that information into a structured, detailed character profile for an advanced role-playing AI.
 
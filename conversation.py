@@ -3,8 +3,13 @@ conversation.py
 Provides class ConversationMemory
 """
 
+import concurrent.futures
+import hashlib
+import time
 import chatModel
 import config
+import logger
+import lruCache
 import models
 import memory
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
@@ -45,14 +50,25 @@ class ConversationMemory:
 class MemoryExtractor:
     """
     A class for extracting memory from a chat session.
+
+    Extractions are cached per (input, memory version) and skipped when the local retrieval
+    finds no related memories. extractMemoryAsync runs them on a worker thread, so they can
+    overlap with the preparation of the main chat call. An extraction finishing after its
+    deadline is dropped and leaves the extraction chat session as it was, one which did not
+    start before its deadline is skipped.
     """
 
+    noRelatedMemories = 'No related memories found'
+
     def __init__(self, conversation: ConversationMemory, memory: memory.Memory) -> None:
         self.chat_session = conversation
         self.memory = memory
         self.llm = chatModel.ChatGoogleGenerativeAI(config.USE_LEGACY_MODEL, with_thinking=False, temperature=0.9, system_prompt=self.getPrompt(), tools=[])
         self.isInitiated = False
         self.pendingBotMessage = None
+        self.cache = lruCache.LRUCache(config.MEMORY_EXTRACTION_CACHE_SIZE)
+        # a single worker keeps the extraction chat session in order
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
         
     
     def setPendingBotMessage(self, message: str) -> None:
@@ -60,6 +76,13 @@ class MemoryExtractor:
         Sets the pending bot message.
         """
         self.pendingBotMessage = message
+
+    def takePendingBotMessage(self) -> str:
+        """
+        Returns the pending bot message and clears it.
+        """
+        pendingBotMessage, self.pendingBotMessage = self.pendingBotMessage, None
+        return pendingBotMessage or ''
         
         
     def getPrompt(self) -> str:
@@ -68,29 +91,40 @@ class MemoryExtractor:
         """
         prompt = models.PreprocessPrompt(config.MEMORY_EXTRACTION_PROMPT, {
             'charName': self.memory.getCharName(),
-            'memories': self.memory.getPastMemories(),
+            'memories': self.memory.getPromptMemories(),
             'userName': self.chat_session.userName
         })
         return prompt
         
         
     
-    def extractMemory(self, messages: list[dict[str, str]]) -> str:
+    def extractMemory(self, messages: list[dict[str, str]], pendingBotMessage: str | None = None, deadline: float | None = None) -> str:
         """
         Extracts memory from the chat session.
         
         Parameters:
             messages: the result of convertMessageListToInput method
+            pendingBotMessage: the last bot message, taken from setPendingBotMessage if None
+            deadline: time.monotonic() after which the result is no longer waited for, None to always keep it
         
         Returns:
             the extracted memory as a string
         """
+        if pendingBotMessage is None:
+            pendingBotMessage = self.takePendingBotMessage()
+        if deadline is not None and time.monotonic() >= deadline:
+            # queued behind an earlier extraction for too long, nobody waits for it anymore
+            return self.noRelatedMemories
+
         # Extract the memory from the chat session
         memory_list = []
-        if self.pendingBotMessage is not None:
+        texts = []
+        # attachments are neither visible to the local retrieval nor part of the cache key
+        onlyText = True
+        if pendingBotMessage:
             memory_list.append(f'{self.memory.getCharName()}: ')
-            memory_list.append(self.pendingBotMessage)
-            self.pendingBotMessage = None
+            memory_list.append(pendingBotMessage)
+            texts.append(pendingBotMessage)
         for message in messages:
             if message['role'] == 'user':
                 memory_list.append(f'{self.chat_session.userName}: ')
@@ -98,8 +132,68 @@ class MemoryExtractor:
             elif message['role'] == 'bot':
                 memory_list.append(f'{self.memory.getCharName()}: ')
                 memory_list.append(message['message'])
+            if isinstance(message['message'], str):
+                texts.append(message['message'])
+            else:
+                onlyText = False
+
+        # only the memories related to this turn are handed to the extractor
+        query = '\n'.join(texts)
+        relevant = self.memory.getRelevantMemories(query)
+        if onlyText and not relevant:
+            return self.noRelatedMemories
+        key = (hashlib.sha1(query.encode('utf-8')).digest(), self.memory.getMemoryVersion())
+        if onlyText and (res := self.cache.get(key)) is not None:
+            return res
+        memory_list.append(f'Retrieved memories:\n{relevant if relevant else "None"}')
         
+        history = list(self.llm.chat_session.get_history()) if self.isInitiated else None
         res = self.llm.chat(memory_list) if self.isInitiated else self.llm.initiate(memory_list)
+        if deadline is not None and time.monotonic() >= deadline:
+            # the turn went on without this result, it must not become part of the extraction session either
+            logger.Logger.log('Memory extraction finished after its deadline, dropping the result')
+            self.llm.chat_session = None if history is None else self.llm.create_session(history)
+            return res
         self.isInitiated = True
+        if onlyText:
+            self.cache.put(key, res)
         return res
+
+    def extractMemoryAsync(self, messages: list[dict[str, str]], deadline: float, pendingBotMessage: str | None = None) -> concurrent.futures.Future[str]:
+        """
+        Starts extracting memory on the worker thread.
+
+        Parameters:
+            messages: the messages of the turn, attachments as returned by convertMessageListToInput
+            deadline: time.monotonic() after which the result is dropped, see waitForMemory
+            pendingBotMessage: the last bot message, taken from setPendingBotMessage if None
+
+        Returns:
+            a future of the extracted memory, see waitForMemory
+        """
+        messages = list(messages)
+        if pendingBotMessage is None:
+            pendingBotMessage = self.takePendingBotMessage()
+        return self.executor.submit(self.extractMemory, messages, pendingBotMessage, deadline)
+
+    def waitForMemory(self, future: concurrent.futures.Future[str], messages: list[dict[str, str]], deadline: float) -> str:
+        """
+        Waits for an extraction started by extractMemoryAsync until its deadline.
+
+        Parameters:
+            future: the result of extractMemoryAsync
+            messages: the messages of the turn, used to retrieve memories locally if the deadline is missed
+            deadline: the deadline passed to extractMemoryAsync
+
+        Returns:
+            the extracted memory, or the locally retrieved memories if the extraction failed or timed out
+        """
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except Exception as e:
+            # not started yet, it would only delay the next extraction
+            future.cancel()
+            logger.Logger.log('Memory extraction missed the deadline, using retrieved memories:', repr(e))
+            query = '\n'.join(i['message'] for i in messages if isinstance(i['message'], str))
+            return self.memory.getRelevantMemories(query) or self.noRelatedMemories
     
\ No newline at end of file
@@ -1,3 +1,4 @@
+import atexit
 import json
 import mimetypes
 import re
@@ -5,16 +6,22 @@ import sqlite3
 import logging
 import time
 from AIDubMiddlewareAPI import AIDubMiddlewareAPI
+import blobStore
 from GPTSoVits import GPTSoVitsAPI
 import config
 import hashlib
 import exceptions
 import logger
+import lruCache
+import memoryConsolidator
+import memoryIndex
 import models
 import typing
 import uuid
 import threading
 import os
+import queue
+import responseCache
 import chatModel
 import langchain_core.messages
 
@@ -65,25 +72,155 @@ class ChatHistoryRole:
     USER = 1
 
 
+class MemoryTier:
+    """
+    Enum class representing the tiers of stored memories, see memoryConsolidator.
+
+    Attributes:
+        RAW: Memory stored at the end of a chat session.
+        DAILY: Rollup of the raw memories of one day.
+        LONG_TERM: Rollup of older memories, initial and edited memories.
+    """
+    RAW = 0
+    DAILY = 1
+    LONG_TERM = 2
+
+
+class DatabaseBlob:
+    """
+    A read-only file-like object over a single BLOB value, backed by SQLite incremental BLOB I/O.
+
+    Args:
+        blob (sqlite3.Blob): The opened blob.
+        conn (sqlite3.Connection | None): Dedicated connection the blob was opened on, closed together with the blob.
+    """
+
+    def __init__(self, blob: sqlite3.Blob, conn: sqlite3.Connection | None = None) -> None:
+        self.blob = blob
+        self.conn = conn
+        self.closed = False
+
+    def read(self, size: int = -1) -> bytes:
+        return self.blob.read(size)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self.blob.seek(offset, whence)
+        return self.blob.tell()
+
+    def tell(self) -> int:
+        return self.blob.tell()
+
+    def __len__(self) -> int:
+        return len(self.blob)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.blob.close()
+        if self.conn is not None:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback) -> None:
+        self.close()
+
+
 class DatabaseObject:
     """
     Class representing a database connection object.
 
+    The database is opened in WAL mode with one writer connection and a pool of
+    read-only connections. Select queries are served by the reader pool and never
+    wait for the writer lock, while every other statement is serialized on the writer.
+
     Args:
         dbPath (str): Path to the SQLite database file.
+        readerPoolSize (int, optional): Number of read-only connections. Defaults to config.DATABASE_READER_POOL_SIZE.
 
     Methods:
         query(query, args=(), one=False):
             Execute an SQL query on the database.
+        executeMany(query, argsList):
+            Execute an SQL statement for every parameter tuple in one transaction.
         runScript(query):
             Execute an SQL script on the database.
+        openBlob(table, column, rowid):
+            Open a BLOB value for streaming reads.
         close():
             Close the database connection.
     """
 
-    def __init__(self, dbPath: str) -> None:
-        self.db = sqlite3.connect(dbPath, check_same_thread=False)
+    def __init__(self, dbPath: str, readerPoolSize: int = config.DATABASE_READER_POOL_SIZE) -> None:
+        self.dbPath = dbPath
+        self.db = self.connect()
         self.lock = threading.Lock()
+        # in-memory databases can not be shared between connections
+        self.readerPoolSize = 0 if dbPath == ':memory:' else readerPoolSize
+        self.readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(self.readerPoolSize):
+            self.readers.put(self.connect(readOnly=True))
+
+    def connect(self, readOnly: bool = False) -> sqlite3.Connection:
+        """
+        Open a new connection to the database and apply the tuning pragmas.
+
+        Args:
+            readOnly (bool, optional): Open the connection in read-only mode. Defaults to False.
+
+        Returns:
+            sqlite3.Connection: The opened connection.
+        """
+        if readOnly:
+            conn = sqlite3.connect(
+                f'file:{self.dbPath}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.dbPath, check_same_thread=False)
+            conn.execute('pragma journal_mode = WAL')
+        conn.execute(f'pragma synchronous = {config.DATABASE_SYNCHRONOUS}')
+        conn.execute(f'pragma mmap_size = {int(config.DATABASE_MMAP_SIZE)}')
+        conn.execute(f'pragma cache_size = {int(config.DATABASE_CACHE_SIZE)}')
+        conn.execute(f'pragma busy_timeout = {int(config.DATABASE_BUSY_TIMEOUT)}')
+        return conn
+
+    @staticmethod
+    def isReadQuery(query: str) -> bool:
+        """
+        Check whether a query can be served by a read-only connection.
+
+        Args:
+            query (str): The SQL query.
+
+        Returns:
+            bool: True if the query only reads from the database.
+        """
+        q = query.lstrip().lower()
+        # last_insert_rowid() is bound to the connection which performed the insert
+        return q.startswith(('select', 'with')) and 'last_insert_rowid' not in q
+
+    @staticmethod
+    def fetchResult(cur: sqlite3.Cursor, query: str, one: bool) -> list[dict[str | typing.Any]] | dict[str | typing.Any] | int:
+        """
+        Convert the rows of an executed cursor into dictionaries and close it.
+
+        Args:
+            cur (sqlite3.Cursor): The executed cursor.
+            query (str): The SQL query which was executed.
+            one (bool): Return only one result.
+
+        Returns:
+            list[dict[str | typing.Any]] | dict[str | typing.Any] | int: Query result, or the last row id for inserts.
+        """
+        rv = [dict((cur.description[idx][0], value)
+                   for idx, value in enumerate(row)) for row in cur.fetchall()]
+        lastrowid = cur.lastrowid
+        cur.close()
+        if query.startswith('insert'):
+            return lastrowid
+        else:
+            return (rv[0] if rv else None) if one else rv
 
     def query(self, query, args=(), one=False) -> list[dict[str | typing.Any]] | dict[str | typing.Any]:
         """
@@ -98,33 +235,151 @@ class DatabaseObject:
             list[dict[str | typing.Any]] | dict[str | typing.Any]: Query result.
         """
 
+        if self.readerPoolSize and self.isReadQuery(query):
+            conn = self.readers.get()
+            try:
+                return self.fetchResult(conn.execute(query, args), query, one)
+            finally:
+                self.readers.put(conn)
+
         with self.lock:
-            cur = self.db.execute(query, args)
-            rv = [dict((cur.description[idx][0], value)
-                       for idx, value in enumerate(row)) for row in cur.fetchall()]
-            lastrowid = cur.lastrowid
-            cur.close()
-            if query.startswith('insert'):
-                return lastrowid
-            else:
-                return (rv[0] if rv else None) if one else rv
+            result = self.fetchResult(self.db.execute(query, args), query, one)
+            # commit right away, otherwise the reader pool would not see the change
+            self.db.commit()
+            return result
+
+    def executeMany(self, query: str, argsList: typing.Iterable[tuple]) -> None:
+        """
+        Execute an SQL statement for every parameter tuple in one explicit transaction.
+
+        Args:
+            query (str): The SQL statement to be executed.
+            argsList (typing.Iterable[tuple]): Parameters for each execution.
+        """
+        with self.lock:
+            try:
+                self.db.execute('begin')
+                self.db.executemany(query, argsList)
+                self.db.commit()
+            except:
+                self.db.rollback()
+                raise
 
     def runScript(self, query: str):
         """
         Execute an SQL script on the database.
 
+        If a statement fails, the transaction opened by the script is rolled back, so the
+        connection is not left inside it and no part of the script is committed later.
+
         Args:
             query (str): The SQL script to be executed.
         """
-        self.db.executescript(query)
-        self.db.commit()
+        with self.lock:
+            try:
+                self.db.executescript(query)
+            except sqlite3.Error:
+                self.db.rollback()
+                raise
+            self.db.commit()
         return None
 
+    def openBlob(self, table: str, column: str, rowid: int) -> DatabaseBlob:
+        """
+        Open a BLOB value for streaming reads without loading it into memory.
+
+        The blob is opened on a dedicated read-only connection, so long running downloads
+        do not hold a connection of the reader pool.
+
+        Args:
+            table (str): Table of the value.
+            column (str): Column of the value.
+            rowid (int): Rowid of the row holding the value.
+
+        Returns:
+            DatabaseBlob: File-like object of the value.
+        """
+        if not self.readerPoolSize:
+            return DatabaseBlob(self.db.blobopen(table, column, rowid, readonly=True))
+        conn = self.connect(readOnly=True)
+        try:
+            return DatabaseBlob(conn.blobopen(table, column, rowid, readonly=True), conn)
+        except:
+            conn.close()
+            raise
+
     def close(self):
         """Close the database connection."""
+        while not self.readers.empty():
+            self.readers.get().close()
         self.db.close()
 
 
+class WriteBehindBuffer:
+    """
+    Buffers rows for an insert statement and writes them in batches through DatabaseObject.executeMany.
+
+    A batch is written once `maxRows` rows are buffered, or by a background thread once the oldest
+    buffered row is `maxDelay` seconds old.
+
+    Args:
+        db (DatabaseObject): Database to write to.
+        query (str): Insert statement executed for every row.
+        maxRows (int): Number of buffered rows which triggers a flush.
+        maxDelay (float): Maximum time in seconds a row stays in the buffer.
+
+    Methods:
+        add(rows): Buffer rows.
+        flush(): Write all buffered rows.
+    """
+
+    def __init__(self, db: DatabaseObject, query: str, maxRows: int, maxDelay: float) -> None:
+        self.db = db
+        self.query = query
+        self.maxRows = maxRows
+        self.maxDelay = maxDelay
+        self.rows: list[tuple] = []
+        self.oldestRowTime = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.flushLoop, daemon=True)
+        self.thread.start()
+
+    def add(self, rows: list[tuple]) -> None:
+        with self.lock:
+            if not self.rows:
+                self.oldestRowTime = time.time()
+            self.rows.extend(rows)
+            if len(self.rows) >= self.maxRows:
+                self.flushLocked()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flushLocked()
+
+    def flushLocked(self) -> None:
+        # keep holding the buffer lock while writing, so batches are written in order
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        try:
+            self.db.executeMany(self.query, rows)
+        except Exception as e:
+            self.rows = rows + self.rows
+            logger.Logger.log(f'{__name__}: Failed to flush buffered rows: {e}')
+            raise
+
+    def flushLoop(self) -> None:
+        while True:
+            time.sleep(self.maxDelay / 2)
+            try:
+                with self.lock:
+                    if self.rows and time.time() - self.oldestRowTime >= self.maxDelay:
+                        self.flushLocked()
+            except Exception:
+                # already logged, retried on the next tick
+                pass
+
+
 class DataProvider:
     """
     Class providing data-related functionality for the application.
@@ -136,6 +391,12 @@ class DataProvider:
         checkIfInitialized():
             Check if the database is initialized.
 
+        getSchemaVersion():
+            Get the schema version of the database.
+
+        runMigrations():
+            Apply pending schema migration scripts.
+
         initialize(userName, password, avatarPath):
             Initialize the database with user information.
 
@@ -178,21 +439,66 @@ class DataProvider:
         convertMessageHistoryToModelInput(chain):
             Convert a message history chain to model input format.
 
+        saveAttachment(file, mime, type):
+            Save an attachment to the blob store.
+
         saveAudioAttachment(file, mime):
-            Save an audio attachment to the database.
+            Save an audio attachment to the blob store.
 
         saveImageAttachment(file, mime):
-            Save an image attachment to the database.
+            Save an image attachment to the blob store.
+
+        getAttachmentInfo(attachmentId):
+            Retrieve the metadata of an attachment.
+
+        openAttachment(attachmentId):
+            Open an attachment for streaming reads.
 
         getAttachment(attachmentId):
-            Retrieve an attachment from the database.
+            Retrieve an attachment.
+
+        migrateAttachmentsToBlobStore(batchSize, onProgress):
+            Move attachment contents from the database into the blob store.
 
         saveChatHistory(charName, msgHistory):
             Save chat history to the database.
 
+        flushChatHistory():
+            Write the buffered chat history to the database.
+
         fetchChatHistory(charId, offset):
             Fetch chat history for a character with optional offset.
 
+        fetchChatHistoryPage(charId, cursor, limit, direction):
+            Fetch a page of chat history for a character using a cursor.
+
+        indexMemory(charId, memory, tier):
+            Store a memory of a character and add it to the search indexes.
+
+        getMemoryEntries(charId, tier):
+            Get the stored memories of a character in one tier.
+
+        replaceMemoryEntries(charId, ids, tier, timestamp, memory):
+            Replace stored memories of a character with their rollup.
+
+        renderMemories(charId):
+            Join the stored memories of a character into one text.
+
+        searchHistory(charId, query, limit):
+            Search the chat history and stored memories of a character.
+
+        getMemoryIndex(charId):
+            Get the retrieval index over the memory chunks of a character.
+
+        retrieveMemories(charId, query, k):
+            Get the memory chunks of a character most relevant to a query.
+
+        getRecentMemories(charId, tokenBudget):
+            Get the latest raw memory chunks of a character within a token budget.
+
+        getMemorySummary(charId, tokenBudget):
+            Get the latest long-term and daily rollups of a character within a token budget.
+
         getCharacterAvatar(charId):
             Retrieve a character's avatar from the database.
 
@@ -232,6 +538,9 @@ class DataProvider:
         getStickerList(setId):
             Retrieve a list of stickers within a specific sticker set.
 
+        updateStickerKeywords(id, keywords):
+            Update the keywords a sticker is matched by.
+
         parseAudio(audioPath):
             Parse audio from a given path and return text.
 
@@ -253,6 +562,26 @@ class DataProvider:
 
     def __init__(self, databasePath: str) -> None:
         self.db = DatabaseObject(databasePath)
+        self.blobStore = blobStore.BlobStore(config.ATTACHMENT_STORE_PATH)
+        # (mime, data, etag) of avatars and stickers, see getCachedImage
+        self.imageCache = lruCache.LRUCache(
+            config.IMAGE_CACHE_MAX_BYTES, lambda v: len(v[1]))
+        # bumped by every invalidation, so a load which raced with one is not cached
+        self.imageCacheGeneration = 0
+        self.imageCacheLock = threading.Lock()
+        self.chatHistoryBuffer = WriteBehindBuffer(
+            self.db, 'insert into chatHistory (charName, role, type, text, timestamp) values (?, ?, ?, ?, ?)',
+            config.CHAT_HISTORY_FLUSH_ROWS, config.CHAT_HISTORY_FLUSH_INTERVAL) if config.CHAT_HISTORY_WRITE_BEHIND else None
+        if self.chatHistoryBuffer is not None:
+            atexit.register(self.flushChatHistory)
+        self.migrated = False
+        self.migrationLock = threading.Lock()
+        # retrieval indexes over the memory chunks, built on first use, see getMemoryIndex
+        self.memoryIndexes: dict[int, memoryIndex.MemoryIndex] = {}
+        self.memoryIndexLock = threading.Lock()
+        # serializes changes of the stored memories with the writes of their `pastMemories` rendering
+        self.memoryWriteLock = threading.RLock()
+        self.memoryConsolidator = memoryConsolidator.MemoryConsolidator(self)
         if not self.checkIfInitialized():
             logging.getLogger(__name__).warning('Database is not initialized')
 
@@ -260,18 +589,71 @@ class DataProvider:
 
     def checkIfInitialized(self) -> bool:
         """
-        Check if the database is initialized.
+        Check if the database is initialized, and apply pending schema migrations on first call.
 
         Returns:
             bool: True if initialized, False otherwise.
         """
+        initialized = False
         try:
-            return len(self.db.query("select 1 from config")) != 0
+            initialized = len(self.db.query("select 1 from config")) != 0
         except:
             logging.getLogger(__name__).info('Running initialization script')
             with open(f'{config.BLOB_URL}/init.sql', 'r') as file:
                 self.db.runScript(file.read())
 
+        if not self.migrated:
+            self.runMigrations()
+        return initialized
+
+    def getSchemaVersion(self) -> int:
+        """
+        Get the schema version of the database.
+
+        Returns:
+            int: Version of the last applied migration, 0 if none.
+        """
+        return self.db.query('pragma user_version', one=True)['user_version']
+
+    def runMigrations(self) -> None:
+        """
+        Apply pending migration scripts from `{config.BLOB_URL}/migrations` in order.
+
+        Migration scripts are named `<version>_<description>.sql`. Every script whose version is
+        greater than the schema version of the database is executed in its own transaction,
+        together with the update of the schema version. A failing script is rolled back and its
+        error raised, the following ones are not applied.
+        """
+        with self.migrationLock:
+            if self.migrated:
+                return
+
+            migrationsPath = f'{config.BLOB_URL}/migrations'
+            migrations = []
+            if os.path.isdir(migrationsPath):
+                for i in os.listdir(migrationsPath):
+                    version = i.split('_', 1)[0]
+                    if i.endswith('.sql') and version.isdigit():
+                        migrations.append((int(version), i))
+
+            currentVersion = self.getSchemaVersion()
+            for version, name in sorted(migrations):
+                if version <= currentVersion:
+                    continue
+                logging.getLogger(__name__).info(f'Applying migration {name}')
+                with open(os.path.join(migrationsPath, name), 'r') as file:
+                    script = file.read()
+                try:
+                    self.db.runScript(
+                        f'begin;\n{script}\npragma user_version = {version};\ncommit;')
+                except sqlite3.Error as e:
+                    logger.Logger.log(
+                        f'{__name__}: Migration {name} failed and was rolled back, the schema stays at version {currentVersion}: {e}')
+                    raise
+                currentVersion = version
+
+            self.migrated = True
+
     def initialize(self, userName: str, password: str, avatar: bytes | None = None) -> None:
         """
         Initialize the database with user information.
@@ -414,8 +796,10 @@ class DataProvider:
             avatarPath (str, optional): Path to the character's avatar. Defaults to f'{config.BLOB_URL}/avatar_2.png'.
         """
         with open(avatarPath, 'rb') as file:
-            return self.db.query('insert into personalCharacter (charName, AIDubUseModel, emotionPack, charPrompt, initialMemories, pastMemories, avatar, exampleChats, tha4Service, creationTime) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                                 (name, useTTSModel, useStickerSet, prompt, initalMemory, initalMemory, file.read(), exampleChats, tha4Service, tools.DateProvider()))
+            id = self.db.query('insert into personalCharacter (charName, AIDubUseModel, emotionPack, charPrompt, initialMemories, pastMemories, avatar, exampleChats, tha4Service, creationTime) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (name, useTTSModel, useStickerSet, prompt, initalMemory, initalMemory, file.read(), exampleChats, tha4Service, tools.DateProvider()))
+        self.indexMemory(id, initalMemory, MemoryTier.LONG_TERM)
+        return id
 
     def checkIfCharacterExist(self, name: int) -> bool:
         """
@@ -429,7 +813,7 @@ class DataProvider:
         """
         return bool(len(self.db.query('select count(*) from personalCharacter where name = ?')), (name, ))
 
-    def updateCharacter(self, id: int, name: str, useTTSModel: str, useStickerSet: int, prompt: str, pastMemories: str, exampleChats: str, tha4Service: int) -> None:
+    def updateCharacter(self, id: int, name: str, useTTSModel: str, useStickerSet: int, prompt: str, pastMemories: str | None, exampleChats: str, tha4Service: int, reindexMemories: bool = False) -> None:
         """
         Update character information in the database.
 
@@ -438,13 +822,28 @@ class DataProvider:
             useTTSModel (str): TTS model to use.
             name (str): New character name.
             prompt (str): New character prompt.
-            pastMemories (str): New past memories for the character.
+            pastMemories (str | None): New past memories for the character, None to render them from the stored memories,
+                which a consolidation running meanwhile can not make stale.
             exampleChats (str): New example chats for the character.
             tha4Service (int): THA4 service ID.
+            reindexMemories (bool, optional): Replace the indexed memories if `pastMemories` was edited. Defaults to False,
+                callers appending memories index them with indexMemory instead.
         """
         print(useTTSModel)
-        self.db.query('update personalCharacter set charName = ?, AIDubUseModel = ?, emotionPack = ?, charPrompt = ?, pastMemories = ?, exampleChats = ?, tha4Service = ? where id = ?',
-                      (name, useTTSModel, useStickerSet, prompt, pastMemories, exampleChats, tha4Service, id))
+        with self.memoryWriteLock:
+            if pastMemories is None:
+                pastMemories = self.renderMemories(id)
+            elif reindexMemories:
+                old = self.db.query(
+                    'select pastMemories from personalCharacter where id = ?', (id, ), one=True)
+                if old is not None and old['pastMemories'] != pastMemories:
+                    self.db.query(
+                        'delete from pastMemoriesFts where charId = ?', (id, ))
+                    self.indexMemory(id, pastMemories, MemoryTier.LONG_TERM)
+                    with self.memoryIndexLock:
+                        self.memoryIndexes.pop(id, None)
+            self.db.query('update personalCharacter set charName = ?, AIDubUseModel = ?, emotionPack = ?, charPrompt = ?, pastMemories = ?, exampleChats = ?, tha4Service = ? where id = ?',
+                          (name, useTTSModel, useStickerSet, prompt, pastMemories, exampleChats, tha4Service, id))
 
     def getCharacterId(self, name: str) -> int:
         """
@@ -499,23 +898,36 @@ class DataProvider:
         Returns:
             str | None: Latest chat history entry if exists, None otherwise.
         """
+        self.flushChatHistory()
         f = self.db.query(
-            'select role, type, text from chatHistory where charName = ? and text != "(OPT_NO_RESPOND)" order by timestamp desc limit 1', (self.getCharacter(id)['charName'], ), one=True)
+            'select role, type, text from chatHistory where charName = (select charName from personalCharacter where id = ?) and text != "(OPT_NO_RESPOND)" order by timestamp desc, id desc limit 1', (id, ), one=True)
         return None if f is None else self.chatMsgToTextOnly(f)
 
     def getCharacterList(self) -> int:
         """
         Get a list of characters with their latest messages.
 
+        The latest message of every character is looked up through the (charName, timestamp) index
+        within the same query, so the cost does not grow with the size of the chat history.
+
         Returns:
             int: List of characters with their latest messages.
         """
+        self.flushChatHistory()
         l = self.db.query(
-            'select id, charName, creationTime from personalCharacter')
-        for i in range(len(l)):
-            l[i]['latestMsg'] = self.fetchLatestChatHistory(l[i]['id'])
-            l[i]['latestMsg'] = 'No chats' if l[i]['latestMsg'] is None else l[i]['latestMsg']
-        return l
+            'select c.id, c.charName, c.creationTime, h.role, h.type, h.text from personalCharacter c left join chatHistory h on h.id = '
+            '(select id from chatHistory where charName = c.charName and text != "(OPT_NO_RESPOND)" order by timestamp desc, id desc limit 1)')
+        r = []
+        for i in l:
+            latestMsg = None if i['text'] is None else self.chatMsgToTextOnly(i)
+            r.append({
+                'id': i['id'],
+                'charName': i['charName'],
+                'creationTime': i['creationTime'],
+                # also for message types without a text representation
+                'latestMsg': 'No chats' if latestMsg is None else latestMsg
+            })
+        return r
 
     def parseMessageChain(self, chain: list[str]) -> list[dict[str | int]]:
         """
@@ -619,25 +1031,40 @@ class DataProvider:
 
         return r
 
-    def saveAudioAttachment(self, file: bytes, mime: str) -> str:
+    def saveAttachment(self, file: bytes, mime: str, type: int) -> str:
         """
-        Saves an audio attachment to the database.
+        Saves an attachment. The content goes to the blob store, the database only keeps the metadata.
 
         Args:
-            file (bytes): Audio data.
-            mime (str): Mime type of the audio.
+            file (bytes): Attachment data.
+            mime (str): Mime type of the attachment.
+            type (int): Type of the attachment, see AttachmentType.
 
         Returns:
             str: ID of the saved attachment.
         """
         id = uuid.uuid4().hex
+        digest = self.blobStore.put(file)
         self.db.query(
-            'insert into attachments (id, timestamp, type, blobMsg, contentType) values (?, ?, ?, ?, ?)', (id, int(time.time()), AttachmentType.AUDIO, file, mime))
+            'insert into attachments (id, timestamp, type, blobMsg, contentType, blobHash, size) values (?, ?, ?, ?, ?, ?, ?)', (id, int(time.time()), type, b'', mime, digest, len(file)))
         return id
 
+    def saveAudioAttachment(self, file: bytes, mime: str) -> str:
+        """
+        Saves an audio attachment.
+
+        Args:
+            file (bytes): Audio data.
+            mime (str): Mime type of the audio.
+
+        Returns:
+            str: ID of the saved attachment.
+        """
+        return self.saveAttachment(file, mime, AttachmentType.AUDIO)
+
     def saveImageAttachment(self, file: bytes, mime: str) -> str:
         """
-        Saves an image attachment to the database.
+        Saves an image attachment.
 
         Args:
             file (bytes): Image data.
@@ -646,14 +1073,47 @@ class DataProvider:
         Returns:
             str: ID of the saved attachment.
         """
-        id = uuid.uuid4().hex
-        self.db.query(
-            'insert into attachments (id, timestamp, type, blobMsg, contentType) values (?, ?, ?, ?, ?)', (id, int(time.time()), AttachmentType.IMG, file, mime))
-        return id
+        return self.saveAttachment(file, mime, AttachmentType.IMG)
+
+    def getAttachmentInfo(self, attachmentId: str) -> dict[str, str | int] | None:
+        """
+        Retrieves the metadata of an attachment.
+
+        Args:
+            attachmentId (str): ID of the attachment.
+
+        Returns:
+            dict[str, str | int] | None: Dictionary with `id`, `timestamp`, `type`, `contentType`, `blobHash` and `size` if found, None otherwise.
+            `blobHash` is None for attachments which are still stored in the database.
+        """
+        # attachments which are still stored in the database have no size yet, length() does not read their contents
+        return self.db.query(
+            'select id, timestamp, type, contentType, blobHash, coalesce(size, length(blobMsg)) as size from attachments where id = ?', (attachmentId, ), one=True)
+
+    def openAttachment(self, attachmentId: str) -> tuple[str, typing.BinaryIO] | None:
+        """
+        Opens an attachment for streaming reads. The caller is responsible for closing the returned file.
+
+        Args:
+            attachmentId (str): ID of the attachment.
+
+        Returns:
+            tuple[str, typing.BinaryIO] | None: Tuple containing mime type and file object of the attachment if found, None otherwise.
+        """
+        f = self.getAttachmentInfo(attachmentId)
+        if f is None:
+            return f
+        if f['blobHash'] is not None:
+            return (f['contentType'], self.blobStore.open(f['blobHash']))
+
+        # not migrated yet
+        row = self.db.query(
+            'select rowid from attachments where id = ?', (attachmentId, ), one=True)
+        return (f['contentType'], self.db.openBlob('attachments', 'blobMsg', row['rowid']))
 
     def getAttachment(self, attachmentId: str) -> tuple[str, bytes] | None:
         """
-        Retrieves an attachment from the database.
+        Retrieves an attachment.
 
         Args:
             attachmentId (str): ID of the attachment.
@@ -661,25 +1121,69 @@ class DataProvider:
         Returns:
             tuple[str, bytes] | None: Tuple containing mime type and data of the attachment if found, None otherwise.
         """
-        f = self.db.query(
-            'select blobMsg, contentType from attachments where id = ?', (attachmentId, ), one=True)
+        f = self.openAttachment(attachmentId)
         if f is None:
             return f
-        else:
-            return (f['contentType'], f['blobMsg'])
+        with f[1] as file:
+            return (f[0], file.read())
+
+    def migrateAttachmentsToBlobStore(self, batchSize: int = 64, onProgress: typing.Callable[[int], None] | None = None) -> int:
+        """
+        Moves the contents of attachments still stored in the database into the blob store.
+
+        Args:
+            batchSize (int, optional): Number of attachments to move per batch. Defaults to 64.
+            onProgress (typing.Callable[[int], None] | None, optional): Called with the number of moved attachments after each batch.
+
+        Returns:
+            int: Number of moved attachments.
+        """
+        moved = 0
+        while True:
+            ids = [i['id'] for i in self.db.query(
+                'select id from attachments where blobHash is null limit ?', (batchSize, ))]
+            if not ids:
+                break
+
+            for id in ids:
+                # one blob in memory at a time
+                f = self.db.query(
+                    'select blobMsg from attachments where id = ?', (id, ), one=True)
+                digest = self.blobStore.put(f['blobMsg'])
+                self.db.query('update attachments set blobHash = ?, size = ?, blobMsg = ? where id = ?',
+                              (digest, len(f['blobMsg']), b'', id))
+                moved += 1
+
+            if onProgress is not None:
+                onProgress(moved)
+
+        return moved
 
     def saveChatHistory(self, charName: str, msgHistory: list[dict[str, int | str]]) -> None:
         """
-        Saves chat history to the database.
+        Saves chat history to the database. The messages are written in one transaction, or handed
+        to the write-behind buffer if `config.CHAT_HISTORY_WRITE_BEHIND` is enabled.
 
         Args:
             charName (str): Character name.
             msgHistory (list[dict[str, int | str]]): List of chat messages.
         """
         logger.Logger.log(f'Triggering saveChatHistory API: {msgHistory}')
-        for i in msgHistory:
-            self.db.query('insert into chatHistory (charName, role, type, text, timestamp) values (?, ?, ?, ?, ?)',
-                          (charName, i['role'], i['type'], i['text'], i['timestamp']))
+        rows = [(charName, i['role'], i['type'], i['text'], i['timestamp'])
+                for i in msgHistory]
+        if not rows:
+            return
+        if self.chatHistoryBuffer is not None:
+            self.chatHistoryBuffer.add(rows)
+        else:
+            self.db.executeMany('insert into chatHistory (charName, role, type, text, timestamp) values (?, ?, ?, ?, ?)', rows)
+
+    def flushChatHistory(self) -> None:
+        """
+        Writes the chat history buffered by the write-behind buffer, if enabled.
+        """
+        if self.chatHistoryBuffer is not None:
+            self.chatHistoryBuffer.flush()
 
     def fetchChatHistory(self, charId: int, offset: int = 0) -> list[dict[str, int | str]]:
         """
@@ -694,12 +1198,252 @@ class DataProvider:
         """
         # fetch latest 24 history
         time = 24
+        self.flushChatHistory()
         charName = self.getCharacter(charId)['charName']
 
         data = self.db.query(
             "select * from (select * from chatHistory where charName = ? order by timestamp desc limit ?, 24) order by timestamp", (charName, offset * time))
         return data
 
+    def fetchChatHistoryPage(self, charId: int, cursor: str | None = None, limit: int = 24, direction: str = 'backward') -> dict[str, typing.Any]:
+        """
+        Fetches a page of chat history using keyset pagination on (timestamp, id).
+
+        Unlike fetchChatHistory the cost of a page does not depend on how far it is from the latest message.
+
+        Args:
+            charId (int): Character ID.
+            cursor (str | None, optional): Cursor returned by a previous call. Defaults to None, which starts from the latest
+                message when going backward and from the oldest message when going forward.
+            limit (int, optional): Page size, capped by config.CHAT_HISTORY_MAX_PAGE_SIZE. Defaults to 24.
+            direction (str, optional): `backward` for older messages, `forward` for newer messages. Defaults to 'backward'.
+
+        Raises:
+            ValueError: If the cursor or the direction is invalid.
+
+        Returns:
+            dict[str, typing.Any]: Dictionary with `messages` in chronological order, `hasMore` telling whether there are
+            more messages in the requested direction, and the cursors `older`/`newer` for continuing in either direction.
+        """
+        if direction not in ('backward', 'forward'):
+            raise ValueError(f'{__name__}: Invalid direction {direction}')
+        limit = max(1, min(int(limit), config.CHAT_HISTORY_MAX_PAGE_SIZE))
+        self.flushChatHistory()
+
+        conditions = 'charName = (select charName from personalCharacter where id = ?)'
+        args = [charId]
+        if cursor is not None:
+            timestamp, sep, id = cursor.partition(':')
+            if not sep:
+                raise ValueError(f'{__name__}: Invalid cursor {cursor}')
+            conditions += ' and (timestamp, id) < (?, ?)' if direction == 'backward' else ' and (timestamp, id) > (?, ?)'
+            args += [int(timestamp), int(id)]
+
+        order = 'desc' if direction == 'backward' else 'asc'
+        data = self.db.query(
+            f'select * from chatHistory where {conditions} order by timestamp {order}, id {order} limit ?', (*args, limit + 1))
+
+        hasMore = len(data) > limit
+        data = data[:limit]
+        if direction == 'backward':
+            data.reverse()
+
+        return {
+            'messages': data,
+            'hasMore': hasMore,
+            'older': f'{data[0]["timestamp"]}:{data[0]["id"]}' if data else cursor,
+            'newer': f'{data[-1]["timestamp"]}:{data[-1]["id"]}' if data else cursor,
+        }
+
+    def indexMemory(self, charId: int, memory: str, tier: int = MemoryTier.RAW) -> None:
+        """
+        Stores a memory of a character and adds it to the full-text search and retrieval indexes.
+
+        Args:
+            charId (int): Character ID.
+            memory (str): The stored memory.
+            tier (int, optional): Tier of the memory, see MemoryTier. Defaults to MemoryTier.RAW.
+        """
+        timestamp = int(time.time())
+        self.db.query('insert into pastMemoriesFts (charId, timestamp, tier, text) values (?, ?, ?, ?)',
+                      (charId, timestamp, tier, memory))
+        with self.memoryIndexLock:
+            if tier == MemoryTier.RAW:
+                index = self.memoryIndexes.get(charId)
+            else:
+                # other tiers are not the latest memories, rebuild the index to keep them in order
+                index = None
+                self.memoryIndexes.pop(charId, None)
+        if index is not None:
+            index.add(timestamp, memory)
+
+    def getMemoryEntries(self, charId: int, tier: int) -> list[dict[str, str | int]]:
+        """
+        Gets the stored memories of a character in one tier.
+
+        Args:
+            charId (int): Character ID.
+            tier (int): Tier of the memories, see MemoryTier.
+
+        Returns:
+            list[dict[str, str | int]]: Memories with `id`, `timestamp` and `text`, oldest first.
+        """
+        return self.db.query('select rowid as id, timestamp, text from pastMemoriesFts where charId = ? and tier = ? order by timestamp, rowid',
+                             (charId, tier))
+
+    def replaceMemoryEntries(self, charId: int, ids: list[int], tier: int, timestamp: int, memory: str) -> None:
+        """
+        Replaces stored memories of a character with their rollup and updates `pastMemories` accordingly.
+
+        Args:
+            charId (int): Character ID.
+            ids (list[int]): IDs of the replaced memories, see getMemoryEntries.
+            tier (int): Tier of the rollup, see MemoryTier.
+            timestamp (int): Timestamp of the rollup, usually the one of the latest replaced memory.
+            memory (str): The rollup.
+        """
+        with self.memoryWriteLock:
+            # insert before deleting, an interrupted consolidation leaves duplicates rather than losing memories
+            self.db.query('insert into pastMemoriesFts (charId, timestamp, tier, text) values (?, ?, ?, ?)',
+                          (charId, timestamp, tier, memory))
+            self.db.executeMany('delete from pastMemoriesFts where rowid = ?', [(i, ) for i in ids])
+            with self.memoryIndexLock:
+                self.memoryIndexes.pop(charId, None)
+            self.db.query('update personalCharacter set pastMemories = ? where id = ?',
+                          (self.renderMemories(charId), charId))
+
+    def renderMemories(self, charId: int) -> str:
+        """
+        Joins the stored memories of a character into one text, long-term memories first and raw memories last.
+
+        Args:
+            charId (int): Character ID.
+
+        Returns:
+            str: The memories separated by new lines.
+        """
+        return '\n'.join(i['text'].strip() for i in self.db.query(
+            'select text from pastMemoriesFts where charId = ? order by tier desc, timestamp, rowid', (charId, )))
+
+    def getMemoryIndex(self, charId: int) -> memoryIndex.MemoryIndex:
+        """
+        Get the retrieval index over the memory chunks of a character, building it on first use.
+
+        Args:
+            charId (int): Character ID.
+
+        Returns:
+            memoryIndex.MemoryIndex: The index.
+        """
+        with self.memoryIndexLock:
+            if charId not in self.memoryIndexes:
+                index = memoryIndex.MemoryIndex(config.MEMORY_CHUNK_SIZE)
+                for i in self.db.query('select timestamp, text, tier from pastMemoriesFts where charId = ? order by tier desc, timestamp, rowid', (charId, )):
+                    index.add(i['timestamp'], i['text'], i['tier'])
+                self.memoryIndexes[charId] = index
+            return self.memoryIndexes[charId]
+
+    def retrieveMemories(self, charId: int, query: str, k: int = config.MEMORY_RETRIEVAL_TOP_K) -> list[dict[str, str | int | float]]:
+        """
+        Get the memory chunks of a character most relevant to a query.
+
+        Args:
+            charId (int): Character ID.
+            query (str): Text to look for, usually the latest turn of the conversation.
+            k (int, optional): Maximum number of chunks. Defaults to config.MEMORY_RETRIEVAL_TOP_K.
+
+        Returns:
+            list[dict[str, str | int | float]]: Chunks with `timestamp`, `text` and `score`, in chronological order.
+        """
+        return self.getMemoryIndex(charId).search(query, k)
+
+    def getRecentMemories(self, charId: int, tokenBudget: int = config.MEMORY_RECENT_TOKEN_LIMIT) -> list[dict[str, str | int]]:
+        """
+        Get the latest raw memory chunks of a character within a token budget.
+
+        Args:
+            charId (int): Character ID.
+            tokenBudget (int, optional): Maximum number of tokens. Defaults to config.MEMORY_RECENT_TOKEN_LIMIT.
+
+        Returns:
+            list[dict[str, str | int]]: Chunks with `timestamp` and `text`, in chronological order.
+        """
+        return self.getMemoryIndex(charId).recent(tokenBudget, models.TokenCounter, {MemoryTier.RAW})
+
+    def getMemorySummary(self, charId: int, tokenBudget: int = config.MEMORY_SUMMARY_TOKEN_LIMIT) -> list[dict[str, str | int]]:
+        """
+        Get the latest rollups of a character within a token budget, the long-term ones taking at most half of it
+        and the daily ones the rest, so neither tier crowds out the other.
+
+        Args:
+            charId (int): Character ID.
+            tokenBudget (int, optional): Maximum number of tokens. Defaults to config.MEMORY_SUMMARY_TOKEN_LIMIT.
+
+        Returns:
+            list[dict[str, str | int]]: Chunks with `timestamp` and `text`, long-term rollups first, each tier in chronological order.
+        """
+        index = self.getMemoryIndex(charId)
+        longTerm = index.recent(tokenBudget // 2, models.TokenCounter, {MemoryTier.LONG_TERM})
+        used = sum(models.TokenCounter(i['text']) for i in longTerm)
+        return longTerm + index.recent(tokenBudget - used, models.TokenCounter, {MemoryTier.DAILY})
+
+    def searchHistory(self, charId: int, query: str, limit: int = 20) -> dict[str, list[dict[str, str | int | float]]]:
+        """
+        Searches the chat history and the stored memories of a character.
+
+        Queries of at least three characters are matched as a phrase through the trigram index and ranked by BM25,
+        best match first. The trigram index can not match shorter queries, they fall back to a substring scan ordered
+        by recency which only covers the latest config.SEARCH_SHORT_QUERY_SCAN_ROWS messages of the character, read
+        through the (charName, timestamp) index, and the memories, which the memory tiers keep small.
+        The matched parts are wrapped with config.SEARCH_HIGHLIGHT.
+
+        Args:
+            charId (int): Character ID.
+            query (str): Text to search for.
+            limit (int, optional): Maximum number of results per source. Defaults to 20.
+
+        Returns:
+            dict[str, list[dict[str, str | int | float]]]: Dictionary with `messages`, the matching text messages, and
+            `memories`, snippets of the matching memories.
+        """
+        if not query.strip():
+            return {'messages': [], 'memories': []}
+        self.flushChatHistory()
+        begin, end = config.SEARCH_HIGHLIGHT
+
+        if len(query) >= 3:
+            match = '"' + query.replace('"', '""') + '"'
+            messages = self.db.query(
+                'select h.id, h.role, h.type, h.timestamp, highlight(chatHistoryFts, 0, ?, ?) as text, bm25(chatHistoryFts) as rank '
+                'from chatHistoryFts join chatHistory h on h.id = chatHistoryFts.rowid '
+                'where chatHistoryFts match ? and h.charName = (select charName from personalCharacter where id = ?) and h.type = ? '
+                'order by rank limit ?', (begin, end, match, charId, ChatHistoryType.TEXT, limit))
+            memories = self.db.query(
+                'select rowid as id, timestamp, snippet(pastMemoriesFts, 3, ?, ?, \'...\', 32) as text, bm25(pastMemoriesFts) as rank '
+                'from pastMemoriesFts where pastMemoriesFts match ? and charId = ? order by rank limit ?', (begin, end, match, charId, limit))
+        else:
+            # the trigram index can not match shorter queries (e.g. two-character Chinese words), scan the latest messages instead
+            pattern = '%' + query.replace('\\', '\\\\').replace(
+                '%', '\\%').replace('_', '\\_') + '%'
+            messages = self.db.query(
+                'select id, role, type, timestamp, text, 0 as rank from ('
+                'select id, role, type, timestamp, text from chatHistory where charName = (select charName from personalCharacter where id = ?) '
+                'order by timestamp desc limit ?) '
+                "where type = ? and text like ? escape '\\' order by timestamp desc, id desc limit ?",
+                (charId, config.SEARCH_SHORT_QUERY_SCAN_ROWS, ChatHistoryType.TEXT, pattern, limit))
+            memories = self.db.query(
+                'select rowid as id, timestamp, text, 0 as rank from pastMemoriesFts '
+                "where charId = ? and text like ? escape '\\' order by rowid desc limit ?", (charId, pattern, limit))
+            # like matches case-insensitively, so does the highlight
+            highlight = re.compile(re.escape(query), re.I)
+            for i in messages + memories:
+                i['text'] = highlight.sub(lambda m: f'{begin}{m.group(0)}{end}', str(i['text']))
+
+        return {
+            'messages': messages,
+            'memories': memories,
+        }
+
     def getCharacterAvatar(self, charId: int) -> tuple[str, bytes] | None:
         """
         Retrieves a character's avatar from the database.
@@ -729,6 +1473,7 @@ class DataProvider:
         """
         self.db.query("update personalCharacter set avatarMime = ?, avatar = ? where id = ?",
                       (image[0], image[1], charId))
+        self.invalidateCachedImages(lambda k: k == ('charAvatar', int(charId)))
 
     def updateAvatar(self, image: tuple[str, bytes]):
         """
@@ -739,6 +1484,7 @@ class DataProvider:
         """
         self.db.query(
             'update config set avatarMime = ?, avatar = ?', (image[0], image[1]))
+        self.invalidateCachedImages(lambda k: k == ('avatar', ))
 
     def getAvatar(self) -> tuple[str, bytes] | None:
         """
@@ -785,6 +1531,7 @@ class DataProvider:
         """
         self.db.query("insert into stickers (setId, name, image, mime) values (?, ?, ?, ?)",
                       (setId, stickerName, sticker[1], sticker[0]))
+        self.invalidateCachedImages(lambda k: k == ('sticker', str(setId), stickerName))
 
     def deleteSticker(self, id: str) -> None:
         """
@@ -793,7 +1540,11 @@ class DataProvider:
         Args:
             id (str): ID of the sticker.
         """
+        d = self.db.query(
+            "select setId, name from stickers where id = ?", (id, ), one=True)
         self.db.query("delete from stickers where id = ?", (id, ))
+        if d is not None:
+            self.invalidateCachedImages(lambda k: k == ('sticker', str(d['setId']), d['name']))
 
     def deleteStickerSet(self, name: str) -> None:
         """
@@ -804,6 +1555,7 @@ class DataProvider:
         """
         self.db.query("delete from stickerSets where setName = ?", (name, ))
         self.db.query("delete from stickers where setName = ?", (name, ))
+        self.invalidateCachedImages(lambda k: k[0] == 'sticker')
 
     def getSticker(self, setId: int, name: str) -> tuple[str, bytes]:
         """
@@ -875,9 +1627,21 @@ class DataProvider:
             setId (int): ID of the sticker set.
 
         Returns:
-            list[dict[str, str | int]]: List of stickers with their IDs, set IDs, and names.
+            list[dict[str, str | int | list[str]]]: List of stickers with their IDs, set IDs, names and keywords.
+        """
+        return [i | {'keywords': json.loads(i['keywords'])} for i in self.db.query(
+            'select id, setId, name, keywords from stickers where setId = ?', (setId, ), )]
+
+    def updateStickerKeywords(self, id: int, keywords: list[str]) -> None:
+        """
+        Updates the keywords a sticker is matched by, see stickerMapper.StickerMapper.
+
+        Args:
+            id (int): ID of the sticker.
+            keywords (list[str]): Emojis and words describing the sticker.
         """
-        return self.db.query('select id, setId, name from stickers where setId = ?', (setId, ), )
+        self.db.query("update stickers set keywords = ? where id = ?",
+                      (json.dumps(keywords, ensure_ascii=False), id))
 
     def parseAudio(self, audioPath: str) -> str:
         """
@@ -1038,12 +1802,17 @@ class DataProvider:
             list[dict[str, str]]: TTS input.
         """
 
+        prompt = models.PreprocessPrompt(config.TEXT_TO_SPEECH_EMOTION_MAPPING_PROMPT, {
+            'availableEmotions': ', '.join(i['name'] for i in availableEmotions),
+            'messageJSON': json.dumps(response)
+        })
+        # only validated mappings are cached, so a retry never gets an invalid response back
+        cacheKey = responseCache.ResponseCache.key(config.USE_LEGACY_MODEL, 1, prompt)
+        if responseCache.cache is not None and (cached := responseCache.cache.get(cacheKey)) is not None:
+            return json.loads(cached)
+
         for _ in range(config.MAX_CHAT_RETRY_COUNT):
             try:
-                prompt = models.PreprocessPrompt(config.TEXT_TO_SPEECH_EMOTION_MAPPING_PROMPT, {
-                    'availableEmotions': ', '.join(i['name'] for i in availableEmotions),
-                    'messageJSON': json.dumps(response)
-                })
                 logger.Logger.log(prompt)
                 s = models.BaseModelProvider(1).initiate(prompt)
 
@@ -1055,6 +1824,8 @@ class DataProvider:
                 for i in s:
                     if i['emotion'] not in [j['name'] for j in availableEmotions]:
                         raise RuntimeError(f'Invalid emotion: {i["emotion"]}')
+                if responseCache.cache is not None:
+                    responseCache.cache.put(cacheKey, json.dumps(s, ensure_ascii=False))
                 return s
             except Exception as e:
                 logger.Logger.log(str(e))
@@ -1386,6 +2157,7 @@ class DataProvider:
             id (int): ID of the THA4 service.
         """
         self.db.query("delete from THA4Services where id = ?", (id,))
+        self.invalidateCachedImages(lambda k: k == ('tha4Avatar', int(id)))
 
     def updateTHA4ServiceAvatar(self, id: int, avatar: bytes) -> None:
         """
@@ -1397,6 +2169,7 @@ class DataProvider:
         """
         self.db.query("update THA4Services set avatar = ? where id = ?",
                       (avatar, id))
+        self.invalidateCachedImages(lambda k: k == ('tha4Avatar', int(id)))
 
     def getTHA4ServiceAvatar(self, id: int) -> bytes:
         """
@@ -1415,6 +2188,97 @@ class DataProvider:
         return r['avatar']
 
 
+    def getCachedImage(self, key: tuple, loader: typing.Callable[[], tuple[str, bytes] | None]) -> tuple[str, bytes, str] | None:
+        """
+        Retrieves a small image through the in-memory image cache.
+
+        Args:
+            key (tuple): Cache key of the image, the mutators of the image invalidate this key.
+            loader (typing.Callable[[], tuple[str, bytes] | None]): Loads mime type and data of the image on cache misses.
+
+        Returns:
+            tuple[str, bytes, str] | None: Tuple containing mime type, data and SHA-256 digest (used as ETag) of the image if found, None otherwise.
+        """
+        r = self.imageCache.get(key)
+        if r is not None:
+            return r
+
+        generation = self.imageCacheGeneration
+        f = loader()
+        if f is None:
+            return None
+        r = (f[0], f[1], hashlib.sha256(f[1]).hexdigest())
+        if len(f[1]) <= config.IMAGE_CACHE_MAX_ENTRY_BYTES:
+            with self.imageCacheLock:
+                # an invalidation since the load may have changed the image, the loaded data could be stale
+                if generation == self.imageCacheGeneration:
+                    self.imageCache.put(key, r)
+        return r
+
+    def invalidateCachedImages(self, predicate: typing.Callable[[tuple], bool]) -> None:
+        """
+        Removes images from the in-memory image cache, after they were changed in the database.
+
+        Args:
+            predicate (typing.Callable[[tuple], bool]): Selects the cache keys to remove.
+        """
+        with self.imageCacheLock:
+            self.imageCacheGeneration += 1
+            self.imageCache.invalidate(predicate)
+
+    def getCachedCharacterAvatar(self, charId: int) -> tuple[str, bytes, str] | None:
+        """
+        Retrieves a character's avatar through the image cache.
+
+        Args:
+            charId (int): Character ID.
+
+        Returns:
+            tuple[str, bytes, str] | None: Tuple containing mime type, data and ETag of the avatar if found, None otherwise.
+        """
+        return self.getCachedImage(('charAvatar', int(charId)), lambda: self.getCharacterAvatar(charId))
+
+    def getCachedAvatar(self) -> tuple[str, bytes, str] | None:
+        """
+        Retrieves the user's avatar through the image cache.
+
+        Returns:
+            tuple[str, bytes, str] | None: Tuple containing mime type, data and ETag of the avatar if found, None otherwise.
+        """
+        return self.getCachedImage(('avatar', ), self.getAvatar)
+
+    def getCachedSticker(self, setId: int, name: str) -> tuple[str, bytes, str]:
+        """
+        Retrieves a specific sticker from a sticker set through the image cache.
+
+        Args:
+            setId (int): ID of the sticker set.
+            name (str): Name of the sticker.
+
+        Raises:
+            exceptions.StickerNotFound: If the sticker is not found.
+
+        Returns:
+            tuple[str, bytes, str]: Tuple containing mime type, data and ETag of the sticker.
+        """
+        return self.getCachedImage(('sticker', str(setId), name), lambda: self.getSticker(setId, name))
+
+    def getCachedTHA4ServiceAvatar(self, id: int) -> tuple[str, bytes, str] | None:
+        """
+        Retrieves a THA4 service's avatar through the image cache.
+
+        Args:
+            id (int): ID of the THA4 service.
+
+        Returns:
+            tuple[str, bytes, str] | None: Tuple containing mime type, data and ETag of the avatar if found, None otherwise.
+        """
+        def loader():
+            r = self.getTHA4ServiceAvatar(id)
+            return None if r is None else ('image/png', r)
+
+        return self.getCachedImage(('tha4Avatar', int(id)), loader)
+
     def getTha4MiddlewareAPI(self) -> str:
         """
         Get the URL of the THA4 middleware API.
@@ -1,5 +1,6 @@
 import mimetypes
 import os
+import time
 from pyexpat import model
 from re import I
 from typing import Any, Optional
@@ -11,22 +12,25 @@ import config
 import memory
 import conversation
 import chatModel
+import exceptions
 from langchain_core.messages import SystemMessage, HumanMessage
 import google.genai as genai
 import google.genai.types
 import google.ai.generativelanguage as glm
 import io
+import remoteFileCache
+import streamParser
 import workflowTools
 import webFrontend.extensionHandler
 
 
 class Chatbot:
-    def __init__(self, memory: memory.Memory, userName: str, enabled_tools: list[typing.Callable] = workflowTools.AvailableTools(), enabled_user_scripts: list[dict[str, str]] = [], enabled_extra_infos: list[dict[str, str]] = [], rtSession: bool = False) -> None:
+    def __init__(self, memory: memory.Memory, userName: str, enabled_tools: list[typing.Callable] = workflowTools.AvailableTools(), enabled_user_scripts: list[dict[str, str]] = [], enabled_extra_infos: list[dict[str, str]] | None = None, rtSession: bool = False) -> None:
         if rtSession:
             logger.Logger.log(
                 'Real time session detected, LLM initialization skipped.')
         self.toolsHandler = None if rtSession else webFrontend.extensionHandler.ToolsHandler(
-            None, memory.dataProvider, enabled_tools, enabled_user_scripts)
+            None, memory.dataProvider, enabled_tools, enabled_user_scripts, enabled_extra_infos)
         self._prompt = models.PreprocessPrompt(memory.createCharPromptFromCharacter(userName), {
             'generated_tool_descriptions': self.toolsHandler.generated_tool_descriptions,
             'extra_info': self.toolsHandler.generated_extra_infos
@@ -54,17 +58,59 @@ class Chatbot:
         else:
             self.userName = name
 
-    def begin(self, userInput: None | list[dict[str, str]]) -> str:
+    def prepareInput(self, userInput: list[dict[str, str]]) -> list[str | glm.File]:
+        """
+        Converts the messages of a turn into model input and appends the reference memory.
+
+        With config.MEMORY_EXTRACTION_PIPELINED the memory of the text parts is extracted as soon as the turn
+        arrives, while the attachments are loaded and converted, and waited for at most
+        config.MEMORY_EXTRACTION_DEADLINE seconds. The converted attachments are only sent to the extractor in
+        a follow-up if the text found no related memories, e.g. a turn of just an image.
+        """
+        if not config.MEMORY_EXTRACTION_PIPELINED:
+            modelInput = self.convertMessageListToInput(userInput)
+            self.conversation.storeUserInput({
+                'role': 'user',
+                'message': i,
+            } for i in modelInput)
+            referenceMemory = self.memoryExtractor.extractMemory({
+                'role': 'user',
+                'message': i,
+            } for i in modelInput)
+            modelInput.append(f"Reference memory: {referenceMemory.strip()}")
+            return modelInput
+
+        deadline = time.monotonic() + config.MEMORY_EXTRACTION_DEADLINE
+        pendingBotMessage = self.memoryExtractor.takePendingBotMessage()
+        messages = [{
+            'role': 'user',
+            'message': i['content'],
+        } for i in userInput if i['content_type'] == 'text']
+        extraction = self.memoryExtractor.extractMemoryAsync(
+            messages, deadline, pendingBotMessage) if messages else None
         modelInput = self.convertMessageListToInput(userInput)
         self.conversation.storeUserInput({
             'role': 'user',
             'message': i,
         } for i in modelInput)
-        referenceMemory = self.memoryExtractor.extractMemory({
+
+        referenceMemory = self.memoryExtractor.waitForMemory(
+            extraction, messages, deadline) if extraction is not None else conversation.MemoryExtractor.noRelatedMemories
+        attachments = [{
             'role': 'user',
             'message': i,
-        } for i in modelInput)
+        } for i in modelInput if not isinstance(i, str)]
+        if attachments and referenceMemory == conversation.MemoryExtractor.noRelatedMemories:
+            # the text alone relates to no memories, the attachments may
+            extraction = self.memoryExtractor.extractMemoryAsync(
+                messages + attachments, deadline, pendingBotMessage)
+            referenceMemory = self.memoryExtractor.waitForMemory(
+                extraction, messages, deadline)
         modelInput.append(f"Reference memory: {referenceMemory.strip()}")
+        return modelInput
+
+    def begin(self, userInput: None | list[dict[str, str]]) -> str:
+        modelInput = self.prepareInput(userInput)
         msg = self.toolsHandler.handleRawResponse(
             self.llm.initiate(modelInput))
         self.conversation.storeBotInput(msg)
@@ -88,15 +134,20 @@ class Chatbot:
                 'mime_type': mime
             }
         elif message['content_type'] == 'audio':
-            mime, binary = self.memory.dataProvider.getAttachment(
+            info = self.memory.dataProvider.getAttachmentInfo(
                 message['content'])
 
-            binary_data = io.BytesIO(binary)
-            self.llm.convert_pool_to_single() # once invoked upload api, it will convert the pool to single
-            self.memoryExtractor.llm.convert_pool_to_single(self.llm.getApiKey())
-            return self.llm.client.files.upload(file=binary_data, config={
-                'mime_type': mime,
-            })
+            # short voice messages go inline, no upload needed
+            if info['size'] <= config.AUDIO_INLINE_MAX_BYTES:
+                mime, binary = self.memory.dataProvider.getAttachment(
+                    message['content'])
+                return {
+                    'data': binary,
+                    'mime_type': mime
+                }
+            # uploaded by the chat model once it picked the key of the request, see remoteFileCache
+            return remoteFileCache.AttachmentReference(message['content'], info['contentType'],
+                                                       lambda: self.memory.dataProvider.getAttachment(message['content'])[1])
         else:
             raise ValueError(f'{__name__}: Unknown message type: {
                 message["type"]}')
@@ -105,22 +156,47 @@ class Chatbot:
         return [self.convertMessageToInput(i) for i in messages]
 
     def chat(self, userInput: list[dict[str, str]]) -> str:
-        modelInput = self.convertMessageListToInput(userInput)
-        self.conversation.storeUserInput({
-            'role': 'user',
-            'message': i,
-        } for i in modelInput)
-        referenceMemory = self.memoryExtractor.extractMemory({
-            'role': 'user',
-            'message': i,
-        } for i in modelInput)
-        modelInput.append(f"Reference memory: {referenceMemory.strip()}")
+        modelInput = self.prepareInput(userInput)
         msg = self.toolsHandler.handleRawResponse(self.llm.chat(modelInput))
         self.conversation.storeBotInput(msg)
         self.memoryExtractor.setPendingBotMessage(msg)
         logger.Logger.log(msg)
         return msg
 
+    def chatStream(self, userInput: list[dict[str, str]]) -> typing.Iterator[str]:
+        """
+        Streamed variant of chat, yields the `---` separated segments of the reply as soon as they are complete.
+
+        Intents at the end of the reply are handled once it is complete, their follow-up responses
+        are delivered through the `intermediate_response` event of the tools handler. A stream failing
+        before its first segment is started again, up to config.MAX_CHAT_RETRY_COUNT times.
+        """
+        modelInput = self.prepareInput(userInput)
+        # the whole stream is retried until its first segment was delivered, later failures reach the caller
+        for attempt in range(config.MAX_CHAT_RETRY_COUNT + 1):
+            segmenter = streamParser.ResponseSegmenter()
+            delivered = False
+            try:
+                chunks = self.llm.chat(modelInput, streamed=True)
+                if chunks is None:
+                    raise exceptions.MaxRetriesExceeded(f'{__name__}: Failed to start the reply stream')
+                for chunk in chunks:
+                    for segment in segmenter.feed(chunk.text or ''):
+                        delivered = True
+                        yield segment
+                break
+            except Exception as e:
+                if delivered or attempt == config.MAX_CHAT_RETRY_COUNT:
+                    raise
+                logger.Logger.log(f'{__name__}: Reply stream failed before its first segment, retrying: {e}')
+                time.sleep(self.llm.backoff_delay(attempt + 1))
+        yield from segmenter.close()
+        msg = self.toolsHandler.handleRawResponse(
+            segmenter.text) if segmenter.intents else segmenter.text
+        self.conversation.storeBotInput(msg)
+        self.memoryExtractor.setPendingBotMessage(msg)
+        logger.Logger.log(msg)
+
     def termination(self) -> None:
         summary = self.llm.chat(f'EOF')
         self.memory.storeMemory(self.userName, summary)
@@ -137,10 +213,14 @@ class Chatbot:
 
     def terminateChatWithSummary(self, summary: str) -> None:
         self.inChatting = False
+        if self.toolsHandler is not None:
+            self.toolsHandler.cancel()
         self.terminationWithSummary(summary)
 
     def terminateChat(self, force=False) -> None:
         self.inChatting = False
+        if self.toolsHandler is not None:
+            self.toolsHandler.cancel()
         if not force:
             self.termination()
 
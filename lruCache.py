@@ -0,0 +1,93 @@
+"""
+lruCache.py
+@biref Provides a thread-safe, size-bounded LRU cache.
+"""
+
+import collections
+import threading
+import typing
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache bounded by the total size of its values.
+
+    Args:
+        maxSize (int): Maximum total size of the cached values.
+        sizeOf (typing.Callable[[typing.Any], int], optional): Computes the size of a value. Defaults to 1 per entry.
+
+    Methods:
+        get(key, default): Get a value and mark it as recently used.
+        put(key, value): Insert a value, evicting the least recently used ones if needed.
+        pop(key): Remove a value.
+        invalidate(predicate): Remove all values whose key matches the predicate.
+        clear(): Remove all values.
+        stats(): Get hit/miss statistics.
+    """
+
+    def __init__(self, maxSize: int, sizeOf: typing.Callable[[typing.Any], int] = lambda v: 1) -> None:
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf
+        self.data: collections.OrderedDict[typing.Hashable, tuple[typing.Any, int]] = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key][0]
+
+    def put(self, key: typing.Hashable, value: typing.Any) -> None:
+        size = self.sizeOf(value)
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+            # values larger than the whole cache are not cached at all
+            if size > self.maxSize:
+                return
+            self.data[key] = (value, size)
+            self.size += size
+            while self.size > self.maxSize:
+                self.size -= self.data.popitem(last=False)[1][1]
+
+    def pop(self, key: typing.Hashable) -> typing.Any:
+        with self.lock:
+            if key not in self.data:
+                return None
+            value, size = self.data.pop(key)
+            self.size -= size
+            return value
+
+    def invalidate(self, predicate: typing.Callable[[typing.Hashable], bool]) -> None:
+        with self.lock:
+            for key in [i for i in self.data if predicate(i)]:
+                self.size -= self.data.pop(key)[1]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.data),
+                'size': self.size,
+                'maxSize': self.maxSize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        with self.lock:
+            return key in self.data
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.data)
@@ -4,6 +4,7 @@ memory.py
 """
 
 import os
+import time
 import json
 import config
 import logger
@@ -35,6 +36,41 @@ class Memory:
     def getPastMemories(self) -> str:
         return self.char['pastMemories']
 
+    @staticmethod
+    def formatMemories(chunks: list[dict[str, str | int]]) -> str:
+        return '\n'.join(
+            f"[{time.strftime('%Y-%m-%d', time.localtime(i['timestamp']))}] {i['text']}" if i['timestamp'] else i['text'] for i in chunks)
+
+    def getRecentMemories(self) -> str:
+        """
+        Returns the latest raw memories within config.MEMORY_RECENT_TOKEN_LIMIT tokens.
+        """
+        return self.formatMemories(self.dataProvider.getRecentMemories(self.char['id']))
+
+    def getMemorySummary(self) -> str:
+        """
+        Returns the long-term and daily rollups within config.MEMORY_SUMMARY_TOKEN_LIMIT tokens.
+        """
+        return self.formatMemories(self.dataProvider.getMemorySummary(self.char['id']))
+
+    def getPromptMemories(self) -> str:
+        """
+        Returns the rollups followed by the latest raw memories, used as the rolling memory of the prompts.
+        """
+        return '\n'.join(i for i in (self.getMemorySummary(), self.getRecentMemories()) if i)
+
+    def getMemoryVersion(self) -> int:
+        """
+        Returns a number which changes whenever memories are stored or edited.
+        """
+        return self.dataProvider.getMemoryIndex(self.char['id']).version
+
+    def getRelevantMemories(self, query: str) -> str:
+        """
+        Returns the memories most relevant to the given text, usually the latest turn of the conversation.
+        """
+        return self.formatMemories(self.dataProvider.retrieveMemories(self.char['id'], query))
+
     def getCharPrompt(self) -> str:
         return self.char['charPrompt']
     
@@ -62,16 +98,16 @@ class Memory:
         return self.char['tha4Service']
 
     def save(self) -> None:
+        # pastMemories is rendered again by updateCharacter, the copy of this object may predate a consolidation
         self.dataProvider.updateCharacter(self.dataProvider.getCharacterId(
-            self.getCharName()), self.getCharName(), self.getCharTTSUseModel(), self.getCharStickerSet(), self.getCharPrompt(), self.getPastMemories(), exampleChats=self.getExampleChats(), tha4Service=self.getCharTHA4Service())
+            self.getCharName()), self.getCharName(), self.getCharTTSUseModel(), self.getCharStickerSet(), self.getCharPrompt(), None, exampleChats=self.getExampleChats(), tha4Service=self.getCharTHA4Service())
+        self.char['pastMemories'] = self.dataProvider.renderMemories(self.char['id'])
 
     def storeMemory(self, userName: str, conversation: str) -> None:
-        self.char['pastMemories'] = self.char['pastMemories'].strip() + \
-            '\n' + conversation
-        if models.TokenCounter(self.char['pastMemories']) > config.MEMORY_SUMMARIZING_LIMIT:
-            self.char['pastMemories'] = models.MemorySummarizingModel(
-                self.getCharName(), self.char['pastMemories']).content
+        self.dataProvider.indexMemory(self.char['id'], conversation)
         self.save()
+        # overflowing memory tiers are summarized in the background, see memoryConsolidator
+        self.dataProvider.memoryConsolidator.schedule(self.char['id'], self.getCharName())
 
     def createCharPromptFromCharacter(self, userName):
         if self.rtSession:
@@ -80,7 +116,7 @@ class Memory:
                 'userName': userName,
                 'datePrompt': tools.TimeProvider(),
                 'charPrompt': self.getCharPrompt(),
-                'memoryPrompt': self.getPastMemories(),
+                'memoryPrompt': self.getPromptMemories(),
                 'exampleChats': self.getExampleChats(),
                 'availableEmotions': ', '.join(self.dataProvider.getAvailableTTSReferenceAudio(self.getCharTTSServiceId())),
                 'userPersona': self.dataProvider.getUserPersona(),
@@ -96,7 +132,7 @@ class Memory:
                 'userName': userName,
                 'datePrompt': tools.TimeProvider(),
                 'charPrompt': self.getCharPrompt(),
-                'memoryPrompt': self.getPastMemories(),
+                'memoryPrompt': self.getPromptMemories(),
                 'exampleChats': self.getExampleChats(),
                 'availableStickers': availableStickers,
                 'userPersona': self.dataProvider.getUserPersona(),
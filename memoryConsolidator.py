@@ -0,0 +1,157 @@
+"""
+memoryConsolidator.py
+@biref Provides background consolidation of the tiered memories of characters.
+"""
+
+import concurrent.futures
+import threading
+import time
+
+import config
+import logger
+import models
+
+
+class MemoryConsolidator:
+    """
+    Consolidates the stored memories of characters in the background.
+
+    Memories are kept in three tiers (see dataProvider.MemoryTier). When a tier exceeds its token limit,
+    its oldest memories are rolled up into the next tier: raw memories into one rollup per day, daily
+    rollups into long-term rollups, and long-term rollups into each other. Each run summarizes at most
+    config.MEMORY_CONSOLIDATION_MAX_TOKENS tokens per tier, so the cost of a write stays bounded while
+    a large backlog is worked off over several writes. Input larger than one model call is summarized
+    map-reduce style, with the chunks summarized in parallel.
+
+    Args:
+        dProvider (dataProvider.DataProvider): Data provider holding the memories.
+
+    Methods:
+        schedule(charId, charName): Consolidate the memories of a character in the background.
+        consolidate(charId, charName): Consolidate the memories of a character.
+        summarize(charName, memories): Summarize memories of any size into one text.
+    """
+
+    def __init__(self, dProvider: 'dataProvider.DataProvider') -> None:
+        self.dataProvider = dProvider
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.MEMORY_CONSOLIDATION_WORKERS)
+        self.running: set[int] = set()
+        self.pending: set[int] = set()
+        self.lock = threading.Lock()
+
+    def schedule(self, charId: int, charName: str) -> None:
+        """
+        Consolidate the memories of a character in the background.
+        Requests for a character which is being consolidated are coalesced into one more run.
+
+        Args:
+            charId (int): Character ID.
+            charName (str): Character name, used in the summarizing prompt.
+        """
+        with self.lock:
+            if charId in self.running:
+                self.pending.add(charId)
+                return
+            self.running.add(charId)
+
+        def worker():
+            while True:
+                try:
+                    self.consolidate(charId, charName)
+                except Exception as e:
+                    logger.Logger.log(f'Memory consolidation of {charName} failed:', e)
+                with self.lock:
+                    if charId not in self.pending:
+                        self.running.discard(charId)
+                        return
+                    self.pending.discard(charId)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def consolidate(self, charId: int, charName: str) -> None:
+        """
+        Consolidate the memories of a character.
+
+        Args:
+            charId (int): Character ID.
+            charName (str): Character name, used in the summarizing prompt.
+        """
+        import dataProvider
+
+        for tier, limit, target in [
+            (dataProvider.MemoryTier.RAW, config.MEMORY_RAW_TIER_LIMIT, dataProvider.MemoryTier.DAILY),
+            (dataProvider.MemoryTier.DAILY, config.MEMORY_DAILY_TIER_LIMIT, dataProvider.MemoryTier.LONG_TERM),
+            (dataProvider.MemoryTier.LONG_TERM, config.MEMORY_LONG_TERM_TIER_LIMIT, dataProvider.MemoryTier.LONG_TERM),
+        ]:
+            entries = self.dataProvider.getMemoryEntries(charId, tier)
+            sizes = [models.TokenCounter(i['text']) for i in entries]
+            overflow = sum(sizes) - limit
+            if overflow <= 0:
+                continue
+
+            # the oldest memories until the tier fits again, bounded per run
+            selected = []
+            budget = config.MEMORY_CONSOLIDATION_MAX_TOKENS
+            for entry, size in zip(entries, sizes):
+                if overflow <= 0 or (selected and size > budget):
+                    break
+                selected.append(entry)
+                overflow -= size
+                budget -= size
+
+            if tier == dataProvider.MemoryTier.RAW:
+                groups: dict[str, list[dict[str, str | int]]] = {}
+                for i in selected:
+                    groups.setdefault(time.strftime('%Y-%m-%d', time.localtime(i['timestamp'])), []).append(i)
+                groups = list(groups.values())
+            elif len(selected) > 1:
+                groups = [selected]
+            else:
+                # a single oversized long-term memory would be summarized again on every write
+                groups = []
+
+            for group in groups:
+                logger.Logger.log(f'Consolidating {len(group)} memories of {charName} from tier {tier} into tier {target}')
+                self.dataProvider.replaceMemoryEntries(charId, [i['id'] for i in group], target, max(
+                    i['timestamp'] for i in group), self.summarize(charName, [i['text'] for i in group]))
+
+    @staticmethod
+    def pack(texts: list[str], size: int) -> list[str]:
+        chunks = []
+        current, currentSize = [], 0
+        for i in texts:
+            tokens = models.TokenCounter(i)
+            if current and currentSize + tokens > size:
+                chunks.append('\n'.join(current))
+                current, currentSize = [], 0
+            current.append(i)
+            currentSize += tokens
+        if current:
+            chunks.append('\n'.join(current))
+        return chunks
+
+    def summarize(self, charName: str, memories: list[str]) -> str:
+        """
+        Summarize memories of any size into one text.
+        Memories are packed into chunks of config.MEMORY_CONSOLIDATION_CHUNK_TOKENS tokens which are summarized
+        in parallel, and the summaries are reduced the same way until one is left.
+
+        Args:
+            charName (str): Character name, used in the summarizing prompt.
+            memories (list[str]): Memories, oldest first.
+
+        Returns:
+            str: The summary.
+        """
+        chunks = self.pack(memories, config.MEMORY_CONSOLIDATION_CHUNK_TOKENS)
+        while True:
+            summaries = list(self.executor.map(
+                lambda i: models.MemorySummarizingModel(charName, i).strip(), chunks))
+            if len(summaries) == 1:
+                return summaries[0]
+            packed = self.pack(summaries, config.MEMORY_CONSOLIDATION_CHUNK_TOKENS)
+            if len(packed) >= len(chunks):
+                # the summaries do not shrink any further
+                return '\n'.join(summaries)
+            chunks = packed
@@ -0,0 +1,161 @@
+"""
+memoryIndex.py
+@biref Provides a BM25 retrieval index over the memory chunks of a character.
+"""
+
+import collections
+import itertools
+import math
+import re
+import threading
+import typing
+
+import numpy
+
+
+class MemoryIndex:
+    """
+    An in-memory BM25 index over timestamped memory chunks.
+
+    Memories are split into chunks of at most `chunkSize` characters along line boundaries.
+    Latin text is tokenized into lower-cased words, CJK text into single characters and bigrams,
+    so no word segmentation is needed.
+
+    Args:
+        chunkSize (int): Maximum length of a chunk in characters.
+        k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+        b (float, optional): BM25 length normalization. Defaults to 0.75.
+
+    Attributes:
+        version (int): Changes whenever chunks are added.
+
+    Methods:
+        add(timestamp, text, tier): Split a memory into chunks and add them to the index.
+        search(query, k): Get the k chunks most relevant to a query.
+        recent(budget, sizeOf, tiers): Get the latest chunks fitting into a budget.
+    """
+
+    wordPattern = re.compile(r'[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+    cjkPattern = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]')
+    # shared by all indexes, so a rebuilt index never reuses the version of the one it replaces
+    versions = itertools.count(1)
+
+    def __init__(self, chunkSize: int, k1: float = 1.5, b: float = 0.75) -> None:
+        self.chunkSize = chunkSize
+        self.k1 = k1
+        self.b = b
+        self.chunks: list[dict[str, str | int]] = []
+        # term -> ([chunk index], [term frequency])
+        self.postings: dict[str, tuple[list[int], list[int]]] = {}
+        self.lengths: list[int] = []
+        self.version = next(self.versions)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def tokenize(cls, text: str) -> list[str]:
+        result = []
+        for word in cls.wordPattern.findall(text.lower()):
+            if cls.cjkPattern.match(word):
+                result.extend(word)
+                result.extend(word[i:i + 2] for i in range(len(word) - 1))
+            else:
+                result.append(word)
+        return result
+
+    def splitChunks(self, text: str) -> list[str]:
+        chunks = []
+        current = ''
+        for line in text.splitlines():
+            line = line.strip()
+            while len(line) > self.chunkSize:
+                if current:
+                    chunks.append(current)
+                    current = ''
+                chunks.append(line[:self.chunkSize])
+                line = line[self.chunkSize:]
+            if not line:
+                continue
+            if current and len(current) + len(line) + 1 > self.chunkSize:
+                chunks.append(current)
+                current = ''
+            current = f'{current}\n{line}' if current else line
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def add(self, timestamp: int, text: str, tier: int = 0) -> None:
+        """
+        Split a memory into chunks and add them to the index.
+
+        Args:
+            timestamp (int): Time the memory was stored.
+            text (str): The memory.
+            tier (int, optional): Tier of the memory, see dataProvider.MemoryTier. Defaults to 0, raw memories.
+        """
+        with self.lock:
+            for chunk in self.splitChunks(text):
+                index = len(self.chunks)
+                terms = collections.Counter(self.tokenize(chunk))
+                for term, tf in terms.items():
+                    docs, tfs = self.postings.setdefault(term, ([], []))
+                    docs.append(index)
+                    tfs.append(tf)
+                self.chunks.append({'timestamp': timestamp, 'text': chunk, 'tier': tier})
+                self.lengths.append(sum(terms.values()))
+            self.version = next(self.versions)
+
+    def search(self, query: str, k: int) -> list[dict[str, str | int | float]]:
+        """
+        Get the k chunks most relevant to a query.
+
+        Args:
+            query (str): Text to look for, usually the latest turn of the conversation.
+            k (int): Maximum number of chunks.
+
+        Returns:
+            list[dict[str, str | int | float]]: Matching chunks with `timestamp`, `text` and `score`,
+            in chronological order.
+        """
+        with self.lock:
+            if not self.chunks:
+                return []
+            lengths = numpy.asarray(self.lengths, dtype=numpy.float32)
+            norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1))
+            scores = numpy.zeros(len(self.chunks), dtype=numpy.float32)
+            for term in set(self.tokenize(query)):
+                if term not in self.postings:
+                    continue
+                docs, tfs = self.postings[term]
+                docs = numpy.asarray(docs)
+                tfs = numpy.asarray(tfs, dtype=numpy.float32)
+                idf = math.log(1 + (len(self.chunks) - len(docs) + 0.5) / (len(docs) + 0.5))
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+            k = min(k, int(numpy.count_nonzero(scores)))
+            if k <= 0:
+                return []
+            best = numpy.argpartition(-scores, k - 1)[:k]
+            return [self.chunks[i] | {'score': float(scores[i])} for i in sorted(best)]
+
+    def recent(self, budget: int, sizeOf: typing.Callable[[str], int], tiers: set[int] | None = None) -> list[dict[str, str | int]]:
+        """
+        Get the latest chunks fitting into a budget.
+
+        Args:
+            budget (int): Maximum total size of the chunks.
+            sizeOf (typing.Callable[[str], int]): Computes the size of a chunk, e.g. its token count.
+            tiers (set[int] | None, optional): Only chunks of these tiers. Defaults to None, all chunks.
+
+        Returns:
+            list[dict[str, str | int]]: Chunks with `timestamp`, `text` and `tier`, in the order they were added.
+        """
+        with self.lock:
+            result = []
+            for chunk in reversed(self.chunks):
+                if tiers is not None and chunk['tier'] not in tiers:
+                    continue
+                budget -= sizeOf(chunk['text'])
+                if budget < 0:
+                    break
+                result.append(chunk)
+            return result[::-1]
@@ -5,6 +5,8 @@ Provides packages for model operating
 
 
 import tools
+import tokenCounter
+import responseCache
 import types
 import chatModel
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
@@ -65,9 +67,7 @@ MODEL_SAFETY_SETTING = [
 # google did not provide the fucking interface for counting token.
 # well, now I get it
 def TokenCounter(string: str) -> int:
-    import google.genai
-    client = google.genai.Client()
-    return client.models.count_tokens(model='gemini-2.5-flash', contents=string).total_tokens
+    return tokenCounter.counter.count(string)
 
 
 def PreprocessPrompt(originalPrompt: str, tVars):
@@ -86,6 +86,14 @@ def BaseModelProvider(temperature:float = 0.9) -> chatModel.ChatGoogleGenerative
     
 
 
+def CachedBaseModelResponse(prompt: str, temperature: float = 0.9) -> str:
+    # stateless single-turn requests, identical prompts get the cached response
+    if responseCache.cache is None:
+        return BaseModelProvider(temperature).initiate(prompt)
+    return responseCache.cache.cached(config.USE_LEGACY_MODEL, temperature, prompt,
+                                      lambda: BaseModelProvider(temperature).initiate(prompt))
+
+
 def ChatModelProvider(system_prompt: str) -> chatModel.ChatGoogleGenerativeAI:
     return chatModel.ChatGoogleGenerativeAI(
         model=config.USE_MODEL,
@@ -102,7 +110,15 @@ def EmojiToStickerInstrctionModel(text: str, availableStickers: list[str]) -> st
         'message': text,
         'availableStickers': availableStickers
     })
-    return BaseModelProvider(1).initiate(p)
+    return CachedBaseModelResponse(p, 1)
+
+
+def MemorySummarizingModel(charName: str, memories: str) -> str:
+    p = PreprocessPrompt(config.MEMORY_SUMMARIZING_PROMPT, {
+        'charName': charName,
+        'memories': memories
+    })
+    return BaseModelProvider(0.3).initiate(p)
 
 
 def ThinkingModelProvider(prompt: str) -> chatModel.ChatGoogleGenerativeAI:
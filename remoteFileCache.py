@@ -0,0 +1,148 @@
+"""
+remoteFileCache.py
+@biref Provides a cache of attachments uploaded to the Gemini Files API, per attachment and API key.
+"""
+
+import datetime
+import io
+import threading
+import typing
+
+from google import genai
+from google.genai import types
+
+import config
+import logger
+import lruCache
+
+
+class AttachmentReference:
+    """
+    An attachment to be sent as a remote file. It is only uploaded by RemoteFileCache.localize, once
+    the API key of the request is known.
+
+    Args:
+        attachmentId (str): Attachment ID.
+        mime (str): Mime type of the attachment.
+        loader (typing.Callable[[], bytes]): Loads the attachment data.
+    """
+
+    def __init__(self, attachmentId: str, mime: str, loader: typing.Callable[[], bytes]) -> None:
+        self.attachmentId = attachmentId
+        self.mime = mime
+        self.loader = loader
+
+    def __repr__(self) -> str:
+        return f'AttachmentReference({self.attachmentId!r}, {self.mime!r})'
+
+
+class RemoteFileCache:
+    """
+    Caches the remote files of uploaded attachments by attachment ID and API key.
+
+    Uploaded files are only visible to the key which uploaded them and expire after a while, so a file
+    is uploaded again when it is about to expire or when a request is sent with another key.
+    localize rewrites messages and chat history for the key in use, uploading missing files on demand
+    and AttachmentReferences for the first time, so chat models keep rotating their keys while attachments
+    are in the history. At most config.REMOTE_FILE_CACHE_SIZE attachments and files are tracked.
+
+    Methods:
+        upload(client, apiKey, attachmentId, mime, loader): Get the remote file of an attachment, uploading it if needed.
+        localize(client, apiKey, value): Point the remote files referenced by a message at files of an API key.
+    """
+
+    def __init__(self) -> None:
+        # (attachment id, api key) -> file
+        self.files = lruCache.LRUCache(config.REMOTE_FILE_CACHE_SIZE)
+        # file uri -> attachment id, for the files uploaded by this cache
+        self.origins = lruCache.LRUCache(config.REMOTE_FILE_CACHE_SIZE)
+        # attachment id -> (mime, loader of the attachment data)
+        self.sources = lruCache.LRUCache(config.REMOTE_FILE_CACHE_SIZE)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def isExpiring(file: types.File) -> bool:
+        if file.expiration_time is None:
+            return False
+        return file.expiration_time - datetime.timedelta(seconds=config.REMOTE_FILE_EXPIRY_MARGIN) <= datetime.datetime.now(datetime.timezone.utc)
+
+    def upload(self, client: genai.Client, apiKey: str, attachmentId: str, mime: str, loader: typing.Callable[[], bytes]) -> types.File:
+        """
+        Get the remote file of an attachment, uploading it if the key has none or it is about to expire.
+
+        Args:
+            client (genai.Client): Client of the API key.
+            apiKey (str): The API key.
+            attachmentId (str): Attachment ID.
+            mime (str): Mime type of the attachment.
+            loader (typing.Callable[[], bytes]): Loads the attachment data, only called when uploading.
+
+        Returns:
+            types.File: The remote file.
+        """
+        with self.lock:
+            self.sources.put(attachmentId, (mime, loader))
+            file = self.files.get((attachmentId, apiKey))
+            if file is not None and not self.isExpiring(file):
+                return file
+
+        file = client.files.upload(file=io.BytesIO(loader()), config={
+            'mime_type': mime,
+        })
+        logger.Logger.log(f'{__name__}: Uploaded attachment {attachmentId} with API key {apiKey[:8]}...')
+        with self.lock:
+            # the uris of replaced files are kept, the history may still reference them
+            self.files.put((attachmentId, apiKey), file)
+            self.origins.put(file.uri, attachmentId)
+        return file
+
+    def localizeUri(self, client: genai.Client, apiKey: str, uri: str | None) -> types.File | None:
+        # the file replacing an uri uploaded by this cache, None if the uri is still valid for the key
+        with self.lock:
+            attachmentId = self.origins.get(uri)
+            if attachmentId is None:
+                return None
+            file = self.files.get((attachmentId, apiKey))
+            if file is not None and file.uri == uri and not self.isExpiring(file):
+                return None
+            source = self.sources.get(attachmentId)
+            if source is None:
+                # no longer tracked, the file is sent as it is
+                return None
+            mime, loader = source
+        file = self.upload(client, apiKey, attachmentId, mime, loader)
+        return file if file.uri != uri else None
+
+    def localize(self, client: genai.Client, apiKey: str, value: typing.Any) -> typing.Any:
+        """
+        Point the remote files referenced by a message at files of an API key.
+
+        Args:
+            client (genai.Client): Client of the API key.
+            apiKey (str): The API key.
+            value (typing.Any): A message, a list of messages, or chat history contents.
+
+        Returns:
+            typing.Any: The value with the remote files replaced and the AttachmentReferences uploaded, the value itself if nothing changed.
+        """
+        if isinstance(value, AttachmentReference):
+            return self.upload(client, apiKey, value.attachmentId, value.mime, value.loader)
+        if isinstance(value, list):
+            result = [self.localize(client, apiKey, i) for i in value]
+            return value if all(a is b for a, b in zip(result, value)) else result
+        if not self.origins:
+            return value
+        if isinstance(value, types.File):
+            return self.localizeUri(client, apiKey, value.uri) or value
+        if isinstance(value, types.Part) and value.file_data is not None:
+            file = self.localizeUri(client, apiKey, value.file_data.file_uri)
+            if file is None:
+                return value
+            return value.model_copy(update={'file_data': types.FileData(file_uri=file.uri, mime_type=file.mime_type)})
+        if isinstance(value, types.Content) and value.parts:
+            parts = self.localize(client, apiKey, value.parts)
+            return value if parts is value.parts else value.model_copy(update={'parts': parts})
+        return value
+
+
+cache = RemoteFileCache()
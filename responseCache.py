@@ -0,0 +1,192 @@
+"""
+responseCache.py
+@biref Provides a two-tier cache for the responses of stateless model helpers.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+import typing
+
+import config
+import logger
+import lruCache
+
+
+class SqliteResponseStore:
+    """
+    A persistent response store in its own sqlite database, so lookups never wait for the chat database.
+
+    Args:
+        path (str): Path of the database file.
+        ttl (float): Seconds a response stays valid.
+
+    Methods:
+        get(key): Get a response which has not expired.
+        put(key, value): Store a response.
+        purge(): Delete expired responses.
+    """
+
+    def __init__(self, path: str, ttl: float) -> None:
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('pragma journal_mode = wal')
+        self.db.execute(
+            'create table if not exists responses (key text primary key, value text not null, expires real not null)')
+        self.db.commit()
+        self.purge()
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            row = self.db.execute(
+                'select value from responses where key = ? and expires > ?', (key, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key: str, value: str) -> None:
+        with self.lock:
+            self.db.execute('insert or replace into responses (key, value, expires) values (?, ?, ?)',
+                            (key, value, time.time() + self.ttl))
+            self.db.commit()
+
+    def purge(self) -> None:
+        with self.lock:
+            self.db.execute('delete from responses where expires <= ?', (time.time(), ))
+            self.db.commit()
+
+
+class ResponseCache:
+    """
+    Caches model responses by model, temperature and prompt.
+
+    Lookups go to an in-memory LRU tier first, then to an optional persistent store (see SqliteResponseStore),
+    whose hits are promoted to the memory tier. Prompts are compared with their whitespace collapsed, so
+    prompts differing only in indentation or line breaks share a response.
+
+    Args:
+        maxEntries (int): Maximum number of responses in the memory tier.
+        store (SqliteResponseStore | None, optional): Persistent tier, any object with `get(key)` and `put(key, value)`.
+            Defaults to None.
+
+    Methods:
+        key(model, temperature, prompt): Get the cache key of a request.
+        get(key): Get a cached response.
+        put(key, value): Cache a response.
+        cached(model, temperature, prompt, producer): Get a cached response or produce and cache it.
+        stats(): Get hit/miss statistics of both tiers.
+    """
+
+    def __init__(self, maxEntries: int, store: SqliteResponseStore | None = None) -> None:
+        self.memory = lruCache.LRUCache(maxEntries)
+        self.store = store
+        self.storeHits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, temperature: float, prompt: str) -> str:
+        """
+        Get the cache key of a request.
+
+        Args:
+            model (str): Model name.
+            temperature (float): Sampling temperature.
+            prompt (str): The complete prompt.
+
+        Returns:
+            str: Hex SHA-256 digest of the request.
+        """
+        return hashlib.sha256(f'{model}\0{float(temperature)}\0{" ".join(prompt.split())}'.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Get a cached response.
+
+        Args:
+            key (str): Cache key, see key.
+
+        Returns:
+            str | None: The response, None if it is not cached.
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                logger.Logger.log(f'{__name__}: Response store lookup failed: {e}')
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.storeHits += 1
+        self.memory.put(key, value)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Cache a response in both tiers.
+
+        Args:
+            key (str): Cache key, see key.
+            value (str): The response.
+        """
+        self.memory.put(key, value)
+        if self.store is not None:
+            try:
+                self.store.put(key, value)
+            except Exception as e:
+                logger.Logger.log(f'{__name__}: Response store write failed: {e}')
+
+    def cached(self, model: str, temperature: float, prompt: str, producer: typing.Callable[[], str]) -> str:
+        """
+        Get a cached response or produce and cache it.
+
+        Args:
+            model (str): Model name.
+            temperature (float): Sampling temperature.
+            prompt (str): The complete prompt.
+            producer (typing.Callable[[], str]): Sends the request on a cache miss.
+
+        Returns:
+            str: The response.
+        """
+        key = self.key(model, temperature, prompt)
+        value = self.get(key)
+        if value is None:
+            value = producer()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get hit/miss statistics of both tiers.
+
+        Returns:
+            dict[str, int]: Entries and hits of the memory tier, hits of the persistent tier and misses of both.
+        """
+        memory = self.memory.stats()
+        with self.lock:
+            return {
+                'entries': memory['entries'],
+                'memoryHits': memory['hits'],
+                'storeHits': self.storeHits,
+                'misses': self.misses,
+            }
+
+
+def createCache() -> ResponseCache | None:
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+    store = None
+    if config.RESPONSE_CACHE_PATH is not None:
+        try:
+            store = SqliteResponseStore(config.RESPONSE_CACHE_PATH, config.RESPONSE_CACHE_TTL)
+        except sqlite3.Error as e:
+            logger.Logger.log(f'{__name__}: Persistent response cache unavailable, using memory only: {e}')
+    return ResponseCache(config.RESPONSE_CACHE_MAX_ENTRIES, store)
+
+
+cache = createCache()
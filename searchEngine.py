@@ -0,0 +1,187 @@
+"""
+searchEngine.py
+@biref Provides cached web search with swappable backends for the SearchEngine tool.
+"""
+
+import abc
+import concurrent.futures
+import os
+import threading
+import time
+import typing
+
+import googleapiclient.discovery
+
+import config
+import logger
+import lruCache
+import memoryIndex
+
+
+class SearchBackend(abc.ABC):
+    """
+    Interface of search backends.
+
+    Methods:
+        search(query, page): Get a page of results.
+    """
+
+    @abc.abstractmethod
+    def search(self, query: str, page: int) -> list[dict[str, str]]:
+        """
+        Get a page of results.
+
+        Args:
+            query (str): The query.
+            page (int): Page number, starting at 1.
+
+        Returns:
+            list[dict[str, str]]: Results with `title`, `link` and `snippet`.
+        """
+
+
+class CustomSearchBackend(SearchBackend):
+    """
+    Google Custom Search, with the keys taken from the `google_search_engine_key` and `google_search_engine_cx_id`
+    environment variables. The service object is built once, on the first search.
+    """
+
+    pageSize = 10
+
+    def __init__(self) -> None:
+        self.service = None
+        self.lock = threading.Lock()
+
+    def getService(self) -> typing.Any:
+        with self.lock:
+            if self.service is None:
+                self.service = googleapiclient.discovery.build(
+                    'customsearch', 'v1', developerKey=os.environ.get('google_search_engine_key'), cache_discovery=False)
+            return self.service
+
+    def search(self, query: str, page: int) -> list[dict[str, str]]:
+        res = self.getService().cse().list(q=query, cx=os.environ.get('google_search_engine_cx_id'),
+                                           num=self.pageSize, start=self.pageSize * (page - 1) + 1).execute()
+        return [{
+            'title': item['title'],
+            'link': item['link'],
+            'snippet': item.get('snippet', ''),
+        } for item in res.get('items', [])]
+
+
+class LocalSearchBackend(SearchBackend):
+    """
+    Searches a fixed list of documents without network access, e.g. for tests or offline use, see CachedSearch.setBackend.
+    Documents are ranked by the number of query terms they contain.
+
+    Args:
+        documents (list[dict[str, str]]): Documents with `title`, `link` and `snippet`.
+        pageSize (int, optional): Results per page. Defaults to 10.
+    """
+
+    def __init__(self, documents: list[dict[str, str]], pageSize: int = 10) -> None:
+        self.documents = documents
+        self.pageSize = pageSize
+        self.calls = 0
+
+    def search(self, query: str, page: int) -> list[dict[str, str]]:
+        self.calls += 1
+        terms = set(memoryIndex.MemoryIndex.tokenize(query))
+        scored = []
+        for i in self.documents:
+            score = len(terms & set(memoryIndex.MemoryIndex.tokenize(f'{i["title"]} {i["snippet"]}')))
+            if score:
+                scored.append((score, i))
+        scored.sort(key=lambda i: -i[0])
+        return [i[1] for i in scored[self.pageSize * (page - 1):self.pageSize * page]]
+
+
+class CachedSearch:
+    """
+    Caches the results of a search backend by query and page for config.SEARCH_CACHE_TTL seconds.
+
+    Concurrent requests for the same page share one backend call, and with config.SEARCH_PREFETCH_NEXT_PAGE
+    the second page is fetched in the background when the first one is requested. Calls to a replaced backend
+    which are still running are not cached.
+
+    Args:
+        backend (SearchBackend): The backend.
+
+    Methods:
+        search(query, page): Get a page of results.
+        setBackend(backend): Replace the backend and drop the cached results.
+    """
+
+    def __init__(self, backend: SearchBackend) -> None:
+        self.backend = backend
+        # (query, page) -> (expiry, results)
+        self.cache = lruCache.LRUCache(config.SEARCH_CACHE_SIZE)
+        self.inflight: dict[tuple[str, int], concurrent.futures.Future] = {}
+        # bumped by setBackend, results of calls started before are dropped
+        self.generation = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='search')
+        self.lock = threading.Lock()
+
+    def setBackend(self, backend: SearchBackend) -> None:
+        """
+        Replace the backend and drop the cached results.
+
+        Args:
+            backend (SearchBackend): The new backend.
+        """
+        with self.lock:
+            self.backend = backend
+            self.generation += 1
+            self.inflight.clear()
+            self.cache.clear()
+
+    def request(self, key: tuple[str, int]) -> concurrent.futures.Future:
+        # the future of the backend call for a page, started unless one is running already
+        with self.lock:
+            if key in self.inflight:
+                return self.inflight[key]
+            future = self.executor.submit(self.backend.search, *key)
+            self.inflight[key] = future
+            generation = self.generation
+
+        def done(f: concurrent.futures.Future) -> None:
+            if f.exception() is not None:
+                logger.Logger.log(f'{__name__}: Search for {key} failed: {f.exception()}')
+            with self.lock:
+                if generation != self.generation:
+                    return
+                # cached before leaving the in-flight list, so no request in between calls the backend again
+                if f.exception() is None:
+                    self.cache.put(key, (time.time() + config.SEARCH_CACHE_TTL, f.result()))
+                self.inflight.pop(key, None)
+
+        future.add_done_callback(done)
+        return future
+
+    def lookup(self, key: tuple[str, int]) -> list[dict[str, str]] | None:
+        cached = self.cache.get(key)
+        if cached is None or cached[0] < time.time():
+            return None
+        return cached[1]
+
+    def search(self, query: str, page: int = 1) -> list[dict[str, str]]:
+        """
+        Get a page of results.
+
+        Args:
+            query (str): The query.
+            page (int, optional): Page number, starting at 1. Defaults to 1.
+
+        Returns:
+            list[dict[str, str]]: Results with `title`, `link` and `snippet`.
+        """
+        key = (' '.join(query.lower().split()), page)
+        results = self.lookup(key)
+        if results is None:
+            results = self.request(key).result()
+        if page == 1 and config.SEARCH_PREFETCH_NEXT_PAGE and results and self.lookup((key[0], 2)) is None:
+            self.request((key[0], 2))
+        return results
+
+
+engine = CachedSearch(CustomSearchBackend())
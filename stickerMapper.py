@@ -0,0 +1,186 @@
+"""
+stickerMapper.py
+@biref Provides a local, deterministic mapping from the emojis of model responses to sticker instructions.
+"""
+
+import json
+import re
+import typing
+
+import emoji
+
+
+# words describing an emotion, matched against sticker names and keywords, see hasKeyword
+EMOTION_KEYWORDS: dict[str, list[str]] = {
+    'happy': ['happy', 'smile', 'smiling', 'joy', 'glad', '开心', '高兴', '快乐', '微笑'],
+    'laugh': ['laugh', 'lol', 'haha', 'grin', '大笑', '哈哈', '笑死'],
+    'love': ['love', 'heart', 'kiss', 'like', '爱', '喜欢', '亲', '亲亲', '爱你', '比心'],
+    'shy': ['shy', 'blush', 'flushed', '害羞', '脸红'],
+    'sad': ['sad', 'unhappy', 'pleading', 'disappointed', '难过', '伤心', '委屈', '可怜'],
+    'cry': ['cry', 'crying', 'tear', 'sob', 'sobbing', '哭', '泪', '大哭', '哭哭', '哭泣', '流泪', '泪目'],
+    'angry': ['angry', 'mad', 'rage', 'pout', 'huff', '生气', '愤怒', '哼', '哼哼'],
+    'surprised': ['surprise', 'shock', 'astonish', 'wow', '惊讶', '震惊', '吃惊'],
+    'confused': ['confus', 'think', 'question', 'puzzl', '疑惑', '问号', '思考', '困惑'],
+    'sleepy': ['sleep', 'tired', 'yawn', '困', '睡', '累', '好困', '犯困', '睡觉', '晚安', '累了'],
+    'scared': ['scare', 'fear', 'afraid', 'scream', '害怕', '怕', '可怕', '吓'],
+    'proud': ['proud', 'smug', 'smirk', 'cool', 'sunglasses', '得意', '骄傲'],
+    'awkward': ['awkward', 'sweat', 'embarrass', '尴尬', '汗', '流汗'],
+    'ok': ['ok', 'okay', 'thumbs', 'good', 'yes', '好', '好的', '赞', '点赞', '可以'],
+    'hello': ['hello', 'hi', 'wave', 'waving', '你好', '嗨', '招手'],
+    'eat': ['eat', 'eating', 'food', 'yum', 'hungry', 'savoring', '吃', '饿', '吃饭', '饿了', '美味'],
+}
+
+
+def hasKeyword(words: set[str], keywords: list[str]) -> bool:
+    """
+    Check if the words of a text contain one of the keywords.
+
+    ASCII keywords match whole words, or the beginning of words if they are stems of four or more letters
+    (e.g. `confus` matches `confused`), so `hi` does not match `thinking`. CJK keywords of two or more
+    characters match anywhere within a word, single characters only a whole word, so `困` matches the
+    sticker `困` but not `困惑`.
+
+    Args:
+        words (set[str]): Words of the text, lower case.
+        keywords (list[str]): The keywords.
+
+    Returns:
+        bool: True if a keyword matches.
+    """
+    for keyword in keywords:
+        if keyword in words:
+            return True
+        if keyword.isascii():
+            if len(keyword) >= 4 and any(w.startswith(keyword) for w in words):
+                return True
+        elif len(keyword) >= 2 and any(keyword in w for w in words):
+            return True
+    return False
+
+
+# emotions of common emojis whose names do not contain any of the emotion keywords
+EMOJI_EMOTIONS: dict[str, str] = {
+    '😀': 'happy', '😃': 'happy', '😄': 'happy', '😊': 'happy', '🙂': 'happy', '☺': 'happy', '😇': 'happy',
+    '😁': 'laugh', '😆': 'laugh', '😂': 'laugh', '🤣': 'laugh',
+    '😍': 'love', '🥰': 'love', '😘': 'love', '😚': 'love',
+    '😳': 'shy', '🥺': 'sad', '😞': 'sad', '😔': 'sad', '😟': 'sad',
+    '😢': 'cry', '😭': 'cry', '😿': 'cry',
+    '😠': 'angry', '😡': 'angry', '😤': 'angry', '💢': 'angry',
+    '😮': 'surprised', '😯': 'surprised', '😲': 'surprised', '😵': 'surprised',
+    '🤔': 'confused', '😕': 'confused', '🧐': 'confused', '❓': 'confused',
+    '😴': 'sleepy', '🥱': 'sleepy', '💤': 'sleepy',
+    '😨': 'scared', '😰': 'scared', '😱': 'scared',
+    '😎': 'proud', '😏': 'proud',
+    '😅': 'awkward', '😓': 'awkward', '😬': 'awkward',
+    '👍': 'ok', '👌': 'ok', '👋': 'hello', '😋': 'eat',
+}
+
+# kept as they are, they are not emotions but part of the text (e.g. singing)
+PRESERVED_EMOJIS = {'🎵', '♪'}
+
+
+class StickerMapper:
+    """
+    Maps the emojis of a message to the stickers of a sticker set without a model call.
+
+    An emoji is mapped to the sticker which lists it among its keywords, else to a sticker
+    sharing its emotion (see EMOTION_KEYWORDS), else to a sticker whose name or keywords share
+    a word with the emoji's name. Emojis which match no sticker are ambiguous.
+
+    Args:
+        stickers (list[dict[str, str | int]]): Stickers of the set with `name` and `keywords`, see dataProvider.getStickerList.
+
+    Methods:
+        match(e): Get the sticker an emoji maps to.
+        map(text, fallback): Replace the emojis of a message with sticker instructions.
+    """
+
+    def __init__(self, stickers: list[dict[str, str | int]]) -> None:
+        self.stickers = []
+        for i in stickers:
+            keywords = i.get('keywords') or []
+            if isinstance(keywords, str):
+                keywords = json.loads(keywords)
+            description = ' '.join([i['name'], *keywords]).lower()
+            words = set(re.findall(r'\w+', description))
+            self.stickers.append({
+                'name': i['name'],
+                'emojis': {self.normalize(j['emoji']) for j in emoji.emoji_list(description)},
+                'words': words,
+                'emotions': {k for k, v in EMOTION_KEYWORDS.items() if hasKeyword(words, v)},
+            })
+
+    @staticmethod
+    def normalize(e: str) -> str:
+        # variation selectors and skin tones do not change the meaning
+        return re.sub('[️\U0001f3fb-\U0001f3ff]', '', e)
+
+    @staticmethod
+    def getEmotion(e: str) -> str | None:
+        if e in EMOJI_EMOTIONS:
+            return EMOJI_EMOTIONS[e]
+        words = set(re.findall(r'[a-z]+', emoji.demojize(e).lower()))
+        for k, v in EMOTION_KEYWORDS.items():
+            if hasKeyword(words, [w for w in v if w.isascii()]):
+                return k
+        return None
+
+    def match(self, e: str) -> str | None:
+        """
+        Get the sticker an emoji maps to.
+
+        Args:
+            e (str): The emoji.
+
+        Returns:
+            str | None: Name of the best matching sticker, None if no sticker matches.
+        """
+        e = self.normalize(e)
+        emotion = self.getEmotion(e)
+        words = set(re.findall(r'[a-z]+', emoji.demojize(e).lower())) - {'face', 'with', 'and'}
+        best, bestScore = None, 0
+        for i in self.stickers:
+            if e in i['emojis']:
+                score = 3
+            elif emotion is not None and emotion in i['emotions']:
+                score = 2
+            elif words & i['words']:
+                score = 1
+            else:
+                continue
+            if score > bestScore:
+                best, bestScore = i['name'], score
+        return best
+
+    def map(self, text: str, fallback: typing.Callable[[str], str] | None = None) -> str:
+        """
+        Replace the emojis of a message with sticker instructions, e.g. `(happy)`.
+        Repeated emojis mapping to the same sticker become a single instruction.
+
+        Args:
+            text (str): The message.
+            fallback (typing.Callable[[str], str] | None, optional): Called with the original message if an emoji
+                is ambiguous, e.g. models.EmojiToStickerInstrctionModel. Defaults to None, which leaves ambiguous
+                emojis in place.
+
+        Returns:
+            str: The message with sticker instructions.
+        """
+        result = []
+        last = 0
+        previous = None
+        for i in emoji.emoji_list(text):
+            if i['emoji'] in PRESERVED_EMOJIS:
+                continue
+            name = self.match(i['emoji'])
+            if name is None and fallback is not None:
+                return fallback(text)
+            result.append(text[last:i['match_start']])
+            if name is None:
+                result.append(i['emoji'])
+            elif not (previous == name and last == i['match_start']):
+                result.append(f'({name})')
+            previous = name
+            last = i['match_end']
+        result.append(text[last:])
+        return ''.join(result)
@@ -0,0 +1,63 @@
+"""
+streamParser.py
+@biref Provides incremental parsing of streamed model responses into message segments.
+"""
+
+
+class ResponseSegmenter:
+    """
+    Splits a streamed model response into its `---` separated message segments as soon as they are complete.
+
+    Everything from the `<intents>` tag on is kept out of the segments, so tool invocations at the end
+    of a response are never shown to the user.
+
+    Attributes:
+        text (str): The whole response received so far.
+        intents (str): The `<intents>` part of the response, empty if there is none so far.
+
+    Methods:
+        feed(delta): Add streamed text and get the segments completed by it.
+        close(): Get the last segment once the stream has ended.
+    """
+
+    separator = '---'
+    intentsTag = '<intents>'
+
+    def __init__(self) -> None:
+        self.text = ''
+        self.intents = ''
+        self.buffer = ''
+
+    def feed(self, delta: str) -> list[str]:
+        """
+        Add streamed text and get the segments completed by it.
+
+        Args:
+            delta (str): The next piece of the response.
+
+        Returns:
+            list[str]: Completed, non-empty segments.
+        """
+        self.text += delta
+        if self.intents:
+            self.intents += delta
+            return []
+
+        self.buffer += delta
+        if self.intentsTag in self.buffer:
+            idx = self.buffer.find(self.intentsTag)
+            self.intents = self.buffer[idx:]
+            self.buffer = self.buffer[:idx]
+
+        *completed, self.buffer = self.buffer.split(self.separator)
+        return [i.strip() for i in completed if i.strip()]
+
+    def close(self) -> list[str]:
+        """
+        Get the last segment once the stream has ended.
+
+        Returns:
+            list[str]: The last segment, or nothing if it is empty.
+        """
+        last, self.buffer = self.buffer.strip(), ''
+        return [last] if last else []
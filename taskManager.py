@@ -154,6 +154,49 @@ class TaskManager():
         t.start()
         return cur_id
     
+    def runAttachmentMigration(self, batchSize: int = 64, vacuum: bool = True):
+        # create task in database
+        stages = {
+            "current_stage": 0,
+            "total_stages": [
+                "Move attachments to blob store",
+                "Vacuum database"
+            ]
+        }
+        cur_id = self.createTask(stages)
+        def wrapper():
+            self.updateTaskStatus("running", cur_id)
+            # move attachment contents
+            self.updateTaskStage(1, cur_id)
+            self.updateTaskLog("Moving attachments to blob store...", cur_id)
+            try:
+                moved = self.dataProvider.migrateAttachmentsToBlobStore(
+                    batchSize, lambda n: self.updateTaskLog(f"Moved {n} attachments", cur_id))
+                self.updateTaskLog(f"Moved {moved} attachments to blob store", cur_id)
+            except Exception as e:
+                self.updateTaskStatus("failed", cur_id)
+                self.updateTaskLog(f"Failed to move attachments: {e}", cur_id)
+                return
+
+            # reclaim the space of the moved blobs
+            self.updateTaskStage(2, cur_id)
+            if vacuum:
+                self.updateTaskLog("Vacuuming database...", cur_id)
+                try:
+                    self.dataProvider.db.runScript("vacuum")
+                except Exception as e:
+                    self.updateTaskStatus("failed", cur_id)
+                    self.updateTaskLog(f"Failed to vacuum database: {e}", cur_id)
+                    return
+
+            # task completed
+            self.updateTaskStatus("completed", cur_id)
+            self.updateTaskLog("Attachment migration completed successfully", cur_id)
+
+        t = threading.Thread(target=wrapper)
+        t.start()
+        return cur_id
+
     def getTaskInfo(self, taskId: int):
         if not self.checkIfTaskExists(taskId):
             raise ValueError("Task with id {} does not exist".format(taskId))
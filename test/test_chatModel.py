@@ -0,0 +1,77 @@
+import google.genai.errors
+from google.genai import types
+
+import chatModel
+import config
+
+
+class FakeSession:
+    def __init__(self, failures: int, error: Exception | None = None) -> None:
+        self.failures = failures
+        self.error = error or google.genai.errors.ClientError(
+            429, {'error': {'message': 'quota exceeded', 'status': 'RESOURCE_EXHAUSTED'}})
+        self.sent = 0
+
+    def send_message_stream(self, msg):
+        self.sent += 1
+        failing = self.failures > 0
+        self.failures -= 1
+
+        def chunks():
+            # like the real stream, the request is only sent once the first chunk is read
+            if failing:
+                raise self.error
+            for i in range(3):
+                yield types.GenerateContentResponse(
+                    candidates=[types.Candidate(content=types.Content(role='model', parts=[types.Part(text=f'{i}')]))],
+                    usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=100, total_token_count=110 + i))
+        return chunks()
+
+    def get_history(self):
+        return []
+
+
+class FakeModel(chatModel.ChatGoogleGenerativeAI):
+    session = None
+
+    def create_session(self, history=None):
+        return self.session
+
+    def prepare_files(self, msg):
+        return msg
+
+
+def test_stream_retries_rate_limit_on_first_chunk(monkeypatch):
+    monkeypatch.setattr(config, 'CHAT_RETRY_BASE_DELAY', 0)
+    session = FakeSession(failures=1)
+    model = FakeModel('model', api_key_pool=['test-key-1', 'test-key-2'])
+    model.session = session
+    model.chat_session = session
+    inflight = sum(i['inflight'] for i in model.api_key_pool.stats())
+
+    chunks = model.chat(['hi'], streamed=True)
+
+    # the failed attempt is retried before the caller sees any chunk
+    assert session.sent == 2
+    assert ''.join(i.text for i in chunks) == '012'
+    assert model.token_count == 112
+    assert model.prompt_token_count == 100
+
+    stats = model.api_key_pool.stats()
+    assert sum(i['failures'] for i in stats) == 1
+    assert sum(i['tokens'] for i in stats) == 112
+    assert sum(i['inflight'] for i in stats) == inflight
+
+
+def test_stream_retries_overloaded_server(monkeypatch):
+    monkeypatch.setattr(config, 'CHAT_RETRY_BASE_DELAY', 0)
+    session = FakeSession(failures=2, error=google.genai.errors.ServerError(
+        503, {'error': {'message': 'model overloaded', 'status': 'UNAVAILABLE'}}))
+    model = FakeModel('model', api_key_pool=['test-key-1', 'test-key-2'])
+    model.session = session
+    model.chat_session = session
+
+    chunks = model.chat(['hi'], streamed=True)
+
+    assert session.sent == 3
+    assert ''.join(i.text for i in chunks) == '012'
@@ -0,0 +1,54 @@
+import types
+
+import pytest
+
+import config
+import instance
+
+
+class FakeLLM:
+    def __init__(self, replies: list[list[str | Exception]]) -> None:
+        self.replies = replies
+        self.calls = 0
+
+    @staticmethod
+    def backoff_delay(attempt: int) -> float:
+        return 0
+
+    def chat(self, modelInput, streamed=False):
+        reply = self.replies[self.calls]
+        self.calls += 1
+
+        def chunks():
+            for i in reply:
+                if isinstance(i, Exception):
+                    raise i
+                yield types.SimpleNamespace(text=i)
+        return chunks()
+
+
+def createChatbot(replies: list[list[str | Exception]]) -> instance.Chatbot:
+    bot = instance.Chatbot.__new__(instance.Chatbot)
+    bot.llm = FakeLLM(replies)
+    bot.prepareInput = lambda userInput: ['hi']
+    bot.conversation = types.SimpleNamespace(storeBotInput=lambda msg: None)
+    bot.memoryExtractor = types.SimpleNamespace(setPendingBotMessage=lambda msg: None)
+    return bot
+
+
+def test_stream_failing_before_first_segment_is_retried():
+    bot = createChatbot([['Hel', RuntimeError('503 overloaded')], ['Hello', '\n---\n', 'there']])
+
+    assert list(bot.chatStream([])) == ['Hello', 'there']
+    assert bot.llm.calls == 2
+
+
+def test_stream_failing_after_a_segment_is_raised(monkeypatch):
+    monkeypatch.setattr(config, 'MAX_CHAT_RETRY_COUNT', 3)
+    bot = createChatbot([['Hello\n---\n', RuntimeError('503 overloaded')]] * 4)
+    segments = bot.chatStream([])
+
+    assert next(segments) == 'Hello'
+    with pytest.raises(RuntimeError):
+        next(segments)
+    assert bot.llm.calls == 1
@@ -0,0 +1,117 @@
+import concurrent.futures
+import threading
+import time
+
+import config
+import conversation
+import instance
+import lruCache
+
+
+class FakeLLM:
+    def __init__(self, delay: float = 0) -> None:
+        self.received = []
+        self.started = threading.Event()
+        self.delay = delay
+        self.chat_session = None
+
+    def initiate(self, messages):
+        self.started.set()
+        self.received.append(list(messages))
+        self.chat_session = 'session'
+        time.sleep(self.delay)
+        return 'Bob showed a photo of his cat.'
+
+    chat = initiate
+
+
+class FakeDataProvider:
+    def __init__(self) -> None:
+        # whether the extraction had started when the attachment was loaded
+        self.extractionStarted = None
+        self.waitForExtraction = False
+        self.llm = None
+
+    def getAttachment(self, attachmentId):
+        self.extractionStarted = self.llm.started.wait(1) if self.waitForExtraction else self.llm.started.is_set()
+        return ('image/png', b'\x89PNG')
+
+
+class FakeMemory:
+    def __init__(self, relevant: str = '') -> None:
+        self.relevant = relevant
+        self.dataProvider = FakeDataProvider()
+
+    def getCharName(self):
+        return 'Alice'
+
+    def getRelevantMemories(self, query):
+        return self.relevant
+
+    def getMemoryVersion(self):
+        return 0
+
+
+def createChatbot(monkeypatch, relevant: str = '', delay: float = 0) -> tuple[instance.Chatbot, FakeLLM]:
+    monkeypatch.setattr(config, 'MEMORY_EXTRACTION_PIPELINED', True)
+    memory = FakeMemory(relevant)
+    llm = FakeLLM(delay)
+    memory.dataProvider.llm = llm
+    extractor = conversation.MemoryExtractor.__new__(conversation.MemoryExtractor)
+    extractor.chat_session = conversation.ConversationMemory('Bob', memory)
+    extractor.memory = memory
+    extractor.llm = llm
+    extractor.isInitiated = False
+    extractor.pendingBotMessage = None
+    extractor.cache = lruCache.LRUCache(16)
+    extractor.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    bot = instance.Chatbot.__new__(instance.Chatbot)
+    bot.memory = memory
+    bot.conversation = extractor.chat_session
+    bot.memoryExtractor = extractor
+    return bot, llm
+
+
+def test_attachment_only_turn_reaches_extractor(monkeypatch):
+    bot, llm = createChatbot(monkeypatch)
+    modelInput = bot.prepareInput([{'content_type': 'image', 'content': 'attachment'}])
+
+    assert len(llm.received) == 1
+    assert {'data': b'\x89PNG', 'mime_type': 'image/png'} in llm.received[0]
+    assert modelInput[-1] == 'Reference memory: Bob showed a photo of his cat.'
+
+
+def test_text_turn_without_related_memories_skips_extractor(monkeypatch):
+    bot, llm = createChatbot(monkeypatch)
+    modelInput = bot.prepareInput([{'content_type': 'text', 'content': 'Good morning'}])
+
+    assert llm.received == []
+    assert modelInput[-1] == f'Reference memory: {conversation.MemoryExtractor.noRelatedMemories}'
+
+
+def test_text_extraction_starts_before_attachments_are_loaded(monkeypatch):
+    bot, llm = createChatbot(monkeypatch, relevant='Bob has a cat.')
+    bot.memory.dataProvider.waitForExtraction = True
+    modelInput = bot.prepareInput([
+        {'content_type': 'text', 'content': 'Look at my cat'},
+        {'content_type': 'image', 'content': 'attachment'},
+    ])
+
+    assert bot.memory.dataProvider.extractionStarted
+    # the text found related memories, no follow-up with the attachment
+    assert len(llm.received) == 1
+    assert all(isinstance(i, str) for i in llm.received[0])
+    assert modelInput[-1] == 'Reference memory: Bob showed a photo of his cat.'
+
+
+def test_late_extraction_is_dropped(monkeypatch):
+    monkeypatch.setattr(config, 'MEMORY_EXTRACTION_DEADLINE', 0.05)
+    bot, llm = createChatbot(monkeypatch, relevant='Bob has a cat.', delay=0.2)
+    modelInput = bot.prepareInput([{'content_type': 'text', 'content': 'Look at my cat'}])
+    bot.memoryExtractor.executor.shutdown(wait=True)
+
+    assert modelInput[-1] == 'Reference memory: Bob has a cat.'
+    # the late result is not part of the extraction session
+    assert not bot.memoryExtractor.isInitiated
+    assert llm.chat_session is None
@@ -0,0 +1,41 @@
+import types
+
+import dataProvider
+import memoryIndex
+
+
+def createProvider(monkeypatch, memories: list[tuple[int, str]]) -> types.SimpleNamespace:
+    # one token per word
+    monkeypatch.setattr(dataProvider.models, 'TokenCounter', lambda string: len(string.split()))
+    index = memoryIndex.MemoryIndex(512)
+    # in the order of DataProvider.getMemoryIndex: highest tier first
+    for timestamp, (tier, text) in sorted(enumerate(memories), key=lambda i: -i[1][0]):
+        index.add(timestamp, text, tier)
+    provider = types.SimpleNamespace(getMemoryIndex=lambda charId: index)
+    return provider
+
+
+def test_rollups_stay_in_the_prompt_next_to_many_raw_memories(monkeypatch):
+    raw = [(dataProvider.MemoryTier.RAW, f'raw memory number {i}') for i in range(50)]
+    provider = createProvider(monkeypatch, [
+        (dataProvider.MemoryTier.LONG_TERM, 'Alice met Bob at school'),
+        (dataProvider.MemoryTier.DAILY, 'Bob adopted a cat'),
+        *raw,
+    ])
+
+    recent = dataProvider.DataProvider.getRecentMemories(provider, 1, 8)
+    summary = dataProvider.DataProvider.getMemorySummary(provider, 1, 16)
+
+    assert [i['text'] for i in recent] == ['raw memory number 48', 'raw memory number 49']
+    assert [i['text'] for i in summary] == ['Alice met Bob at school', 'Bob adopted a cat']
+
+
+def test_summary_is_bounded_and_keeps_both_tiers(monkeypatch):
+    provider = createProvider(monkeypatch, [
+        *[(dataProvider.MemoryTier.LONG_TERM, f'long term rollup {i}') for i in range(10)],
+        *[(dataProvider.MemoryTier.DAILY, f'daily rollup {i}') for i in range(10)],
+    ])
+
+    summary = [i['text'] for i in dataProvider.DataProvider.getMemorySummary(provider, 1, 16)]
+
+    assert summary == ['long term rollup 8', 'long term rollup 9', 'daily rollup 8', 'daily rollup 9']
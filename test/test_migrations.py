@@ -0,0 +1,19 @@
+import pytest
+import sqlite3
+
+import dataProvider
+
+
+def test_failed_script_is_rolled_back(tmp_path):
+    db = dataProvider.DatabaseObject(str(tmp_path / 'test.db'))
+    db.runScript('create table t (a int);')
+
+    with pytest.raises(sqlite3.Error):
+        db.runScript('begin; alter table t add column b int; select nosuchfunction(); pragma user_version = 1; commit;')
+    # the next write must not commit the half-applied script
+    db.query('insert into t (a) values (1)')
+
+    assert [i['name'] for i in db.query('pragma table_info(t)')] == ['a']
+    assert db.query('pragma user_version')[0]['user_version'] == 0
+    db.runScript('begin; alter table t add column b int; pragma user_version = 1; commit;')
+    assert db.query('pragma user_version')[0]['user_version'] == 1
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import config
+import searchEngine
+
+
+DOCUMENTS = [{'title': f'Cat {i}', 'link': f'https://example.com/{i}', 'snippet': 'about cats'} for i in range(15)]
+
+
+class GatedBackend(searchEngine.LocalSearchBackend):
+    """Blocks every search until the gate is opened."""
+
+    def __init__(self, documents: list[dict[str, str]]) -> None:
+        super().__init__(documents)
+        self.gate = threading.Event()
+
+    def search(self, query: str, page: int) -> list[dict[str, str]]:
+        self.gate.wait(5)
+        return super().search(query, page)
+
+
+def createSearch(monkeypatch, backend: searchEngine.SearchBackend) -> searchEngine.CachedSearch:
+    monkeypatch.setattr(config, 'SEARCH_PREFETCH_NEXT_PAGE', False)
+    return searchEngine.CachedSearch(backend)
+
+
+def test_backend_interface_is_abstract():
+    assert searchEngine.SearchBackend.__abstractmethods__ == {'search'}
+
+
+def test_cache_hit(monkeypatch):
+    backend = searchEngine.LocalSearchBackend(DOCUMENTS)
+    search = createSearch(monkeypatch, backend)
+
+    first = search.search('cats')
+    # queries differing only in case and spacing share the entry
+    assert search.search('  Cats ') == first
+    assert len(first) == 10
+    assert backend.calls == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    backend = searchEngine.LocalSearchBackend(DOCUMENTS)
+    search = createSearch(monkeypatch, backend)
+    search.search('cats')
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + config.SEARCH_CACHE_TTL + 1)
+    search.search('cats')
+    assert backend.calls == 2
+
+
+def test_concurrent_requests_share_one_call(monkeypatch):
+    backend = GatedBackend(DOCUMENTS)
+    search = createSearch(monkeypatch, backend)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(search.search('cats'))) for _ in range(4)]
+    for i in threads:
+        i.start()
+    time.sleep(0.1)
+    backend.gate.set()
+    for i in threads:
+        i.join()
+
+    assert len(results) == 4
+    assert backend.calls == 1
+
+
+def test_second_page_is_prefetched(monkeypatch):
+    backend = searchEngine.LocalSearchBackend(DOCUMENTS)
+    search = createSearch(monkeypatch, backend)
+    monkeypatch.setattr(config, 'SEARCH_PREFETCH_NEXT_PAGE', True)
+
+    search.search('cats')
+    search.request(('cats', 2)).result()
+    assert backend.calls == 2
+    assert len(search.search('cats', 2)) == 5
+    assert backend.calls == 2
+
+
+def test_replaced_backend_results_are_dropped(monkeypatch):
+    old = GatedBackend([{'title': 'Old', 'link': 'https://example.com/old', 'snippet': 'cats'}])
+    search = createSearch(monkeypatch, old)
+    stale = search.request(('cats', 1))
+
+    search.setBackend(searchEngine.LocalSearchBackend(DOCUMENTS))
+    old.gate.set()
+    stale.result()
+    # the completion callback runs right after the result is set
+    time.sleep(0.05)
+
+    assert search.lookup(('cats', 1)) is None
+    assert search.search('cats')[0]['title'] == 'Cat 0'
@@ -0,0 +1,34 @@
+import os
+import types
+
+import config
+import dataProvider
+
+
+def createProvider(tmp_path, messages: list[str]) -> types.SimpleNamespace:
+    db = dataProvider.DatabaseObject(str(tmp_path / 'test.db'))
+    with open(os.path.join(os.path.dirname(__file__), '..', 'blob', 'init.sql')) as file:
+        db.runScript(file.read())
+    db.runScript("create virtual table pastMemoriesFts using fts5(charId unindexed, timestamp unindexed, tier unindexed, text, tokenize='trigram');")
+    db.query("insert into personalCharacter (charName, charPrompt, initialMemories, exampleChats, pastMemories, avatar, creationTime) "
+             "values ('Alice', '', '', '', '', x'', 0)")
+    for timestamp, text in enumerate(messages):
+        db.query('insert into chatHistory (charName, role, type, text, timestamp) values (?, ?, ?, ?, ?)',
+                 ('Alice', 0, dataProvider.ChatHistoryType.TEXT, text, timestamp))
+    return types.SimpleNamespace(db=db, flushChatHistory=lambda: None)
+
+
+def test_short_query_highlight_ignores_case(tmp_path):
+    provider = createProvider(tmp_path, ['Ok then', 'OK!', 'nothing'])
+    begin, end = config.SEARCH_HIGHLIGHT
+
+    result = dataProvider.DataProvider.searchHistory(provider, 1, 'ok')
+
+    assert [i['text'] for i in result['messages']] == [f'{begin}OK{end}!', f'{begin}Ok{end} then']
+
+
+def test_short_query_only_scans_latest_messages(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'SEARCH_SHORT_QUERY_SCAN_ROWS', 2)
+    provider = createProvider(tmp_path, ['你好', 'a', 'b'])
+
+    assert dataProvider.DataProvider.searchHistory(provider, 1, '你好')['messages'] == []
@@ -0,0 +1,41 @@
+import stickerMapper
+
+
+def createMapper(*names: str) -> stickerMapper.StickerMapper:
+    return stickerMapper.StickerMapper([{'name': i, 'keywords': []} for i in names])
+
+
+def test_short_keywords_do_not_match_inside_emoji_names():
+    # shushing_face contains "hi", smoking contains "ok"
+    assert stickerMapper.StickerMapper.getEmotion('🤫') is None
+    assert createMapper('hello', 'ok').match('🤫') is None
+
+
+def test_short_keywords_do_not_match_inside_sticker_names():
+    mapper = createMapper('thinking', 'looking', 'sweat')
+    emotions = {i['name']: i['emotions'] for i in mapper.stickers}
+    assert emotions['thinking'] == {'confused'}
+    assert emotions['looking'] == set()
+    assert emotions['sweat'] == {'awkward'}
+
+
+def test_single_cjk_characters_only_match_whole_names():
+    mapper = createMapper('困惑', '好奇', '困')
+    emotions = {i['name']: i['emotions'] for i in mapper.stickers}
+    assert emotions['困惑'] == {'confused'}
+    assert emotions['好奇'] == set()
+    assert emotions['困'] == {'sleepy'}
+
+
+def test_false_emotion_does_not_outrank_real_match():
+    # waving matches hello by emotion, "thinking" must not claim it through "hi"
+    mapper = createMapper('thinking', 'hello')
+    assert mapper.match('👋') == 'hello'
+    assert mapper.match('🤔') == 'thinking'
+
+
+def test_stems_match_word_beginnings():
+    mapper = createMapper('confused', 'sleeping', 'crying')
+    assert mapper.map('what 😕') == 'what (confused)'
+    assert mapper.map('night 😴') == 'night (sleeping)'
+    assert mapper.map('no 😭😭') == 'no (crying)'
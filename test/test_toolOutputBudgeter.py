@@ -0,0 +1,47 @@
+import memoryIndex
+import tokenCounter
+import toolOutputBudgeter
+
+
+def createBudgeter(monkeypatch, passages: list[str]) -> toolOutputBudgeter.ToolOutputBudgeter:
+    # one token per word keeps the pages predictable
+    monkeypatch.setattr(tokenCounter.counter, 'count', lambda string: len(string.split()))
+    budgeter = toolOutputBudgeter.ToolOutputBudgeter(
+        tokenBudget=toolOutputBudgeter.ToolOutputBudgeter.noteTokens + 20, passageSize=800, storeSize=4)
+    index = memoryIndex.MemoryIndex(800)
+    for position, passage in enumerate(passages):
+        index.add(position, passage)
+    budgeter.outputs.put('output', index)
+    return budgeter
+
+
+def readAll(budgeter: toolOutputBudgeter.ToolOutputBudgeter, query: str) -> list[str]:
+    lines = []
+    page = 1
+    while True:
+        text = budgeter.read('output', query, page)
+        *passages, note = text.split('\n')
+        lines += [i for i in passages if i != '...']
+        if 'the last one' in note:
+            return lines
+        page += 1
+
+
+def test_query_pages_reach_every_passage(monkeypatch):
+    passages = [f'passage {i} about {"apples" if i % 4 == 0 else "pears"} and more words' for i in range(12)]
+    budgeter = createBudgeter(monkeypatch, passages)
+
+    lines = readAll(budgeter, 'apples')
+
+    # two passages per page, the matches come first, then the rest in document order
+    assert sorted(lines) == sorted(passages)
+    assert lines[:2] == [passages[0], passages[4]]
+    assert lines[2:4] == [passages[1], passages[8]]
+    assert lines[4:] == [passages[i] for i in range(12) if i % 4 and i != 1]
+
+
+def test_paging_past_the_end(monkeypatch):
+    budgeter = createBudgeter(monkeypatch, [f'passage {i} with some words' for i in range(3)])
+
+    assert budgeter.read('output', 'passage', 1).endswith('[Page 1, the last one.]')
+    assert budgeter.read('output', 'passage', 2) == 'Output output has no page 2.'
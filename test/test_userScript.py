@@ -0,0 +1,54 @@
+import userScript
+import workflowTools
+
+
+SCRIPT = '''
+calls = []
+
+def Remember(text: str) -> int:
+    """
+    Remember a text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: How many texts were remembered.
+    """
+    calls.append(text)
+    return len(calls)
+
+def register():
+    return {'Remember': Remember}
+'''
+
+
+def test_sessions_do_not_share_script_globals():
+    registry = userScript.UserScriptRegistry()
+    first = registry.get('memo', SCRIPT)
+    second = registry.get('memo', SCRIPT)
+
+    assert first.invoke('Remember', 'a') == 1
+    assert second.invoke('Remember', 'b') == 1
+    # compiled and described once
+    assert second.bc is first.bc
+    assert second.getReadableInformation() == first.getReadableInformation()
+    assert '`Remember`' in first.getReadableInformation()
+
+
+def test_edited_script_is_compiled_again():
+    registry = userScript.UserScriptRegistry()
+    first = registry.get('memo', SCRIPT)
+    edited = registry.get('memo', SCRIPT.replace('return len(calls)', 'return -len(calls)'))
+
+    assert edited.bc is not first.bc
+    assert edited.invoke('Remember', 'a') == -1
+
+
+def test_only_builtin_descriptions_are_memoized():
+    workflowTools.GetBuiltinToolReadableDescription.cache_clear()
+    script = userScript.UserScript('memo', SCRIPT)
+    workflowTools.GetToolReadableDescription(script.globals['Remember'])
+    workflowTools.GetToolReadableDescription(workflowTools.WebsiteReader)
+
+    assert workflowTools.GetBuiltinToolReadableDescription.cache_info().currsize == 1
@@ -0,0 +1,128 @@
+"""
+tokenCounter.py
+@biref Provides local token counting with a cache, an estimator fallback and opt-in remote counting.
+"""
+
+import hashlib
+import math
+import threading
+import typing
+
+import config
+import logger
+import lruCache
+
+
+class TokenCounter:
+    """
+    Counts the tokens of a string without a network round-trip.
+
+    In `local` mode the sentencepiece tokenizer shipped with google-genai is used.
+    If it can not be loaded, a character-based estimator calibrated for the Gemini
+    tokenizer is used instead. `remote` mode asks the Gemini API for the exact count.
+    Results are cached by the SHA-1 digest of the string.
+
+    Args:
+        mode (str): One of `local`, `estimate` or `remote`.
+        model (str): Model whose tokenizer is used.
+        cacheSize (int): Maximum number of cached counts.
+
+    Methods:
+        count(string): Count the tokens of a string.
+        estimate(string): Estimate the token count of a string from its characters.
+        stats(): Get cache statistics and the backend in use.
+    """
+
+    def __init__(self, mode: str, model: str, cacheSize: int) -> None:
+        self.mode = mode
+        self.model = model.removeprefix('models/')
+        self.cache = lruCache.LRUCache(cacheSize)
+        self.tokenizer = None
+        self.tokenizerFailed = mode != 'local'
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def isWideCharacter(c: str) -> bool:
+        # CJK ideographs, kana, hangul and fullwidth forms are mostly single tokens
+        o = ord(c)
+        return 0x2E80 <= o <= 0x9FFF or 0xAC00 <= o <= 0xD7AF or 0xF900 <= o <= 0xFAFF or 0xFF00 <= o <= 0xFFEF or o >= 0x1F000
+
+    def estimate(self, string: str) -> int:
+        """
+        Estimate the token count of a string from its characters.
+
+        Args:
+            string (str): Text to count.
+
+        Returns:
+            int: Estimated token count, rounded up.
+        """
+        wide = sum(1 for c in string if self.isWideCharacter(c))
+        narrow = len(string) - wide
+        return math.ceil(wide * config.TOKEN_ESTIMATE_TOKENS_PER_WIDE_CHAR + narrow / config.TOKEN_ESTIMATE_CHARS_PER_TOKEN)
+
+    def getTokenizer(self) -> typing.Any:
+        if self.tokenizerFailed:
+            return None
+        with self.lock:
+            if self.tokenizer is None and not self.tokenizerFailed:
+                try:
+                    from google.genai.local_tokenizer import LocalTokenizer
+                    self.tokenizer = LocalTokenizer(model_name=self.model)
+                except Exception as e:
+                    logger.Logger.log(
+                        'Local tokenizer unavailable, falling back to token estimation:', e)
+                    self.tokenizerFailed = True
+            return self.tokenizer
+
+    def countUncached(self, string: str) -> int:
+        if self.mode == 'remote':
+            import google.genai
+            client = google.genai.Client()
+            return client.models.count_tokens(model=self.model, contents=string).total_tokens
+
+        tokenizer = self.getTokenizer()
+        if tokenizer is not None:
+            try:
+                return tokenizer.count_tokens(string).total_tokens
+            except Exception as e:
+                logger.Logger.log('Local token counting failed:', e)
+        return self.estimate(string)
+
+    def count(self, string: str) -> int:
+        """
+        Count the tokens of a string.
+
+        Args:
+            string (str): Text to count.
+
+        Returns:
+            int: Token count.
+        """
+        if not string:
+            return 0
+        key = hashlib.sha1(string.encode('utf-8')).digest()
+        result = self.cache.get(key)
+        if result is None:
+            result = self.countUncached(string)
+            self.cache.put(key, result)
+        return result
+
+    def stats(self) -> dict[str, typing.Any]:
+        """
+        Get cache statistics and the backend in use.
+
+        Returns:
+            dict[str, typing.Any]: Cache statistics with the `backend` key added.
+        """
+        if self.mode == 'remote':
+            backend = 'remote'
+        elif self.tokenizer is not None:
+            backend = 'local'
+        else:
+            backend = 'estimate'
+        return self.cache.stats() | {'backend': backend}
+
+
+counter = TokenCounter(config.TOKEN_COUNTER_MODE,
+                       config.TOKEN_COUNTER_MODEL, config.TOKEN_COUNTER_CACHE_SIZE)
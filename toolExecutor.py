@@ -0,0 +1,156 @@
+"""
+toolExecutor.py
+@biref Provides a bounded executor running the tool invocations of a model response concurrently.
+"""
+
+import concurrent.futures
+import threading
+import time
+import typing
+
+import config
+import logger
+
+
+class ToolExecutor:
+    """
+    Runs the tool invocations of a model response concurrently on a shared, bounded thread pool.
+
+    Invocations are independent unless one lists the `id` of another in its `after` field, in which case
+    it starts once the other has finished. Every tool runs at most config.TOOL_CONCURRENCY_LIMITS[tool]
+    times at once across all sessions; an invocation is only handed to the pool once its tool has a free
+    slot, so waiting invocations do not hold workers. An invocation running longer than its timeout is
+    answered with a failure. The thread of a timed out invocation can not be stopped, it finishes in the
+    background (tools bound their own work, e.g. webFetcher's deadline) and its result is dropped.
+
+    Args:
+        workers (int): Maximum number of invocations running at once.
+
+    Methods:
+        run(invocations, call, cancelled): Run invocations and get their results in the original order.
+    """
+
+    pollInterval = 0.2
+
+    def __init__(self, workers: int) -> None:
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='tool')
+        self.limits: dict[str, threading.Semaphore] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def failed(message: str) -> dict[str, str]:
+        return {
+            "status": "failed",
+            "message": message,
+        }
+
+    @staticmethod
+    def getTimeout(tool: str) -> float:
+        return config.TOOL_INVOCATION_TIMEOUTS.get(tool, config.TOOL_INVOCATION_TIMEOUT)
+
+    @staticmethod
+    def getDependencies(invocation: dict[str, typing.Any]) -> list[str]:
+        after = invocation.get('after', [])
+        return [after] if isinstance(after, str) else list(after)
+
+    def getLimit(self, tool: str) -> threading.Semaphore | None:
+        if tool not in config.TOOL_CONCURRENCY_LIMITS:
+            return None
+        with self.lock:
+            if tool not in self.limits:
+                self.limits[tool] = threading.Semaphore(config.TOOL_CONCURRENCY_LIMITS[tool])
+            return self.limits[tool]
+
+    def run(self, invocations: list[dict[str, typing.Any]], call: typing.Callable[[dict[str, typing.Any]], typing.Any], cancelled: threading.Event) -> list[typing.Any]:
+        """
+        Run invocations and get their results in the original order.
+
+        Args:
+            invocations (list[dict[str, typing.Any]]): Invocation payloads with `tool`, `params` and the optional `id` and `after`.
+            call (typing.Callable[[dict[str, typing.Any]], typing.Any]): Invokes the tool of a payload and returns its result.
+            cancelled (threading.Event): Once set, invocations which have not finished are answered with a failure.
+
+        Returns:
+            list[typing.Any]: Results of the invocations, failures for timed out, cancelled or unresolvable ones.
+        """
+        results: list[typing.Any] = [None] * len(invocations)
+        ids = {i['id']: idx for idx, i in enumerate(invocations) if isinstance(i, dict) and 'id' in i}
+        pending = list(range(len(invocations)))
+        finished: set[int] = set()
+        running: dict[concurrent.futures.Future, int] = {}
+        # start times are set by the workers, so waiting for a slot or a worker does not count towards the timeout
+        started: dict[int, float] = {}
+        # slots taken by the scheduler, released by the worker or when the invocation never starts
+        slots: dict[int, threading.Semaphore] = {}
+
+        def release(idx: int) -> None:
+            if (limit := slots.pop(idx, None)) is not None:
+                limit.release()
+
+        def work(idx: int) -> typing.Any:
+            try:
+                if cancelled.is_set():
+                    return self.failed('Invocation cancelled')
+                started[idx] = time.monotonic()
+                return call(invocations[idx])
+            finally:
+                release(idx)
+
+        while pending or running:
+            if cancelled.is_set():
+                for future, idx in running.items():
+                    if future.cancel():
+                        release(idx)
+                    results[idx] = self.failed('Invocation cancelled')
+                for idx in pending:
+                    results[idx] = self.failed('Invocation cancelled')
+                break
+
+            limited = False
+            for idx in list(pending):
+                dependencies = [ids[i] for i in self.getDependencies(invocations[idx]) if i in ids and ids[i] != idx]
+                if not all(i in finished for i in dependencies):
+                    continue
+                limit = self.getLimit(invocations[idx].get('tool', ''))
+                if limit is not None:
+                    if not limit.acquire(blocking=False):
+                        # tried again on the next poll
+                        limited = True
+                        continue
+                    slots[idx] = limit
+                pending.remove(idx)
+                running[self.executor.submit(work, idx)] = idx
+
+            if not running and limited:
+                time.sleep(self.pollInterval)
+                continue
+            if not running:
+                # the remaining invocations wait for each other
+                for idx in pending:
+                    results[idx] = self.failed(f'Unresolvable dependencies: {self.getDependencies(invocations[idx])}')
+                break
+
+            done, _ = concurrent.futures.wait(
+                running, timeout=self.pollInterval, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                idx = running.pop(future)
+                try:
+                    results[idx] = future.result()
+                except Exception as e:
+                    results[idx] = self.failed(f'Failed to invoke tool: {e}')
+                finished.add(idx)
+
+            now = time.monotonic()
+            for future, idx in list(running.items()):
+                tool = invocations[idx].get('tool', '')
+                if idx in started and now - started[idx] > self.getTimeout(tool):
+                    logger.Logger.log(f'{__name__}: Invocation of {tool} timed out')
+                    running.pop(future)
+                    results[idx] = self.failed(f'Invocation of {tool} timed out after {self.getTimeout(tool)}s')
+                    finished.add(idx)
+
+        return results
+
+
+executor = ToolExecutor(config.TOOL_EXECUTOR_WORKERS)
@@ -0,0 +1,159 @@
+"""
+toolOutputBudgeter.py
+@biref Provides relevance-ranked truncation of large tool outputs before they are sent to the model.
+"""
+
+import json
+import typing
+import uuid
+
+import config
+import lruCache
+import memoryIndex
+import tokenCounter
+
+
+class ToolOutputBudgeter:
+    """
+    Keeps tool outputs within a token budget.
+
+    Outputs larger than the budget are split into passages which are ranked with BM25 against the invocation
+    and the text of the response which requested it. The best passages are kept, in document order, and the full
+    output is stored under an id so the model can read the rest with the ToolOutputReader tool.
+
+    Args:
+        tokenBudget (int): Maximum tokens of an output sent to the model.
+        passageSize (int): Maximum length of a passage in characters.
+        storeSize (int): How many full outputs are kept for ToolOutputReader.
+
+    Methods:
+        render(content): Convert a tool output into text with one item per line.
+        budget(content, query): Get the text of an output, truncated to the passages most relevant to a query.
+        read(outputId, query, page): Read a stored output by relevance or page by page.
+    """
+
+    # tokens reserved for the note telling the model how to read the rest
+    noteTokens = 64
+
+    def __init__(self, tokenBudget: int, passageSize: int, storeSize: int) -> None:
+        self.tokenBudget = tokenBudget
+        self.passageSize = passageSize
+        self.outputs = lruCache.LRUCache(storeSize)
+
+    @staticmethod
+    def render(content: typing.Any) -> str:
+        """
+        Convert a tool output into text with one item per line, so passages do not cut through items.
+
+        Args:
+            content (typing.Any): The tool output.
+
+        Returns:
+            str: The text.
+        """
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return '\n'.join(json.dumps(i, ensure_ascii=False, default=str) for i in content)
+        if isinstance(content, dict):
+            lines = []
+            for k, v in content.items():
+                if isinstance(v, str):
+                    lines.append(f'{k}:\n{v}')
+                elif isinstance(v, list):
+                    lines.append(f'{k}:\n{ToolOutputBudgeter.render(v)}')
+                else:
+                    lines.append(f'{k}: {json.dumps(v, ensure_ascii=False, default=str)}')
+            return '\n'.join(lines)
+        return str(content)
+
+    def select(self, index: memoryIndex.MemoryIndex, query: str, skip: int = 0) -> tuple[list[dict[str, str | int]], int]:
+        # passages are indexed with their position as timestamp, those matching the query come first, then
+        # the rest in document order, so paging reaches every passage
+        budget = self.tokenBudget - self.noteTokens
+        matches = sorted(index.search(query, len(index.chunks)), key=lambda i: -i['score']) if query else []
+        matched = {(i['timestamp'], i['text']) for i in matches}
+        ranked = matches + [i for i in index.chunks if (i['timestamp'], i['text']) not in matched]
+        selected = []
+        end = skip
+        for passage in ranked[skip:]:
+            size = tokenCounter.counter.count(passage['text'])
+            if size > budget:
+                if selected:
+                    break
+                # never fits, skipped for good
+                end += 1
+                continue
+            selected.append(passage)
+            budget -= size
+            end += 1
+        # the passages of the page and where the next page starts in the ranking
+        return sorted(selected, key=lambda i: i['timestamp']), end
+
+    @staticmethod
+    def join(passages: list[dict[str, str | int]]) -> str:
+        result = []
+        last = -1
+        for i in passages:
+            if i['timestamp'] != last + 1:
+                result.append('...')
+            result.append(i['text'])
+            last = i['timestamp']
+        return '\n'.join(result)
+
+    def budget(self, content: typing.Any, query: str) -> str:
+        """
+        Get the text of an output, truncated to the passages most relevant to a query if it exceeds the budget.
+
+        Args:
+            content (typing.Any): The tool output.
+            query (str): Text describing what the output is needed for, e.g. the invocation and its reasoning.
+
+        Returns:
+            str: The output as it is if it fits into the budget, otherwise the selected passages and a note with the output id.
+        """
+        text = str(content)
+        total = tokenCounter.counter.count(text)
+        if total <= self.tokenBudget:
+            return text
+
+        index = memoryIndex.MemoryIndex(self.passageSize)
+        for position, passage in enumerate(index.splitChunks(self.render(content))):
+            index.add(position, passage)
+        outputId = uuid.uuid4().hex[:8]
+        self.outputs.put(outputId, index)
+
+        passages, _ = self.select(index, query)
+        return f'{self.join(passages)}\n[Output truncated from {total} tokens to the {len(passages)} of {len(index.chunks)} passages most relevant to the request. ' \
+            f'Use ToolOutputReader with outputId "{outputId}" to read more.]'
+
+    def read(self, outputId: str, query: str = '', page: int = 1) -> str:
+        """
+        Read a stored output, by relevance to a query or, without one, page by page in document order.
+
+        Args:
+            outputId (str): Id from the truncation note.
+            query (str, optional): What to look for. Defaults to ''.
+            page (int, optional): Page of the results, starting at 1. Defaults to 1.
+
+        Returns:
+            str: The passages of the page and a note whether more pages exist. With a query, the passages
+            matching it come first and the others follow in document order.
+        """
+        index = self.outputs.get(outputId)
+        if index is None:
+            return f'Output {outputId} is no longer available, invoke the tool again.'
+
+        skip = 0
+        for _ in range(page - 1):
+            _, skip = self.select(index, query, skip)
+            if skip >= len(index.chunks):
+                return f'Output {outputId} has no page {page}.'
+        passages, skip = self.select(index, query, skip)
+        more = skip < len(index.chunks)
+        note = f'[Page {page}, use page {page + 1} to read more.]' if more else f'[Page {page}, the last one.]'
+        return f'{self.join(passages)}\n{note}'
+
+
+budgeter = ToolOutputBudgeter(config.TOOL_OUTPUT_TOKEN_BUDGET,
+                              config.TOOL_OUTPUT_PASSAGE_SIZE, config.TOOL_OUTPUT_STORE_SIZE)
@@ -1,14 +1,18 @@
+import hashlib
+import types
 import typing
+import config
 import logger
+import lruCache
 import workflowTools
 
 class UserScript():
-    def __init__(self, name, script):
+    def __init__(self, name, script, bc: types.CodeType | None = None, readable_information: dict[str, str] | None = None):
         logger.Logger.log(f'[Script/{name}]: Creating user script environment')
         self.globals = {workflowTools.__name__: workflowTools}
         self.script = script
         self.name = name
-        self.bc = compile(script, f'<string>', 'exec')
+        self.bc = compile(script, f'<string>', 'exec') if bc is None else bc
         exec(self.bc, self.globals, self.globals)
         logger.Logger.log(f'[Script/{name}]: User script environment created')
         if 'register' not in self.globals:
@@ -22,7 +26,9 @@ class UserScript():
                 raise TypeError('Register function returned non-callable')
 
         
-        self.readable_information = {i: workflowTools.GetToolReadableDescription(info[i]) for i in info}
+        if readable_information is None:
+            readable_information = {i: workflowTools.GetToolReadableDescription(info[i]) for i in info}
+        self.readable_information = readable_information
         
     def getReadableInformation(self):
         return '\n'.join(f'{v}' for k, v in self.readable_information.items())
@@ -39,4 +45,36 @@ class UserScript():
         return lambda *args, **kwargs: self.invoke(key, *args, **kwargs)
 
     def getAllInvocables(self) -> list[str]:
-        return [i for i in self.readable_information.keys()]
\ No newline at end of file
+        return [i for i in self.readable_information.keys()]
+
+
+class UserScriptRegistry:
+    """
+    Process-wide cache of compiled user scripts, so new sessions do not compile them and generate their
+    tool descriptions again.
+
+    Scripts are keyed by their name and the SHA-256 digest of their content, so an edited script is compiled
+    again on its next use and the old entry ages out, at most config.USER_SCRIPT_CACHE_SIZE are kept. Only the
+    code object and the descriptions are shared, every session executes the script and calls `register` in
+    its own globals, so scripts keeping state do not leak it between sessions.
+
+    Methods:
+        get(name, content): Create the environment of a script for a session.
+    """
+
+    def __init__(self) -> None:
+        # (name, digest) -> (code, readable information)
+        self.scripts = lruCache.LRUCache(config.USER_SCRIPT_CACHE_SIZE)
+
+    def get(self, name: str, content: str) -> UserScript:
+        key = (name, hashlib.sha256(content.encode('utf-8')).hexdigest())
+        cached = self.scripts.get(key)
+        if cached is not None:
+            return UserScript(name, content, *cached)
+        # scripts are compiled and registered without a lock, two sessions starting at once may both compile
+        script = UserScript(name, content)
+        self.scripts.put(key, (script.bc, script.readable_information))
+        return script
+
+
+registry = UserScriptRegistry()
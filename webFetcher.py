@@ -0,0 +1,323 @@
+"""
+webFetcher.py
+@biref Provides a pooled, size-capped and cached fetch engine for web pages and a main content extractor.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+import typing
+import urllib.parse
+
+import bs4
+import requests
+import requests.adapters
+
+import config
+import logger
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+class WebCache:
+    """
+    A persistent HTTP cache in its own sqlite database.
+
+    Responses are stored with their ETag and Last-Modified validators and the time until which they are
+    fresh. Entries which have not been fetched for config.WEB_CACHE_MAX_AGE seconds are purged on startup,
+    and the least recently fetched ones once the bodies exceed config.WEB_CACHE_MAX_BYTES.
+
+    Args:
+        path (str): Path of the database file.
+
+    Methods:
+        get(url): Get the cached response of an url.
+        put(url, entry): Store the response of an url.
+        touch(url, freshUntil): Extend the freshness of a response revalidated by the server.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('pragma journal_mode = wal')
+        self.db.execute('''create table if not exists pages (
+            url text primary key, etag text, lastModified text, contentType text, body blob not null,
+            truncated integer not null, freshUntil real not null, fetched real not null)''')
+        self.db.execute('create index if not exists pagesFetched on pages (fetched)')
+        self.db.execute('delete from pages where fetched < ?', (time.time() - config.WEB_CACHE_MAX_AGE, ))
+        self.size = self.db.execute('select coalesce(sum(length(body)), 0) from pages').fetchone()[0]
+        self.evict()
+        self.db.commit()
+
+    def evict(self) -> None:
+        # called with the lock held, the caller commits
+        while self.size > config.WEB_CACHE_MAX_BYTES:
+            rows = self.db.execute('select url, length(body) from pages order by fetched limit 64').fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for url, length in rows:
+                self.db.execute('delete from pages where url = ?', (url, ))
+                self.size -= length
+                if self.size <= config.WEB_CACHE_MAX_BYTES:
+                    break
+
+    def get(self, url: str) -> dict[str, typing.Any] | None:
+        with self.lock:
+            row = self.db.execute('select * from pages where url = ?', (url, )).fetchone()
+        return None if row is None else dict(row)
+
+    def put(self, url: str, entry: dict[str, typing.Any]) -> None:
+        with self.lock:
+            old = self.db.execute('select length(body) from pages where url = ?', (url, )).fetchone()
+            self.db.execute('''insert or replace into pages (url, etag, lastModified, contentType, body, truncated, freshUntil, fetched)
+                values (?, ?, ?, ?, ?, ?, ?, ?)''', (url, entry['etag'], entry['lastModified'], entry['contentType'],
+                                                    entry['body'], entry['truncated'], entry['freshUntil'], time.time()))
+            self.size += len(entry['body']) - (old[0] if old else 0)
+            self.evict()
+            self.db.commit()
+
+    def touch(self, url: str, freshUntil: float) -> None:
+        with self.lock:
+            self.db.execute('update pages set freshUntil = ?, fetched = ? where url = ?',
+                            (freshUntil, time.time(), url))
+            self.db.commit()
+
+
+class WebFetcher:
+    """
+    Fetches web pages over a shared keep-alive session.
+
+    Bodies are read up to config.WEB_FETCH_MAX_BYTES, the rest of a larger page is dropped. Failed requests are
+    retried up to config.WEB_FETCH_RETRIES times, all attempts together end by a deadline so a fetch never outlives
+    the tool invocation waiting for it (see config.TOOL_INVOCATION_TIMEOUTS). Responses are
+    cached on disk and used without a request while fresh (Cache-Control max-age, or config.WEB_CACHE_FRESHNESS
+    when the server gives none), then revalidated with If-None-Match / If-Modified-Since. If a page can not be
+    fetched, its cached copy is used however old it is.
+
+    Args:
+        cache (WebCache | None): Persistent cache, None to always fetch.
+
+    Methods:
+        fetch(url, deadline): Get the body of a page.
+        read(url, deadline): Get the main text content and links of a page.
+    """
+
+    userAgent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:137.0) Gecko/20100101 Firefox/137.0'
+    # containers of the main content, most specific first
+    contentSelectors = ['.mw-parser-output', 'article', 'main', '[role=main]', 'div.page', '#content']
+    # never part of the main content
+    # form controls rather than forms, some sites (e.g. ASP.NET) wrap the whole page in a form
+    boilerplateTags = ['script', 'style', 'noscript', 'template', 'svg', 'iframe', 'button', 'select', 'textarea',
+                       'nav', 'header', 'footer', 'aside']
+    # elements followed by a line break in the extracted text
+    blockTags = ['p', 'div', 'br', 'li', 'tr', 'pre', 'blockquote', 'section', 'table', 'ul', 'ol', 'dl', 'dt', 'dd',
+                 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+    def __init__(self, cache: WebCache | None) -> None:
+        self.cache = cache
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = self.userAgent
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=config.WEB_FETCH_POOL_SIZE, pool_maxsize=config.WEB_FETCH_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @staticmethod
+    def getFreshUntil(resp: requests.Response) -> float | None:
+        # None if the response must not be stored
+        cacheControl = resp.headers.get('Cache-Control', '').lower()
+        if 'no-store' in cacheControl:
+            return None
+        if 'no-cache' in cacheControl:
+            return time.time()
+        maxAge = re.search(r'max-age=(\d+)', cacheControl)
+        return time.time() + (int(maxAge.group(1)) if maxAge else config.WEB_CACHE_FRESHNESS)
+
+    @staticmethod
+    def remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('Reading the website took too long. You may retry later.')
+        return remaining
+
+    def request(self, url: str, entry: dict[str, typing.Any] | None, deadline: float) -> tuple[requests.Response, bytes, bool]:
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['lastModified']:
+            headers['If-Modified-Since'] = entry['lastModified']
+
+        remaining = self.remaining(deadline)
+        timeout = tuple(min(i, remaining) for i in config.WEB_FETCH_TIMEOUT)
+        with self.session.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+            if resp.status_code == 304 and entry is not None:
+                return resp, b'', False
+            if resp.status_code != 200:
+                raise Exception(f'Failed to read website {url}. Status code: {resp.status_code}. You may retry later.')
+            body = bytearray()
+            truncated = False
+            for chunk in resp.iter_content(64 * 1024):
+                body += chunk
+                # the read timeout only bounds each chunk, a slow server could trickle on forever
+                self.remaining(deadline)
+                if len(body) > config.WEB_FETCH_MAX_BYTES:
+                    del body[config.WEB_FETCH_MAX_BYTES:]
+                    truncated = True
+                    break
+            return resp, bytes(body), truncated
+
+    def requestWithRetries(self, url: str, entry: dict[str, typing.Any] | None, deadline: float) -> tuple[requests.Response, bytes, bool]:
+        for attempt in range(config.WEB_FETCH_RETRIES + 1):
+            try:
+                return self.request(url, entry, deadline)
+            except TimeoutError:
+                raise
+            except Exception as e:
+                if attempt == config.WEB_FETCH_RETRIES or deadline - time.monotonic() <= 1:
+                    raise
+                logger.Logger.log(f'{__name__}: Failed to fetch {url}, retrying: {e}')
+                time.sleep(1)
+
+    def fetch(self, url: str, deadline: float | None = None) -> dict[str, typing.Any]:
+        """
+        Get the body of a page, from the cache if it is fresh or the server confirms it is unchanged.
+
+        Args:
+            url (str): The page url.
+            deadline (float | None, optional): time.monotonic() by which all attempts end. Defaults to None,
+                config.WEB_FETCH_DEADLINE seconds from now.
+
+        Returns:
+            dict[str, typing.Any]: `body`, `contentType`, `truncated`, `cached`, whether no body was downloaded, and
+            `stale`, whether the page could not be fetched and the cached copy is outdated.
+        """
+        entry = self.cache.get(url) if self.cache is not None else None
+        if entry is not None and entry['freshUntil'] > time.time():
+            return entry | {'cached': True, 'stale': False}
+
+        if deadline is None:
+            deadline = time.monotonic() + config.WEB_FETCH_DEADLINE
+        try:
+            resp, body, truncated = self.requestWithRetries(url, entry, deadline)
+        except Exception as e:
+            if entry is None:
+                raise
+            # an outdated copy is better than none
+            logger.Logger.log(f'{__name__}: Failed to fetch {url}, using the cached copy: {e}')
+            return entry | {'cached': True, 'stale': True}
+        freshUntil = self.getFreshUntil(resp)
+        if resp.status_code == 304:
+            if freshUntil is not None:
+                self.cache.touch(url, freshUntil)
+            return entry | {'cached': True, 'stale': False}
+
+        result = {
+            'etag': resp.headers.get('ETag'),
+            'lastModified': resp.headers.get('Last-Modified'),
+            'contentType': resp.headers.get('Content-Type', ''),
+            'body': body,
+            'truncated': truncated,
+            'freshUntil': freshUntil,
+        }
+        if self.cache is not None and freshUntil is not None:
+            try:
+                self.cache.put(url, result)
+            except sqlite3.Error as e:
+                logger.Logger.log(f'{__name__}: Failed to cache {url}: {e}')
+        return result | {'cached': False, 'stale': False}
+
+    @classmethod
+    def extractMainContent(cls, soup: bs4.BeautifulSoup) -> bs4.Tag:
+        for tag in soup(cls.boilerplateTags):
+            tag.decompose()
+
+        for selector in cls.contentSelectors:
+            tag = soup.select_one(selector)
+            if tag is not None and len(tag.get_text(strip=True)) >= config.WEB_READER_MIN_CONTENT_CHARS:
+                return tag
+
+        # readability style: paragraphs vote for their parent and, with half the weight, their grandparent
+        scores: dict[int, tuple[bs4.Tag, float]] = {}
+        for p in soup.find_all(['p', 'pre', 'td', 'li']):
+            length = len(p.get_text(strip=True))
+            if length < 25:
+                continue
+            for tag, weight in ((p.parent, 1), (p.parent.parent if p.parent else None, 0.5)):
+                if tag is None:
+                    continue
+                score = scores.get(id(tag), (tag, 0))[1]
+                scores[id(tag)] = (tag, score + weight * (1 + min(length / 100, 3)))
+        if not scores:
+            return soup.body or soup
+
+        def linkDensity(tag: bs4.Tag) -> float:
+            text = len(tag.get_text(strip=True)) or 1
+            return sum(len(i.get_text(strip=True)) for i in tag.find_all('a')) / text
+
+        return max(scores.values(), key=lambda i: i[1] * (1 - linkDensity(i[0])))[0]
+
+    def read(self, url: str, deadline: float | None = None) -> dict[str, typing.Any]:
+        """
+        Get the main text content and links of a page.
+
+        Args:
+            url (str): The page url.
+            deadline (float | None, optional): time.monotonic() by which fetching the page ends, see fetch.
+
+        Returns:
+            dict[str, typing.Any]: `content`, the text of the main content, and `links`, the distinct links within it
+            with their `content` and `url`, at most config.WEB_READER_MAX_LINKS.
+        """
+        page = self.fetch(url, deadline)
+        soup = bs4.BeautifulSoup(page['body'], HTML_PARSER)
+        main = self.extractMainContent(soup)
+
+        # line breaks after blocks only, so inline elements like links stay within their sentence
+        for tag in main.find_all(self.blockTags):
+            tag.insert_after('\n')
+        lines = [' '.join(i.split()) for i in main.get_text().splitlines()]
+        content = re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+        if page['truncated']:
+            content += '\n[page truncated]'
+        if page['stale']:
+            content += '\n[the website could not be reached, this is an earlier copy]'
+
+        links = {}
+        for link in main.find_all('a', href=True):
+            href = link['href']
+            if not (href.startswith('http') or href.startswith('/')):
+                # ignore relative links
+                continue
+            target = urllib.parse.urljoin(url, href).split('#')[0]
+            if target not in links:
+                links[target] = {
+                    'content': link.get_text(' ', strip=True) or link.get('title', ''),
+                    'url': target,
+                }
+            if len(links) >= config.WEB_READER_MAX_LINKS:
+                break
+
+        return {
+            'content': content,
+            'links': list(links.values()),
+        }
+
+
+def createFetcher() -> WebFetcher:
+    cache = None
+    if config.WEB_CACHE_PATH is not None:
+        try:
+            cache = WebCache(config.WEB_CACHE_PATH)
+        except sqlite3.Error as e:
+            logger.Logger.log(f'{__name__}: Web cache unavailable, pages are always fetched: {e}')
+    return WebFetcher(cache)
+
+
+fetcher = createFetcher()
@@ -1,8 +1,10 @@
+import json
 import dataProvider
 import logger
 import models
 import chatModel
 import config
+import responseCache
 from webFrontend.extensionHandler import ToolsHandler
 import workflowTools
 
@@ -10,12 +12,15 @@ class CharacterGenerator:
     def __init__(self, dataProvider: dataProvider.DataProvider):
         self.dataProvider = dataProvider
         
-    def generate(self, name: str) -> dict[str, str]:
+    def generate(self, name: str, useCache: bool = False) -> dict[str, str]:
         """
         Create a new character with the given name and collected information through AI
 
         Args:
             name (str): The character's name.
+            useCache (bool, optional): Return the last complete character generated for the name, within
+                config.RESPONSE_CACHE_TTL, instead of generating a new one. Defaults to False, since generating
+                again is expected to give a different character.
 
         Returns:
             dict[str, str]: A dictionary containing the generated character's information including `charName`, `charPrompt`, `initalMemory`, `exampleChats`.
@@ -28,6 +33,11 @@ class CharacterGenerator:
                 'extra_info': self.toolsHandler.generated_extra_infos
             })
         })
+        # a generation is a whole tool-using session, so its result is cached instead of single responses
+        cacheKey = responseCache.ResponseCache.key(config.USE_MODEL, 1, self.prompt)
+        if useCache and responseCache.cache is not None and (cached := responseCache.cache.get(cacheKey)) is not None:
+            return json.loads(cached)
+
         self.llm = models.ThinkingModelProvider('')
         self.toolsHandler.bindLLM(self.llm)
         
@@ -54,6 +64,10 @@ class CharacterGenerator:
         
         self.toolsHandler.on('unhandled_intent', handleIntent)
         self.toolsHandler.handleRawResponse(self.llm.initiate(self.prompt + '\nNow let the creation begin!'))
-        
+
+        # only complete characters are worth returning again
+        complete = all(generated[i] is not None for i in ('charName', 'charPrompt', 'initalMemory')) and generated['exampleChats']
+        if responseCache.cache is not None and complete:
+            responseCache.cache.put(cacheKey, json.dumps(generated, ensure_ascii=False))
         return generated
         
\ No newline at end of file
@@ -27,6 +27,7 @@ import livekit.api
 import livekit.rtc
 import numpy
 import AIDubMiddlewareAPI
+import config
 from GPTSoVits import GPTSoVitsAPI
 import SileroVAD
 import dataProvider
@@ -49,6 +50,7 @@ import Tha4Api
 from models import EmojiToStickerInstrctionModel, TokenCounter
 
 import emoji
+import stickerMapper
 
 import webFrontend.extensionHandler
 from workflowTools import ToolResponse
@@ -919,6 +921,17 @@ class ChatroomSession:
         else:
             raise exceptions.EventNotFound(f"Event {event} not found")
 
+    def createStickerMapping(self) -> typing.Callable[[str], str]:
+        # emojis are mapped locally, the model is only asked for ambiguous ones if enabled
+        stickers = self.chatbot.memory.getAvailableStickers()
+        fallback = (lambda text: tools.retryWrapper(lambda: EmojiToStickerInstrctionModel(text, ''.join(
+            f'({i["name"]}) ' for i in stickers)))) if config.STICKER_MAPPING_LLM_FALLBACK else None
+        mapper = stickerMapper.StickerMapper(stickers)
+        return lambda plain: mapper.map(plain, fallback)
+
+    def mapStickers(self, plain: str) -> str:
+        return self.createStickerMapping()(plain)
+
     def beginChat(self, msgChain: list[str]):
         f = self.dataProvider.parseMessageChain(msgChain)
 
@@ -929,9 +942,9 @@ class ChatroomSession:
 
         result = []
 
-        logger.Logger.log('TTS available: ', 'True' if (TokenCounter(
-            plain) < 621 and self.chatbot.memory.getCharTTSUseModel() != None) else 'False')
-        if TokenCounter(plain) < 621 and self.chatbot.memory.getCharTTSUseModel() != "None" and random.randint(1, 5) == 1:
+        ttsAvailable = TokenCounter(plain) < 621 and self.chatbot.memory.getCharTTSUseModel() != "None"
+        logger.Logger.log('TTS available: ', 'True' if ttsAvailable else 'False')
+        if ttsAvailable and random.randint(1, 5) == 1:
             # if True:
             # remove all emojis in `plain`
             plain = removeEmojis(plain)
@@ -945,8 +958,7 @@ class ChatroomSession:
                 self.trigger('message', [content])
 
         else:
-            plain = EmojiToStickerInstrctionModel(plain, ''.join(
-                f'({i}) ' for i in self.chatbot.getAvailableStickers()))
+            plain = self.mapStickers(plain)
             plain = removeEmojis(plain)
             for i in self.chatbot.getAvailableStickers():
                 plain = plain.replace(f'（{i}）', f"({i})")
@@ -966,12 +978,18 @@ class ChatroomSession:
         else:
             self.trigger_labelled = True
 
+        # voice replies need the complete text, only text replies are streamed
+        voice = random.randint(1, 5) == 1
+        if config.CHAT_STREAMING and not (voice and self.chatbot.memory.getCharTTSUseModel() != "None"):
+            self.streamReply(f)
+            return
+
         result = None
         retries = 0
         while result == None:
             plain = tools.retryWrapper(lambda: self.chatbot.chat(
                 userInput=self.dataProvider.convertMessageHistoryToModelInput(f)))
-            if TokenCounter(plain) < 621 and self.chatbot.memory.getCharTTSUseModel() != "None" and random.randint(1, 5) == 1:
+            if TokenCounter(plain) < 621 and self.chatbot.memory.getCharTTSUseModel() != "None" and voice:
                 # if True:
                 for i in self.chatbot.getAvailableStickers():
                     plain = plain.replace(f'（{i}）', f"({i})")
@@ -983,8 +1001,7 @@ class ChatroomSession:
                     self.trigger('message', [content])
 
             else:
-                plain = tools.retryWrapper(lambda: EmojiToStickerInstrctionModel(plain, ''.join(
-                    f'({i}) ' for i in self.chatbot.getAvailableStickers())))
+                plain = self.mapStickers(plain)
                 plain = removeEmojis(plain)
                 for i in self.chatbot.getAvailableStickers():
                     plain = plain.replace(f'（{i}）', f"({i})")
@@ -994,6 +1011,26 @@ class ChatroomSession:
 
                 self.dataProvider.saveChatHistory(self.charName, result)
                 self.trigger('message', result)
+            voice = random.randint(1, 5) == 1
+
+    def streamReply(self, f: list[dict[str, str | int]]) -> None:
+        # every segment is delivered as soon as the model completed it, the reply is saved once it is complete
+        # so a stream failing halfway does not leave a partial turn in the history. Failures are retried by
+        # Chatbot.chatStream until the first segment is delivered, later ones are reported by the socket handler
+        stickers = self.chatbot.getAvailableStickers()
+        mapStickers = self.createStickerMapping()
+        reply = []
+        for segment in self.chatbot.chatStream(self.dataProvider.convertMessageHistoryToModelInput(f)):
+            plain = mapStickers(segment)
+            plain = removeEmojis(plain)
+            for i in stickers:
+                plain = plain.replace(f'（{i}）', f"({i})")
+                plain = plain.replace(f':{i}:', f":{i}:")
+
+            result = self.dataProvider.parseModelResponse(plain)
+            reply += result
+            self.trigger('message', result)
+        self.dataProvider.saveChatHistory(self.charName, reply)
 
     def trigger_trigger(self):
         self.sendMessage(['[trigger]'])
@@ -9,17 +9,22 @@ import uuid
 import workflowTools
 import typing
 import json
+import threading
+import toolExecutor
+import toolOutputBudgeter
+import userScript
 from userScript import UserScript
 import google.genai.live
 
 class ToolsHandler:
-    def __init__(self, llm: chatModel.ChatGoogleGenerativeAI, dataProvider: dataProvider.DataProvider, enabled_tools: list[typing.Callable] = [], enabled_user_scripts: list[dict[str, str]] = []):
+    def __init__(self, llm: chatModel.ChatGoogleGenerativeAI, dataProvider: dataProvider.DataProvider, enabled_tools: list[typing.Callable] = [], enabled_user_scripts: list[dict[str, str]] = [], enabled_extra_infos: list[dict[str, str]] | None = None):
         """
         Initialize the ToolsHandler class
 
         Args:
             llm (chatModel.ChatGoogleGenerativeAI): The chat model object
             dataProvider (dataProvider.DataProvider): The data provider object
+            enabled_extra_infos (list[dict[str, str]] | None): The enabled extra infos, queried from the data provider if None
         """
         self.llm = llm
         self.available_events = {
@@ -28,9 +33,13 @@ class ToolsHandler:
             'terminate_intent': []
         }
         self.dataProvider = dataProvider
+        # set once the session terminates, running invocations are abandoned, see cancel
+        self.cancelled = threading.Event()
         self.generated_tool_descriptions = ''.join(
             [workflowTools.GetToolReadableDescription(i) for i in enabled_tools])
-        self.generated_extra_infos = ''.join([i['content'] for i in self.dataProvider.getAllEnabledExtraInfos()])
+        if enabled_extra_infos is None:
+            enabled_extra_infos = self.dataProvider.getAllEnabledExtraInfos()
+        self.generated_extra_infos = ''.join([i['content'] for i in enabled_extra_infos])
         
         self.enabled_tools = enabled_tools
         self.parsed_user_scripts: list[UserScript] = []
@@ -43,7 +52,8 @@ class ToolsHandler:
 
         for i in enabled_user_scripts:
             name, content = i['name'], i['content']
-            script = UserScript(name, content)
+            # compiled once per process, see userScript.UserScriptRegistry
+            script = userScript.registry.get(name, content)
             self.parsed_user_scripts.append(script)
 
             for tool in script.getAllInvocables():
@@ -82,6 +92,12 @@ class ToolsHandler:
         else:
             raise ValueError(f'Invalid event: {event}')
 
+    def cancel(self) -> None:
+        """
+        Cancel the tool invocations in progress and stop handling responses, used when the session terminates.
+        """
+        self.cancelled.set()
+
     def bindLLM(self, llm: chatModel.ChatGoogleGenerativeAI) -> None:
         """
         Bind the LLM to the ToolsHandler.
@@ -190,6 +206,27 @@ class ToolsHandler:
                 self.trigger('unhandled_intent', intent, args)
                 return None
 
+    def resultAsModelInput(self, result: typing.Any, args: typing.Any, context: str) -> typing.Any:
+        """
+        Convert the result of an intent into model input, large text outputs are cut down to the passages
+        relevant to the invocation and the response which requested it, see toolOutputBudgeter.
+
+        Args:
+            result (typing.Any): The result of the intent.
+            args (typing.Any): The arguments of the intent.
+            context (str): The text of the response which contained the intent.
+
+        Returns:
+            typing.Any: The model input.
+        """
+        params = args.get('params', {}) if isinstance(args, dict) else args
+        query = '\n'.join([*(str(i) for i in params.values()), context] if isinstance(params, dict) else [str(params), context])
+        if isinstance(result, workflowTools.ToolResponse):
+            if result.type not in ['text/plain', 'list', 'dict']:
+                return result.asModelInput()
+            result = result.response_content
+        return toolOutputBudgeter.budgeter.budget(result, query)
+
     def handleRawResponse(self, response: str) -> str:
         """
         Handle a raw response from the LLM by parsing the response and handling the intents.
@@ -207,19 +244,29 @@ class ToolsHandler:
         
         current_response = self.parseRawResponse(response)
         
-        while current_response['intents']:
+        while current_response['intents'] and not self.cancelled.is_set():
             logger.Logger.log(f'Handling response: {current_response}')
+            intents = current_response['intents']
+            # invocations run concurrently, see toolExecutor, other intents are handled right away
+            invocations = [idx for idx, i in enumerate(intents) if i['name'] == 'invocation' and isinstance(i['content'], dict)]
+            handled = {idx: self.handleIntent(i['name'], i['content'])
+                       for idx, i in enumerate(intents) if idx not in invocations}
+            handled |= zip(invocations, toolExecutor.executor.run(
+                [intents[idx]['content'] for idx in invocations],
+                lambda args: self.handleIntent('invocation', args), self.cancelled))
+
             intent_results = []
-            for i in current_response['intents']:
-                intent_result = self.handleIntent(i['name'], i['content'])
+            for idx in range(len(intents)):
+                intent_result = handled[idx]
                 if intent_result and 'result' in intent_result:
-                    intent_results.append(intent_result['result'])
+                    intent_results.append((intent_result['result'], intents[idx]['content']))
                 elif intent_result:
-                    intent_results.append(intent_result)
+                    intent_results.append((intent_result, intents[idx]['content']))
             
+            if self.cancelled.is_set():
+                break
             if intent_results:
-                prompt = [r.asModelInput() if isinstance(
-                    r, workflowTools.ToolResponse) else str(r) for r in intent_results]
+                prompt = [self.resultAsModelInput(r, args, current_response['response']) for r, args in intent_results]
                 current_response = self.parseRawResponse(self.llm.chat(prompt))
                 self.trigger('intermediate_response', current_response['response'])
             else:
@@ -7,7 +7,9 @@ import flask
 from flask_cors import CORS, cross_origin
 from flask_socketio import SocketIO, emit
 import time
+import typing
 import eventlet
+import werkzeug.wsgi
 import livekit.api.room_service
 import Tha4Api
 from AIDubMiddlewareAPI import AIDubMiddlewareAPI
@@ -48,47 +50,155 @@ def Result(status, data):
     }
 
 
-def parseRequestRange(s, flen):
-    s = s[s.find('=')+1:]
-    c = s.split('-')
-    if len(c) != 2:
+def parseRequestRanges(s: str, flen: int) -> list[tuple[int, int]] | None:
+    """
+    Parse the value of a `Range` header.
+
+    Args:
+        s (str): Value of the header.
+        flen (int): Length of the requested file.
+
+    Returns:
+        list[tuple[int, int]] | None: Inclusive byte ranges, an empty list if none of them is satisfiable,
+        or None if the header is malformed and should be ignored.
+    """
+    if not s.startswith('bytes='):
         return None
+
+    ranges = []
+    for part in s[s.find('=')+1:].split(','):
+        start, sep, end = part.strip().partition('-')
+        if not sep or (start == '' and end == ''):
+            return None
+        try:
+            if start == '':
+                # suffix range: last n bytes
+                length = int(end)
+                if length > 0 and flen > 0:
+                    ranges.append((max(flen - length, 0), flen - 1))
+            else:
+                start = int(start)
+                end = flen - 1 if end == '' else min(int(end), flen - 1)
+                if start <= end:
+                    ranges.append((start, end))
+        except ValueError:
+            return None
+    return ranges
+
+
+def iterFileRange(file: typing.BinaryIO, start: int, end: int, chunkSize: int = 64 * 1024) -> typing.Iterator[bytes]:
+    file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = file.read(min(chunkSize, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def checkNotModified(etag: str | None, lastModified: int | None) -> bool:
+    ifNoneMatch = flask.request.headers.get('If-None-Match')
+    if ifNoneMatch is not None:
+        if etag is None:
+            return False
+        tags = [i.strip().removeprefix('W/') for i in ifNoneMatch.split(',')]
+        return '*' in tags or f'"{etag}"' in tags
+
+    ifModifiedSince = flask.request.if_modified_since
+    if ifModifiedSince is not None and lastModified is not None:
+        return int(lastModified) <= ifModifiedSince.timestamp()
+    return False
+
+
+def makeStreamResponse(file: typing.BinaryIO, mime: str, etag: str | None = None, lastModified: int | None = None, cacheControl: str | None = None):
+    """
+    Make a streamed response for a seekable file object, reading only the requested byte ranges.
+
+    Supports single and multiple ranges, `ETag`/`Last-Modified` validators and conditional requests.
+    The file is closed once the response is finished.
+
+    Args:
+        file (typing.BinaryIO): Seekable file object to send.
+        mime (str): Mime type of the file.
+        etag (str | None, optional): Strong entity tag of the file. Defaults to None.
+        lastModified (int | None, optional): Modification time of the file as unix timestamp. Defaults to None.
+        cacheControl (str | None, optional): Value of the `Cache-Control` header. Defaults to None.
+    """
+    fileLength = file.seek(0, os.SEEK_END)
+    file.seek(0)
+
+    def finish(response: flask.Response) -> flask.Response:
+        response.headers['Accept-Ranges'] = 'bytes'
+        if etag is not None:
+            response.set_etag(etag)
+        if lastModified is not None:
+            response.last_modified = int(lastModified)
+        if cacheControl is not None:
+            response.headers['Cache-Control'] = cacheControl
+        if mime.startswith('application'):
+            response.headers['Content-Disposition'] = "attachment;"
+        return response
+
+    if checkNotModified(etag, lastModified):
+        file.close()
+        return finish(flask.Response(status=304))
+
+    reqRanges = None
+    if flask.request.headers.get('Range') is not None:
+        ifRange = flask.request.headers.get('If-Range')
+        if ifRange is None or (etag is not None and ifRange.strip() == f'"{etag}"'):
+            reqRanges = parseRequestRanges(
+                flask.request.headers.get('Range'), fileLength)
+
+    if reqRanges is None:
+        # let the server use its file wrapper (sendfile for real files)
+        response = flask.Response(werkzeug.wsgi.wrap_file(
+            flask.request.environ, file), mimetype=mime, direct_passthrough=True)
+        response.content_length = fileLength
+        return finish(response)
+
+    if not reqRanges:
+        file.close()
+        response = flask.Response(status=416)
+        response.headers['Content-Range'] = f'bytes */{fileLength}'
+        return finish(response)
+
+    if len(reqRanges) == 1:
+        start, end = reqRanges[0]
+        response = flask.Response(iterFileRange(
+            file, start, end), status=206, mimetype=mime, direct_passthrough=True)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{fileLength}'
+        response.content_length = end - start + 1
     else:
-        if c[0] == '' and c[1] == '':
-            return [0, flen - 1]
-        elif c[1] == '':
-            return [int(c[0]), flen - 1]
-        elif c[0] == '':
-            return [flen - int(c[1]) - 1, flen - 1]
-        else:
-            return [int(i) for i in c]
+        boundary = uuid.uuid4().hex
+        partHeaders = [
+            f'--{boundary}\r\nContent-Type: {mime}\r\nContent-Range: bytes {start}-{end}/{fileLength}\r\n\r\n'.encode() for start, end in reqRanges]
+        closing = f'--{boundary}--\r\n'.encode()
 
+        def multipart():
+            for header, (start, end) in zip(partHeaders, reqRanges):
+                yield header
+                yield from iterFileRange(file, start, end)
+                yield b'\r\n'
+            yield closing
 
-def makeFileResponse(file: bytes, mime: str):
-    isPreview = not mime.startswith('application')
-    if flask.request.headers.get('Range') != None:
-        fileLength = len(file)
-        reqRange = parseRequestRange(
-            flask.request.headers.get('Range'), fileLength)
+        response = flask.Response(multipart(), status=206,
+                                  content_type=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
+        response.content_length = sum(len(i) + end - start + 1 + 2 for i, (start, end) in zip(
+            partHeaders, reqRanges)) + len(closing)
 
-        response_file = bytes()
+    response.call_on_close(file.close)
+    return finish(response)
 
-        response_file = file[reqRange[0]:reqRange[1]
-                             if reqRange[0] != reqRange[1] else reqRange[1] + 1]
 
-        response = flask.make_response(response_file)
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Range'] = 'bytes ' + \
-            str(reqRange[0]) + '-' + \
-            str(reqRange[1]) + '/' + str(fileLength)
-        response.headers['Content-Type'] = mime
-        if response.headers['Content-Type'].startswith('application'):
-            response.headers['Content-Disposition'] = "attachment;"
+def makeFileResponse(file: bytes, mime: str, etag: str | None = None, lastModified: int | None = None, cacheControl: str | None = None):
+    return makeStreamResponse(BytesIO(file), mime, etag, lastModified, cacheControl)
 
-        response.status_code = 206
-        return response
 
-    return flask.send_file(BytesIO(file), as_attachment=not isPreview, mimetype=mime)
+def makeCachedImageResponse(image: tuple[str, bytes, str]):
+    mime, file, etag = image
+    return makeFileResponse(file, mime, etag, cacheControl=config.IMAGE_CACHE_CONTROL)
 
 
 def authenticateSession() -> int:
@@ -100,7 +210,6 @@ def authenticateSession() -> int:
 
 @app.after_request
 def afterRequst(f):
-    dProvider.db.db.commit()
     f.headers.add('Access-Control-Allow-Credentials', 'true')
     return f
 
@@ -207,7 +316,15 @@ def socketChatMessage(data):
     client_sid = flask.session.get('sid', None)
     
     session = chatbotManager.getSessionByClient(client_sid)
-    session.sendMessage(data['msgChain'])
+    if session is None:
+        socket.emit('error', 'invalid session', room=client_sid, namespace="/chat")
+        return
+    try:
+        session.sendMessage(data['msgChain'])
+    except Exception as e:
+        # the message is saved, the reply failed after its retries or while it was streamed
+        logger.Logger.log(f'Failed to reply: {e}')
+        socket.emit('error', f'failed to reply: {e}', room=client_sid, namespace="/chat")
 
 @app.route("/api/v1/chat/keep_alive", methods=["POST"])
 def chatKeepAlive():
@@ -293,8 +410,24 @@ def attachmentDownload(attachmentId: str):
     if not dProvider.checkIfInitialized():
         return Result(False, 'not initialized')
 
-    mime, file = dProvider.getAttachment(attachmentId)
-    return makeFileResponse(file, mime)
+    info = dProvider.getAttachmentInfo(attachmentId)
+    if info is None:
+        return Result(False, 'attachment not exist')
+
+    mime, file = dProvider.openAttachment(attachmentId)
+    # attachments are immutable, legacy rows fall back to the attachment id
+    return makeStreamResponse(file, mime, info['blobHash'] or info['id'], info['timestamp'])
+
+
+@app.route("/api/v1/attachment/migrate", methods=["POST"])
+def attachmentMigrate():
+    if not authenticateSession():
+        return Result(False, 'not authenticated')
+    if not dProvider.checkIfInitialized():
+        return Result(False, 'not initialized')
+
+    data = flask.request.get_json(silent=True) or {}
+    return Result(True, taskManager.runAttachmentMigration(vacuum=bool(data.get('vacuum', True))))
 
 
 @app.route("/api/v1/char/<id>/info", methods=["POST"])
@@ -321,8 +454,10 @@ def charAvatar(id):
     if not dProvider.checkIfInitialized():
         return Result(False, 'not initialized')
 
-    mime, file = dProvider.getCharacterAvatar(int(id))
-    return makeFileResponse(file, mime)
+    image = dProvider.getCachedCharacterAvatar(int(id))
+    if image is None:
+        return Result(False, 'character not exist')
+    return makeCachedImageResponse(image)
 
 
 @app.route("/api/v1/char/<id>/edit", methods=["POST"])
@@ -355,7 +490,7 @@ def charEdit(id):
         return Result(False, f'invalid form: {str(e)}')
 
     dProvider.updateCharacter(
-        int(id), charName, useTTSModel, useStickerSet, charPrompt, pastMemories, exampleChats, tha4Service)
+        int(id), charName, useTTSModel, useStickerSet, charPrompt, pastMemories, exampleChats, tha4Service, reindexMemories=True)
 
     return Result(True, 'success')
 
@@ -405,6 +540,37 @@ def charHistory(id, offset):
     return Result(True, dProvider.fetchChatHistory(int(id), int(offset)))
 
 
+@app.route("/api/v1/char/<id>/history", methods=["POST"])
+def charHistoryPage(id):
+    if not authenticateSession():
+        return Result(False, 'not authenticated')
+    if not dProvider.checkIfInitialized():
+        return Result(False, 'not initialized')
+
+    try:
+        data = flask.request.get_json(silent=True) or {}
+        return Result(True, dProvider.fetchChatHistoryPage(int(id), data.get('cursor'), int(data.get('limit', 24)), data.get('direction', 'backward')))
+    except ValueError as e:
+        return Result(False, f'invalid form: {str(e)}')
+
+
+@app.route("/api/v1/char/<id>/search", methods=["POST"])
+def charSearch(id):
+    if not authenticateSession():
+        return Result(False, 'not authenticated')
+    if not dProvider.checkIfInitialized():
+        return Result(False, 'not initialized')
+
+    try:
+        data = flask.request.get_json()
+        query = data['query']
+        limit = int(data.get('limit', 20))
+    except Exception as e:
+        return Result(False, f'invalid form: {str(e)}')
+
+    return Result(True, dProvider.searchHistory(int(id), query, limit))
+
+
 @app.route("/api/v1/char/<id>/avatar/update", methods=["POST"])
 def charAvatarUpdate(id):
     if not authenticateSession():
@@ -436,8 +602,7 @@ def avatar():
     if not dProvider.checkIfInitialized():
         return Result(False, 'not initialized')
 
-    mime, avatarBlob = dProvider.getAvatar()
-    return makeFileResponse(avatarBlob, mime)
+    return makeCachedImageResponse(dProvider.getCachedAvatar())
 
 
 @app.route("/api/v1/sticker/create_set", methods=["POST"])
@@ -537,8 +702,7 @@ def stickerGet():
         return Result(False, f'invalid form: {str(e)}')
 
     try:
-        mime, blob = dProvider.getSticker(setId, stickerName)
-        return makeFileResponse(blob, mime)
+        return makeCachedImageResponse(dProvider.getCachedSticker(setId, stickerName))
     except exceptions.StickerNotFound as e:
         with open(f'./emotionPack/yoimiya/awkward.png', 'rb+') as file:
             b = file.read()
@@ -609,6 +773,25 @@ def stickerList():
     return Result(True, dProvider.getStickerList(setId))
 
 
+@app.route("/api/v1/sticker/keywords", methods=["POST"])
+def stickerKeywords():
+    if not authenticateSession():
+        return Result(False, 'not authenticated')
+    if not dProvider.checkIfInitialized():
+        return Result(False, 'not initialized')
+
+    stickerId = 0
+    keywords = []
+    try:
+        stickerId = flask.request.json['stickerId']
+        keywords = [str(i) for i in flask.request.json['keywords']]
+    except Exception as e:
+        return Result(False, f'invalid form: {str(e)}')
+
+    dProvider.updateStickerKeywords(stickerId, keywords)
+    return Result(True, None)
+
+
 @app.route("/api/v1/tts/service/create", methods=["POST"])
 def ttsCreate():
     if not authenticateSession():
@@ -1248,10 +1431,12 @@ def list_tha4_service():
 def get_tha4_service_avatar(service_id: int):
     if authenticateSession() == -1:
         return Result(False, 'Not authenticated')
-    r = dProvider.getTHA4ServiceAvatar(service_id)
+    r = dProvider.getCachedTHA4ServiceAvatar(service_id)
     if r is None:
         return Result(False, 'Invalid id')
-    return flask.send_file(BytesIO(r), mimetype='image/png', download_name='avatar.png', as_attachment=True)
+    response = makeCachedImageResponse(r)
+    response.headers['Content-Disposition'] = 'attachment; filename=avatar.png'
+    return response
 
 
 @app.route('/api/v1/tha4_middleware/service/set_avatar/<int:service_id>', methods=['POST'])
@@ -1276,7 +1461,7 @@ def character_generator():
         return Result(False, 'Invalid request')
     try:
         generator = characterGenerator.CharacterGenerator(dProvider)
-        return Result(True, generator.generate(data['name']))
+        return Result(True, generator.generate(data['name'], bool(data.get('useCache', False))))
     except Exception as e:
         # return Result(False, f'Error: {str(e)}')
         raise e
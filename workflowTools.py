@@ -5,7 +5,6 @@ import chatModel
 import pathlib
 import requests
 import bs4
-import googleapiclient.discovery
 import tools
 import urllib.parse
 import typing
@@ -14,8 +13,12 @@ import logger
 import subprocess
 import sys
 import importlib
+import functools
 import google.genai.types
 import config
+import webFetcher
+import searchEngine
+import toolOutputBudgeter
 
 class ToolResponse:
     def __init__(self, content: typing.Any, type: str = 'text/plain'):
@@ -82,54 +85,10 @@ def WebsiteReader(url: str) -> dict[str, list[dict] | str]:
 
     Returns:
         dict[str, list[dict] | str]: A dictionary containing the website content and links as a list of dictionaries.
-        For key `content`, the value is the text content of the website. For key `links`, the value is a list of dictionaries
+        For key `content`, the value is the main text content of the website. For key `links`, the value is a list of dictionaries
     """
-    userAgent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:137.0) Gecko/20100101 Firefox/137.0'
-    
-    def get_website_content(url: str) -> bytes:
-        resp = requests.get(url, headers={'User-Agent': userAgent}, timeout=1240)
-        if resp.status_code != 200:
-            raise Exception(f'Failed to read website {url}. Status code: {resp.status_code}. You may retry later.')
-        return resp
-    
-    resp = tools.retryWrapper(lambda: get_website_content(url), max_retries=5, retry_interval=1)
-    
-    print(resp)
-    content = resp.content
-    soup = bs4.BeautifulSoup(content, 'html.parser')
-    if 'fandom.com' in url:
-        # get the .page section of the fandom page
-        page_soup = soup.find('div', class_='page')
-        if page_soup:
-            soup = page_soup
-
-    all_text = soup.get_text()
-
-    gathered_links = []
-    for link in soup.find_all('a'):
-        text = link.parent.get_text()
-        href = link.get('href')
-        if href:
-            if href.startswith('http'):
-                gathered_links.append({
-                    'content': text,
-                    'url': href,
-                })
-            elif href.startswith('/'):
-                # extract the host from url and add the href to it
-                new_url = urllib.parse.urljoin(url, href)
-                gathered_links.append({
-                    'content': text,
-                    'url': new_url,
-                })
-            else:
-                # ignore relative links
-                pass
-
-    return TextResponse({
-        'content': all_text,
-        'links': gathered_links,
-    })
+    # the pages are fetched over a shared session, cached on disk and retried until a deadline, see webFetcher
+    return TextResponse(webFetcher.fetcher.read(url))
 
 
 def SearchEngine(query: str, page: int = 1) -> list[dict[str, str]]:
@@ -146,23 +105,27 @@ def SearchEngine(query: str, page: int = 1) -> list[dict[str, str]]:
         list[dict[str, str]]: A list of dictionaries containing the search results.
     """
 
-    # Set up the Google Custom Search API
-    api_key = os.environ.get('google_search_engine_key')
-    cse_id = os.environ.get('google_search_engine_cx_id')
-    service = googleapiclient.discovery.build(
-        'customsearch', 'v1', developerKey=api_key)
-
-    # Search for the query
-    res = service.cse().list(q=query, cx=cse_id, num=10, start=10*(page-1)).execute() # support page indexing
-    results = []
-    for item in res['items']:
-        title = item['title']
-        link = item['link']
-        snippet = item['snippet']
-        results.append({'title': title, 'link': link, 'snippet': snippet})
+    # the service is built once and results are cached, see searchEngine
+    results = searchEngine.engine.search(query, page)
     return TextResponse(results)
 
 
+def ToolOutputReader(outputId: str, query: str = '', page: int = 1) -> str:
+    """
+    Tool for reading more of a tool output which was truncated to its most relevant passages.
+    Use it with the outputId given in the truncation note when the shown passages are not enough.
+
+    Args:
+        outputId (str): The outputId from the truncation note.
+        query (str): What to look for in the output. Leave it empty to read the output in order. Defaults to ''.
+        page (int): The page of the passages to read. Defaults to 1.
+
+    Returns:
+        str: The passages of the page.
+    """
+    return TextResponse(toolOutputBudgeter.budgeter.read(outputId, query, page))
+
+
 def AvailableTools() -> list[typing.Callable]:
     """
     Returns a list of available tools.
@@ -174,6 +137,7 @@ def AvailableTools() -> list[typing.Callable]:
     return [
         WebsiteReader,
         SearchEngine,
+        ToolOutputReader,
     ]
 
 
@@ -237,6 +201,13 @@ def GetToolDescription(tool: typing.Callable) -> dict[str, str] | None:
     }
     
 
+# every session generates the descriptions of its tools, the built-in ones are the same every time.
+# user script functions are not memoized, the cache would keep them and their script alive
+@functools.lru_cache(maxsize=None)
+def GetBuiltinToolReadableDescription(tool: typing.Callable) -> str:
+    return FormatToolReadableDescription(tool)
+
+
 def GetToolReadableDescription(tool: typing.Callable) -> str:
     """
     Extract the method name, parameters and return type and description of a tool from callable definition and format it as a readable string.
@@ -246,7 +217,12 @@ def GetToolReadableDescription(tool: typing.Callable) -> str:
     Returns:
         str: A string containing the method name, parameters and return type and description of the tool.
     """
+    if tool in AvailableTools():
+        return GetBuiltinToolReadableDescription(tool)
+    return FormatToolReadableDescription(tool)
+
 
+def FormatToolReadableDescription(tool: typing.Callable) -> str:
     description = GetToolDescription(tool)
     desc = f'### {description['tool']}\n\n'
     desc += f'**Invocation name**: `{description["tool"]}`\n\n'